@@ -0,0 +1,50 @@
+from django.contrib import admin, messages
+from .models import Payment, Refund, WebhookEvent
+from .refunds import get_refund_engine
+
+
+@admin.action(description="Queue full refunds of selected payments")
+def refund_in_full(modeladmin, request, queryset):
+    """
+    Queue a refund of what is left of each selected payment
+
+    Only the pending bulk Refund rows are created here, so the admin
+    request never waits on Stripe; `manage.py bulk_refund --resume` (e.g.
+    from cron) sends them.
+    """
+    reason = f"Bulk refund by {request.user}"
+    refunds, skipped = get_refund_engine().create_refunds(
+        (payment_id, None, reason) for payment_id in queryset.values_list('id', flat=True)
+    )
+    modeladmin.message_user(
+        request,
+        f"Queued {len(refunds)} refunds, {len(skipped)} skipped; "
+        f"they are sent to Stripe by `manage.py bulk_refund --resume`",
+        messages.WARNING if skipped else messages.SUCCESS
+    )
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'amount', 'amount_refunded', 'currency', 'status', 'payment_intent_id', 'created_at')
+    list_filter = ('status', 'currency')
+    search_fields = ('order__order_number', 'payment_intent_id', 'transaction_id')
+    raw_id_fields = ('order',)
+    actions = [refund_in_full]
+
+
+@admin.register(Refund)
+class RefundAdmin(admin.ModelAdmin):
+    list_display = ('id', 'payment', 'amount', 'status', 'source', 'refund_id', 'created_at')
+    list_filter = ('status', 'source')
+    search_fields = ('payment__order__order_number', 'refund_id')
+    raw_id_fields = ('payment',)
+    readonly_fields = ('error_message',)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('event_id', 'payment_intent_id')
+    readonly_fields = ('payload', 'last_error')
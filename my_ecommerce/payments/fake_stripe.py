@@ -0,0 +1,237 @@
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def _decode(pairs):
+    """
+    Rebuild nested parameters from Stripe's form encoding
+    """
+    params = {}
+    for name, value in pairs:
+        keys = name.replace(']', '').split('[')
+        target = params
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return params
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; don't let Nagle delay them
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (e.g. a read timeout)
+            pass
+
+    def _error(self, status, message, error_type='invalid_request_error', headers=None):
+        self._send(status, {'error': {'type': error_type, 'message': message}}, headers)
+
+    def _handle(self, method):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        url = urlsplit(self.path)
+        params = _decode(parse_qsl(url.query if method == 'GET' else body))
+
+        with fake.lock:
+            fake.requests += 1
+            failure = fake.next_failure()
+        if fake.latency:
+            time.sleep(fake.latency)
+        if failure:
+            self._error(failure, 'Injected failure', 'api_error')
+            return
+
+        if self.headers.get('Authorization') != f"Bearer {fake.api_key}":
+            self._error(401, 'Invalid API Key provided', 'authentication_error')
+            return
+
+        key = self.headers.get('Idempotency-Key') if method == 'POST' else None
+        if key:
+            with fake.lock:
+                replay = fake.idempotency.get(key)
+            if replay is not None:
+                if replay[0] != (url.path, params):
+                    self._error(400, 'Keys for idempotent requests can only be used with the same parameters',
+                                'idempotency_error')
+                    return
+                self._send(replay[1], replay[2], {'Idempotent-Replayed': 'true'})
+                return
+
+        status, result = fake.route(method, url.path, params)
+        if key and status < 500:
+            with fake.lock:
+                fake.idempotency[key] = ((url.path, params), status, result)
+        self._send(status, result)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class FakeStripeServer:
+    """
+    In-process stand-in for the parts of the Stripe API the shop uses
+
+    Serves PaymentIntent create/retrieve/update and refund creation over
+    HTTP, honors Idempotency-Key like Stripe does, and can inject latency
+    and 5xx failures to exercise timeouts, retries and the circuit breaker.
+
+    Args:
+        api_key: Secret key clients must send
+        port: Port to listen on, 0 for any free port
+        latency: Seconds added to every response
+        failure_rate: Share of requests answered with HTTP 500
+        seed: Random seed for failure injection
+    """
+
+    def __init__(self, api_key='sk_test_fake', host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, seed=None):
+        self.api_key = api_key
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.forced_failures = []
+        self.idempotency = {}
+        self.payment_intents = {}
+        self.refunds = {}
+        self.httpd = ThreadingHTTPServer((host, port), FakeStripeHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fail_next(self, count=1, status=500):
+        """
+        Answer the next `count` requests with `status`
+        """
+        with self.lock:
+            self.forced_failures.extend([status] * count)
+
+    def next_failure(self):
+        if self.forced_failures:
+            return self.forced_failures.pop(0)
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            return 500
+        return None
+
+    def route(self, method, path, params):
+        parts = path.strip('/').split('/')
+        if parts[:2] == ['v1', 'payment_intents']:
+            if len(parts) == 2 and method == 'POST':
+                return self.create_payment_intent(params)
+            if len(parts) == 3:
+                intent = self.payment_intents.get(parts[2])
+                if intent is None:
+                    return 404, {'error': {'type': 'invalid_request_error', 'code': 'resource_missing',
+                                           'message': f"No such payment_intent: '{parts[2]}'"}}
+                if method == 'POST':
+                    return self.update_payment_intent(intent, params)
+                return 200, intent
+        if parts == ['v1', 'refunds'] and method == 'POST':
+            return self.create_refund(params)
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f"Unrecognized request URL ({path})"}}
+
+    def create_payment_intent(self, params):
+        if not str(params.get('amount', '')).isdigit():
+            return 400, {'error': {'type': 'invalid_request_error', 'code': 'parameter_missing',
+                                   'message': 'Missing required param: amount.'}}
+        intent_id = f"pi_{secrets.token_hex(12)}"
+        intent = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(params['amount']),
+            'currency': params.get('currency', 'usd'),
+            'description': params.get('description'),
+            'metadata': params.get('metadata', {}),
+            'status': 'requires_payment_method',
+            'client_secret': f"{intent_id}_secret_{secrets.token_hex(8)}",
+            'created': int(time.time()),
+        }
+        with self.lock:
+            self.payment_intents[intent_id] = intent
+        return 200, intent
+
+    def update_payment_intent(self, intent, params):
+        if intent['status'] in ('succeeded', 'canceled'):
+            return 400, {'error': {'type': 'invalid_request_error', 'code': 'payment_intent_unexpected_state',
+                                   'message': f"This PaymentIntent's status is {intent['status']}."}}
+        with self.lock:
+            if 'amount' in params:
+                intent['amount'] = int(params['amount'])
+            if 'metadata' in params:
+                intent['metadata'].update(params['metadata'])
+            if 'description' in params:
+                intent['description'] = params['description']
+        return 200, intent
+
+    def create_refund(self, params):
+        intent = self.payment_intents.get(params.get('payment_intent'))
+        if intent is None:
+            return 400, {'error': {'type': 'invalid_request_error', 'code': 'resource_missing',
+                                   'message': f"No such payment_intent: '{params.get('payment_intent')}'"}}
+        refund_id = f"re_{secrets.token_hex(12)}"
+        refund = {
+            'id': refund_id,
+            'object': 'refund',
+            'amount': int(params.get('amount') or intent['amount']),
+            'payment_intent': intent['id'],
+            'metadata': params.get('metadata', {}),
+            'status': 'succeeded',
+            'created': int(time.time()),
+        }
+        with self.lock:
+            self.refunds[refund_id] = refund
+        return 200, refund
+
+    def succeed(self, payment_intent_id):
+        """
+        Mark a PaymentIntent paid, as if the customer had completed checkout
+        """
+        with self.lock:
+            self.payment_intents[payment_intent_id]['status'] = 'succeeded'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-stripe', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
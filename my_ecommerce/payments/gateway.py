@@ -0,0 +1,329 @@
+import logging
+import random
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = '2023-10-16'
+
+
+class PaymentGatewayError(Exception):
+    """
+    A Stripe call failed
+
+    Attributes:
+        status: HTTP status of the response, None for network errors
+        code: Stripe error code when the API returned one
+        retryable: Whether repeating the call (with the same idempotency
+            key) may succeed
+    """
+
+    def __init__(self, message, status=None, code=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.retryable = retryable
+
+
+class CircuitOpenError(PaymentGatewayError):
+    """
+    Raised without calling Stripe while the circuit breaker is open
+    """
+
+    def __init__(self, retry_in):
+        super().__init__(
+            f"Payment gateway unavailable, retry in {retry_in:.0f}s",
+            retryable=True
+        )
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Fail fast after repeated gateway failures
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are refused for `reset_timeout` seconds. Then one trial call is
+    let through (half-open): success closes the circuit, failure opens it
+    again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go ahead
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == 'open' and retry_in <= 0:
+                # Let this one call probe the gateway
+                self.state = 'half_open'
+                return
+            raise CircuitOpenError(max(retry_in, 0))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opened_count += 1
+                    logger.error(f"Payment gateway circuit opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+def _encode(params, prefix=None):
+    """
+    Flatten parameters into Stripe's form encoding (metadata[key]=value)
+    """
+    pairs = []
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else key
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            pairs.extend(_encode(value, name))
+        elif isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                pairs.extend(_encode({str(index): item}, name))
+        elif isinstance(value, bool):
+            pairs.append((name, 'true' if value else 'false'))
+        else:
+            pairs.append((name, str(value)))
+    return pairs
+
+
+class StripeClient:
+    """
+    Stripe API client over one persistent, pooled HTTP session
+
+    Every call has a connect/read timeout, POSTs always carry an
+    idempotency key so they can be retried safely, transient failures
+    (network errors, 409, 429, 5xx) are retried up to `max_retries` times
+    with jittered exponential backoff, and a circuit breaker refuses calls
+    while the gateway keeps failing.
+
+    Args:
+        api_key: Stripe secret key
+        api_base: API root, e.g. a fake Stripe server in tests
+        timeout: (connect, read) timeout in seconds
+        max_retries: Retries after the first attempt
+        backoff: Base delay in seconds between retries
+        backoff_max: Maximum delay in seconds between retries
+        pool_size: Connections kept open to the API host
+        breaker: CircuitBreaker instance
+    """
+
+    def __init__(self, api_key, api_base='https://api.stripe.com', timeout=(3.05, 10.0), max_retries=2,
+                 backoff=0.25, backoff_max=2.0, pool_size=20, breaker=None):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f"Bearer {api_key}",
+            'Stripe-Version': API_VERSION,
+        })
+
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'attempts': 0, 'retries': 0, 'failures': 0, 'rejected': 0}
+        self.total_seconds = 0.0
+
+    def _count(self, name, seconds=None):
+        with self._lock:
+            self.counters[name] += 1
+            if seconds is not None:
+                self.total_seconds += seconds
+
+    def _delay(self, attempt, response=None):
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(float(response.headers['Retry-After']), self.backoff_max)
+        delay = min(self.backoff * 2 ** attempt, self.backoff_max)
+        return random.uniform(delay / 2, delay)
+
+    def _error(self, response):
+        try:
+            error = response.json().get('error', {})
+        except ValueError:
+            error = {}
+        should_retry = response.headers.get('Stripe-Should-Retry')
+        if should_retry is not None:
+            retryable = should_retry == 'true'
+        else:
+            retryable = response.status_code in (409, 429) or response.status_code >= 500
+        return PaymentGatewayError(
+            error.get('message') or f"Stripe returned HTTP {response.status_code}",
+            status=response.status_code,
+            code=error.get('code') or error.get('type'),
+            retryable=retryable
+        )
+
+    def request(self, method, path, params=None, idempotency_key=None, timeout=None):
+        """
+        Call the API and return the decoded JSON object
+
+        Raises:
+            PaymentGatewayError: The call failed (after retries)
+            CircuitOpenError: The circuit breaker refused the call
+        """
+        headers = {}
+        if method == 'POST':
+            headers['Idempotency-Key'] = idempotency_key or f"auto-{uuid.uuid4().hex}"
+        data = _encode(params or {})
+        url = f"{self.api_base}{path}"
+        self._count('calls')
+
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count('rejected')
+                raise
+
+            started = time.perf_counter()
+            response = None
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    params=data if method == 'GET' else None,
+                    data=data if method != 'GET' else None,
+                    headers=headers,
+                    timeout=timeout or self.timeout
+                )
+                if response.status_code < 400:
+                    self._count('attempts', time.perf_counter() - started)
+                    self.breaker.record_success()
+                    return response.json()
+                error = self._error(response)
+            except requests.RequestException as e:
+                error = PaymentGatewayError(f"Network error calling Stripe: {str(e)}", retryable=True)
+            except BaseException:
+                # Anything else still ends the attempt; a half-open circuit
+                # would otherwise wait for this probe's outcome forever
+                self._count('attempts', time.perf_counter() - started)
+                self.breaker.record_failure()
+                raise
+            self._count('attempts', time.perf_counter() - started)
+
+            # Only trouble on the gateway's side counts against the circuit
+            if error.status is None or error.status >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            if not error.retryable or attempt >= self.max_retries:
+                self._count('failures')
+                logger.error(f"Stripe {method} {path} failed after {attempt + 1} attempts: {str(error)}")
+                raise error
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+            self._count('retries')
+
+    def create_payment_intent(self, amount, currency, metadata=None, description=None, idempotency_key=None):
+        return self.request('POST', '/v1/payment_intents', {
+            'amount': amount,
+            'currency': currency,
+            'metadata': metadata,
+            'description': description,
+        }, idempotency_key=idempotency_key)
+
+    def retrieve_payment_intent(self, payment_intent_id):
+        return self.request('GET', f"/v1/payment_intents/{payment_intent_id}")
+
+    def update_payment_intent(self, payment_intent_id, idempotency_key=None, **params):
+        return self.request('POST', f"/v1/payment_intents/{payment_intent_id}", params, idempotency_key=idempotency_key)
+
+    def create_refund(self, payment_intent, amount=None, metadata=None, idempotency_key=None):
+        return self.request('POST', '/v1/refunds', {
+            'payment_intent': payment_intent,
+            'amount': amount,
+            'metadata': metadata,
+        }, idempotency_key=idempotency_key)
+
+    def stats(self):
+        """
+        Call counters, mean attempt latency and circuit state
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            attempts = stats['attempts']
+            stats['mean_attempt_ms'] = round(self.total_seconds * 1000 / attempts, 2) if attempts else None
+        stats['circuit'] = self.breaker.state
+        stats['circuit_opened'] = self.breaker.opened_count
+        return stats
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_stripe_client():
+    """
+    Get this process's shared Stripe client, configured from settings
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = StripeClient(
+                    settings.STRIPE_SECRET_KEY,
+                    api_base=getattr(settings, 'STRIPE_API_BASE', 'https://api.stripe.com'),
+                    timeout=(
+                        getattr(settings, 'STRIPE_CONNECT_TIMEOUT', 3.05),
+                        getattr(settings, 'STRIPE_READ_TIMEOUT', 10.0)
+                    ),
+                    max_retries=getattr(settings, 'STRIPE_MAX_RETRIES', 2),
+                    pool_size=getattr(settings, 'STRIPE_POOL_SIZE', 20),
+                    breaker=CircuitBreaker(
+                        failure_threshold=getattr(settings, 'STRIPE_BREAKER_THRESHOLD', 5),
+                        reset_timeout=getattr(settings, 'STRIPE_BREAKER_RESET', 30.0)
+                    )
+                )
+    return _client
+
+
+def payment_intent_key(payment):
+    """
+    Idempotency key of a payment's current PaymentIntent creation attempt
+
+    The attempt counter makes every new intent for a payment use a fresh
+    key, so a key is never replayed after the amount has changed.
+    """
+    return f"payment-{payment.id}-intent-{payment.intent_attempts}"
+
+
+def refund_key(refund):
+    """
+    Idempotency key of a refund request
+    """
+    return f"refund-{refund.id}"
@@ -0,0 +1,228 @@
+import datetime
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.utils import timezone
+from products.models import Product
+from .models import ReservedStock, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when an order asks for more of some products than is available
+
+    Attributes:
+        shortages: Dictionary of product ID -> (requested, available)
+    """
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        products = ', '.join(str(product_id) for product_id in sorted(shortages))
+        super().__init__(f"Insufficient stock for products {products}")
+
+
+def get_reservation_ttl():
+    return datetime.timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60))
+
+
+def order_quantities(order):
+    """
+    Quantity ordered of each product as {product_id: quantity}
+    """
+    return dict(
+        order.items.values_list('product_id').annotate(total=Sum('quantity')).order_by()
+    )
+
+
+def _shortages(quantities, available):
+    return {
+        product_id: (quantity, max(available.get(product_id, 0), 0))
+        for product_id, quantity in quantities.items()
+        if available.get(product_id, 0) < quantity
+    }
+
+
+def _per_product(values, field):
+    return Case(
+        *[When(**{field: product_id, 'then': Value(value)}) for product_id, value in values.items()],
+        default=Value(0),
+        output_field=IntegerField()
+    )
+
+
+def _release(reservations):
+    """
+    Delete reservations and take their quantities off ReservedStock
+
+    The reservation rows are locked first, so a hold released concurrently
+    (e.g. by the sweep and a payment at once) is only subtracted once.
+    """
+    with transaction.atomic():
+        held = list(reservations.select_for_update().values_list('id', 'product_id', 'quantity'))
+        if not held:
+            return 0
+        totals = {}
+        for reservation_id, product_id, quantity in held:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        StockReservation.objects.filter(id__in=[reservation_id for reservation_id, _, _ in held]).delete()
+        ReservedStock.objects.filter(product_id__in=list(totals)).update(
+            quantity=F('quantity') - _per_product(totals, 'product_id')
+        )
+    return len(held)
+
+
+def decrement_stock(order, quantities=None):
+    """
+    Take an order's items out of stock and release its reservations
+
+    All products are decremented by a single conditional UPDATE in one
+    transaction: either every product had enough stock and all of them are
+    decremented, or InsufficientStock is raised and nothing is changed.
+    The database applies each decrement against the current row, so
+    concurrent orders cannot lose each other's updates.
+
+    Args:
+        order: Order whose items are taken out of stock
+        quantities: Optional precomputed {product_id: quantity}
+
+    Returns:
+        Dictionary of product ID -> quantity taken out of stock
+    """
+    if quantities is None:
+        quantities = order_quantities(order)
+    if not quantities:
+        return {}
+
+    enough = Q()
+    for product_id, quantity in quantities.items():
+        enough |= Q(id=product_id, stock__gte=quantity)
+
+    with transaction.atomic():
+        updated = Product.objects.filter(enough).update(stock=F('stock') - _per_product(quantities, 'id'))
+        if updated == len(quantities):
+            _release(StockReservation.objects.filter(order=order))
+            return quantities
+        transaction.set_rollback(True)
+
+    # Read after the rollback so the reported stock is untouched
+    available = dict(Product.objects.filter(id__in=list(quantities)).values_list('id', 'stock'))
+    raise InsufficientStock(_shortages(quantities, available))
+
+
+def _claim(quantities):
+    """
+    Add quantities to ReservedStock where they fit within stock
+
+    One conditional UPDATE: the database checks each product's reserved
+    total against its stock under the row lock it takes for the update,
+    so concurrent checkouts are serialized per product and can never
+    reserve more than is in stock together.
+
+    Returns:
+        Whether every product had room
+    """
+    stock = Subquery(Product.objects.filter(id=OuterRef('product_id')).values('stock')[:1])
+    room = Q()
+    for product_id, quantity in quantities.items():
+        room |= Q(product_id=product_id, quantity__lte=stock - quantity)
+    updated = ReservedStock.objects.filter(room).update(
+        quantity=F('quantity') + _per_product(quantities, 'product_id')
+    )
+    return updated == len(quantities)
+
+
+def reserve_stock(order, ttl=None):
+    """
+    Hold an order's items for `ttl` (default STOCK_RESERVATION_TTL seconds)
+
+    The holds are claimed against each product's ReservedStock total by a
+    single conditional UPDATE, in the same transaction that stores the
+    StockReservation rows: either every product has room and all holds
+    are placed, or InsufficientStock is raised and nothing is changed.
+    Only the counter rows of the products being reserved are locked, and
+    only until the transaction commits.
+
+    Any earlier holds of the order are replaced. Expired holds still count
+    until they are released; when they are what stands in the way, they
+    are released and the reservation is tried once more.
+
+    Returns:
+        Expiry time of the holds, or None for an order without items
+    """
+    quantities = order_quantities(order)
+    if not quantities:
+        return None
+
+    ReservedStock.objects.bulk_create(
+        [ReservedStock(product_id=product_id) for product_id in quantities],
+        ignore_conflicts=True
+    )
+    expires_at = timezone.now() + (ttl or get_reservation_ttl())
+    for attempt in range(2):
+        with transaction.atomic():
+            _release(StockReservation.objects.filter(order=order))
+            if _claim(quantities):
+                StockReservation.objects.bulk_create([
+                    StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                    for product_id, quantity in quantities.items()
+                ])
+                return expires_at
+            transaction.set_rollback(True)
+        if attempt or not release_expired_reservations(product_ids=list(quantities)):
+            break
+
+    # Read after the rollback; the order's own earlier holds don't count against it
+    stock = dict(Product.objects.filter(id__in=list(quantities)).values_list('id', 'stock'))
+    reserved = dict(
+        ReservedStock.objects.filter(product_id__in=list(quantities)).values_list('product_id', 'quantity')
+    )
+    own = dict(
+        StockReservation.objects.filter(order=order).values_list('product_id').annotate(total=Sum('quantity')).order_by()
+    )
+    available = {
+        product_id: stock.get(product_id, 0) - reserved.get(product_id, 0) + own.get(product_id, 0)
+        for product_id in quantities
+    }
+    raise InsufficientStock(_shortages(quantities, available))
+
+
+def release_reservations(order):
+    """
+    Drop an order's stock holds
+
+    Returns:
+        Number of reservations released
+    """
+    return _release(StockReservation.objects.filter(order=order))
+
+
+def release_expired_reservations(batch_size=5000, product_ids=None):
+    """
+    Release expired reservations in batches of `batch_size` rows
+
+    Expired holds keep counting against stock until they are released, so
+    run this every minute or so.
+
+    Args:
+        batch_size: Reservations released per transaction
+        product_ids: Only release holds on these products
+
+    Returns:
+        Number of reservations released
+    """
+    now = timezone.now()
+    expired = StockReservation.objects.filter(expires_at__lte=now)
+    if product_ids is not None:
+        expired = expired.filter(product_id__in=list(product_ids))
+    total = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        total += _release(StockReservation.objects.filter(id__in=ids, expires_at__lte=now))
+    if total:
+        logger.info(f"Released {total} expired stock reservations")
+    return total
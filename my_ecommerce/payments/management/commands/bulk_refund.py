@@ -0,0 +1,73 @@
+import csv
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from payments.refunds import get_refund_engine
+
+
+class Command(BaseCommand):
+    help = "Refund many payments concurrently through Stripe"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', help="CSV file with payment_id,amount,reason rows (empty amount refunds the rest)")
+        parser.add_argument('--payments', help="Comma-separated payment IDs to refund in full")
+        parser.add_argument('--reason', default="Bulk refund", help="Reason recorded for --payments refunds")
+        parser.add_argument('--resume', action='store_true', help="Submit bulk refunds left pending by an earlier run")
+        parser.add_argument('--workers', type=int, help="Concurrent Stripe calls")
+        parser.add_argument('--rate', type=float, help="Maximum Stripe calls per second")
+        parser.add_argument('--batch-size', type=int, help="Results written per batch of database updates")
+
+    def parse_amount(self, value, line):
+        value = (value or '').strip()
+        if not value:
+            return None
+        try:
+            amount = Decimal(value)
+        except InvalidOperation:
+            raise CommandError(f"Invalid amount {value!r} on line {line}")
+        if not amount.is_finite() or amount != amount.quantize(Decimal('0.01')):
+            raise CommandError(f"Invalid amount {value!r} on line {line}")
+        return amount
+
+    def read_requests(self, options):
+        requests = []
+        if options['csv']:
+            with open(options['csv'], newline='') as handle:
+                reader = csv.DictReader(handle)
+                for row in reader:
+                    amount = self.parse_amount(row.get('amount'), reader.line_num)
+                    requests.append((int(row['payment_id']), amount, row.get('reason') or options['reason']))
+        if options['payments']:
+            for payment_id in options['payments'].split(','):
+                requests.append((int(payment_id), None, options['reason']))
+        return requests
+
+    def handle(self, *args, **options):
+        def progress(report):
+            self.stdout.write(
+                f"{report['done']}/{report['total']} submitted, {report['processed']} processed, "
+                f"{report['failed']} failed, {report['refunds_per_second']} refunds/s"
+            )
+
+        engine = get_refund_engine(
+            workers=options['workers'],
+            rate=options['rate'],
+            batch_size=options['batch_size'],
+            progress=progress
+        )
+        if options['resume']:
+            report = engine.submit_pending()
+        else:
+            try:
+                requests = self.read_requests(options)
+            except (OSError, KeyError, ValueError) as e:
+                raise CommandError(f"Invalid refund requests: {str(e)}")
+            if not requests:
+                raise CommandError("Give --csv, --payments or --resume")
+            report = engine.run(requests)
+            for payment_id, reason in report['skipped']:
+                self.stdout.write(self.style.WARNING(f"Skipped payment {payment_id}: {reason}"))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {report['processed']} refunds, {report['failed']} failed, {report['pending']} pending "
+            f"in {report['seconds']}s; gateway: {report['gateway']}"
+        ))
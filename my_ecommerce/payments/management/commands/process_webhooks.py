@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from payments.webhooks import get_worker_pool
+
+
+class Command(BaseCommand):
+    help = "Process queued Stripe webhook events with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Number of worker threads")
+        parser.add_argument('--batch-size', type=int, help="Events claimed per worker round trip")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is drained")
+
+    def handle(self, *args, **options):
+        pool = get_worker_pool(workers=options['workers'], batch_size=options['batch_size'])
+        pool.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {pool.processed} webhook events ({pool.failed} failed attempts)"
+        ))
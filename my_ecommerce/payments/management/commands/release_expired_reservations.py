@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from payments.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Release expired checkout stock reservations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Reservations released per transaction")
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from payments.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = "Run a local fake Stripe API for offline development and load tests (point STRIPE_API_BASE at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=12111, help="Port to listen on")
+        parser.add_argument('--api-key', default='sk_test_fake', help="Secret key clients must send")
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of requests answered with HTTP 500")
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            api_key=options['api_key'],
+            port=options['port'],
+            latency=options['latency'],
+            failure_rate=options['failure_rate']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Fake Stripe listening on {server.url}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 from orders.models import Order
+from products.models import Product
 
 
 class Payment(models.Model):
@@ -24,20 +25,26 @@ class Payment(models.Model):
     )
 
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payments')
-    payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
+    payment_intent_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     transaction_id = models.CharField(max_length=255, blank=True, null=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    amount_refunded = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Total of processed refunds")
     currency = models.CharField(max_length=3, default='USD')
     status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, blank=True, null=True)
     last_four = models.CharField(max_length=4, blank=True, null=True, help_text="Last four digits of the card")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    paid_at = models.DateTimeField(blank=True, null=True, help_text="When the payment succeeded")
+    intent_attempts = models.PositiveIntegerField(default=0, help_text="PaymentIntents created for this payment")
     error_message = models.TextField(blank=True, null=True)
     refund_reason = models.TextField(blank=True, null=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['order', 'status'], name='payment_order_status_idx'),
+        ]
 
     def __str__(self):
         return f"Payment {self.id} - {self.order.order_number} - {self.status}"
@@ -65,11 +72,18 @@ class Refund(models.Model):
         ('failed', 'Failed'),
     )
 
+    SOURCE_CHOICES = (
+        ('customer', 'Customer request'),
+        ('bulk', 'Bulk refund'),
+    )
+
     payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='refunds')
     refund_id = models.CharField(max_length=255, blank=True, null=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     reason = models.TextField()
     status = models.CharField(max_length=20, choices=REFUND_STATUS_CHOICES, default='pending')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='customer')
+    error_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -77,4 +91,82 @@ class Refund(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"Refund {self.id} - {self.payment.order.order_number}"
\ No newline at end of file
+        return f"Refund {self.id} - {self.payment.order.order_number}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Verified Stripe webhook event waiting for (or done with) processing
+
+    The event ID is unique, so redeliveries of an event are stored once
+    and processed once.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    )
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payment_intent_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    payload = models.JSONField()
+    stripe_created = models.BigIntegerField(default=0, help_text="Event creation time reported by Stripe")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['stripe_created', 'id']
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='webhook_event_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Webhook {self.event_id} ({self.event_type}) - {self.status}"
+
+
+class StockReservation(models.Model):
+    """
+    Short-lived hold on stock for an order between checkout and payment
+
+    Reservations reduce the stock other checkouts can reserve until they
+    are released: when the order's stock is decremented, when its payment
+    fails, or by the periodic sweep once expired. Their quantities are
+    totalled per product in ReservedStock.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['product', 'expires_at'], name='stock_reservation_active_idx'),
+        ]
+
+    def __str__(self):
+        return f"Reservation of {self.quantity} x {self.product_id} for {self.order.order_number}"
+
+
+class ReservedStock(models.Model):
+    """
+    Quantity of a product currently held by stock reservations
+
+    Kept equal to the sum of the product's StockReservation rows, so a
+    checkout can claim stock with one conditional UPDATE of this row
+    against the product's stock.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='reserved_stock')
+    quantity = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} reserved"
@@ -0,0 +1,279 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+from orders.models import Order
+from .gateway import PaymentGatewayError, get_stripe_client, refund_key
+from .models import Payment, Refund
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` calls per second on average
+    and bursts of up to `capacity` calls
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call may be made
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def _refund_totals(payment_ids, statuses):
+    return {
+        payment_id: total
+        for payment_id, total in Refund.objects.filter(
+            payment_id__in=list(payment_ids),
+            status__in=statuses
+        ).values_list('payment_id').annotate(total=Sum('amount')).order_by()
+    }
+
+
+class BulkRefundEngine:
+    """
+    Refund many payments through Stripe concurrently
+
+    Refund rows are created in bulk, then submitted by a bounded thread
+    pool under a shared rate limit. Each Stripe call is keyed by its refund
+    ID, so re-running an interrupted batch (see submit_pending()) never
+    refunds a payment twice. The worker threads only talk to Stripe;
+    refund, payment and order statuses are written from the calling thread
+    in batches of `batch_size`.
+
+    Refunds that fail with a retryable error (network trouble, open
+    circuit), or with an unexpected error after which Stripe may or may
+    not have refunded, stay pending for a later run; other failures are
+    marked failed. Either way the error is kept on the refund. A payment
+    accumulates its processed refunds in `amount_refunded` and is only
+    marked refunded once that covers its amount.
+
+    Args:
+        workers: Concurrent Stripe calls
+        rate: Maximum Stripe calls per second
+        batch_size: Results written per batch of database updates
+        client: StripeClient, defaults to the shared client
+        progress: Optional callable(report) called after every batch
+    """
+
+    def __init__(self, workers=8, rate=25.0, batch_size=100, client=None, progress=None):
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.batch_size = batch_size
+        self.client = client or get_stripe_client()
+        self.progress = progress
+
+    def create_refunds(self, requests):
+        """
+        Validate refund requests and create their Refund rows in bulk
+
+        Args:
+            requests: Iterable of (payment_id, amount, reason); an amount of
+                None refunds whatever is left of the payment
+
+        Returns:
+            Tuple of (created refunds, [(payment_id, reason skipped)])
+        """
+        requests = list(requests)
+        # The workers read the order number, so fetch orders up front
+        payments = Payment.objects.select_related('order').in_bulk(
+            {payment_id for payment_id, amount, reason in requests}
+        )
+        # Pending and processed refunds both reserve part of the payment
+        remaining = {
+            payment_id: payment.amount
+            for payment_id, payment in payments.items()
+        }
+        for payment_id, total in _refund_totals(payments, ('pending', 'processed')).items():
+            remaining[payment_id] -= total
+
+        refunds, skipped = [], []
+        for payment_id, amount, reason in requests:
+            payment = payments.get(payment_id)
+            if payment is None:
+                skipped.append((payment_id, "payment not found"))
+                continue
+            if not payment.can_be_refunded():
+                skipped.append((payment_id, f"payment is {payment.status}"))
+                continue
+            amount = remaining[payment_id] if amount is None else Decimal(amount)
+            if amount <= 0 or amount > remaining[payment_id]:
+                skipped.append((payment_id, f"amount must be between 0 and {remaining[payment_id]}"))
+                continue
+            remaining[payment_id] -= amount
+            refunds.append(Refund(payment=payment, amount=amount, reason=reason, source='bulk'))
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            refunds = Refund.objects.bulk_create(refunds, batch_size=self.batch_size)
+        else:
+            # The idempotency keys need the primary keys
+            with transaction.atomic():
+                for refund in refunds:
+                    refund.save()
+        return refunds, skipped
+
+    def _submit_one(self, refund):
+        try:
+            self.bucket.acquire()
+            stripe_refund = self.client.create_refund(
+                payment_intent=refund.payment.payment_intent_id,
+                amount=int(refund.amount * 100),  # Convert to cents
+                metadata={'refund_id': refund.id, 'order_number': refund.payment.order.order_number},
+                idempotency_key=refund_key(refund)
+            )
+            return refund, stripe_refund['id'], None
+        except Exception as e:
+            # One bad refund mustn't take down the batch; replaying it later
+            # with the same idempotency key is safe
+            return refund, None, e
+
+    def _write_results(self, results, refunded):
+        now = timezone.now()
+        processed, failed, errored = [], [], []
+        increments = {}
+        for refund, stripe_refund_id, error in results:
+            refund.updated_at = now
+            if error is None:
+                refund.refund_id = stripe_refund_id
+                refund.status = 'processed'
+                refund.error_message = None
+                processed.append(refund)
+                increments[refund.payment_id] = increments.get(refund.payment_id, 0) + refund.amount
+                refunded[refund.payment_id] = refunded.get(refund.payment_id, 0) + refund.amount
+                continue
+
+            refund.error_message = str(error)
+            if getattr(error, 'retryable', True):
+                errored.append(refund)
+                logger.error(f"Refund {refund.id} of payment {refund.payment_id} left pending: {str(error)}")
+            else:
+                refund.status = 'failed'
+                failed.append(refund)
+                logger.error(f"Refund {refund.id} of payment {refund.payment_id} failed: {str(error)}")
+
+        payments = {refund.payment_id: refund.payment for refund in processed}
+        fully_refunded = [
+            payment for payment_id, payment in payments.items()
+            if refunded[payment_id] >= payment.amount
+        ]
+        with transaction.atomic():
+            if results:
+                Refund.objects.bulk_update(
+                    processed + failed + errored,
+                    ['refund_id', 'status', 'error_message', 'updated_at']
+                )
+            if increments:
+                Payment.objects.filter(id__in=list(increments)).update(
+                    amount_refunded=F('amount_refunded') + Case(
+                        *[When(id=payment_id, then=Value(amount)) for payment_id, amount in increments.items()],
+                        output_field=DecimalField(max_digits=10, decimal_places=2)
+                    ),
+                    updated_at=now
+                )
+            if fully_refunded:
+                Payment.objects.filter(id__in=[payment.id for payment in fully_refunded]).update(status='refunded')
+                Order.objects.filter(id__in=[payment.order_id for payment in fully_refunded]).update(status='refunded')
+        return len(processed), len(failed)
+
+    def submit(self, refunds):
+        """
+        Send refunds to Stripe and record the outcomes
+
+        Returns:
+            Report dict with counts, timings and throughput
+        """
+        refunds = list(refunds)
+        refunded = _refund_totals({refund.payment_id for refund in refunds}, ('processed',))
+        report = {'total': len(refunds), 'done': 0, 'processed': 0, 'failed': 0}
+        started = time.perf_counter()
+        results = []
+
+        def flush():
+            processed, failed = self._write_results(results, refunded)
+            report['done'] += len(results)
+            report['processed'] += processed
+            report['failed'] += failed
+            results.clear()
+            elapsed = time.perf_counter() - started
+            report['seconds'] = round(elapsed, 3)
+            report['refunds_per_second'] = round(report['done'] / elapsed, 1) if elapsed else None
+            if self.progress:
+                self.progress(dict(report))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='refund') as executor:
+            queued = iter(refunds)
+            in_flight = set()
+            while True:
+                # Keep a bounded window of calls in flight
+                for refund in queued:
+                    in_flight.add(executor.submit(self._submit_one, refund))
+                    if len(in_flight) >= self.workers * 2:
+                        break
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in finished)
+                if len(results) >= self.batch_size:
+                    flush()
+        flush()
+
+        report['pending'] = report['total'] - report['processed'] - report['failed']
+        report['gateway'] = self.client.stats()
+        logger.info(f"Bulk refund finished: {report}")
+        return report
+
+    def run(self, requests):
+        """
+        Create and submit refunds for (payment_id, amount, reason) requests
+        """
+        refunds, skipped = self.create_refunds(requests)
+        report = self.submit(refunds)
+        report['skipped'] = skipped
+        return report
+
+    def submit_pending(self, payment_ids=None):
+        """
+        Submit bulk refunds left pending, e.g. by an interrupted run
+
+        Refunds requested by shoppers are left to their own flow.
+        """
+        refunds = Refund.objects.filter(
+            status='pending',
+            source='bulk'
+        ).select_related('payment__order').order_by('id')
+        if payment_ids is not None:
+            refunds = refunds.filter(payment_id__in=list(payment_ids))
+        return self.submit(refunds)
+
+
+def get_refund_engine(**overrides):
+    options = {
+        'workers': getattr(settings, 'REFUND_WORKERS', 8),
+        'rate': getattr(settings, 'REFUND_RATE_LIMIT', 25.0),
+        'batch_size': getattr(settings, 'REFUND_BATCH_SIZE', 100),
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return BulkRefundEngine(**options)
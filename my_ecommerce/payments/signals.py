@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent once an order's payment has succeeded and its stock has been updated,
+# after that transaction has committed.
+# Arguments: order, paid_at
+order_paid = Signal()
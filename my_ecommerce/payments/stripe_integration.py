@@ -1,11 +1,19 @@
 import stripe
 from django.conf import settings
+from django.core.cache import caches
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from django.shortcuts import redirect, get_object_or_404
 from orders.models import Order
+from .gateway import PaymentGatewayError, get_stripe_client, payment_intent_key
+from .inventory import InsufficientStock, decrement_stock, release_reservations, reserve_stock
 from .models import Payment
+from .signals import order_paid
+from .webhooks import enqueue_event
 from django.urls import reverse
 import logging
 
@@ -15,13 +23,68 @@ endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
 logger = logging.getLogger(__name__)
 
 
+# PaymentIntent statuses in which the customer can still pay the intent
+REUSABLE_INTENT_STATUSES = ('requires_payment_method', 'requires_confirmation', 'requires_action')
+
+
+def get_intent_cache():
+    return caches[getattr(settings, 'PAYMENT_INTENT_CACHE', 'default')]
+
+
+def _intent_cache_key(order):
+    return f"payments:intent:{order.id}"
+
+
+def _reuse_payment_intent(order, payment, amount_cents, currency):
+    """
+    Get the intent of an order's pending payment, updated to `amount_cents`
+
+    The intent's client secret, amount and currency are cached when it is
+    created, so reloading the checkout page normally needs no Stripe call.
+    On a cache miss the intent is retrieved once and checked to still be
+    payable.
+
+    Returns:
+        Dictionary with the intent's id, client_secret, amount and currency,
+        or None if a new intent has to be created
+    """
+    client = get_stripe_client()
+    intent = get_intent_cache().get(_intent_cache_key(order))
+    if intent is None or intent['id'] != payment.payment_intent_id:
+        try:
+            found = client.retrieve_payment_intent(payment.payment_intent_id)
+        except PaymentGatewayError as e:
+            if e.retryable:
+                raise
+            return None
+        if found['status'] not in REUSABLE_INTENT_STATUSES:
+            return None
+        intent = {key: found[key] for key in ('id', 'client_secret', 'amount', 'currency')}
+
+    if intent['currency'] != currency:
+        return None
+    if intent['amount'] != amount_cents:
+        # The cart total changed since the intent was created
+        try:
+            client.update_payment_intent(intent['id'], amount=amount_cents)
+        except PaymentGatewayError as e:
+            if e.retryable:
+                raise
+            # e.g. the intent is already being confirmed
+            return None
+        intent['amount'] = amount_cents
+    return intent
+
+
 def create_payment_intent(order, request=None):
     """
-    Create a Stripe Payment Intent for an order
+    Create a Stripe Payment Intent for an order, or reuse the pending one
     """
     try:
         # Calculate the total in cents
-        amount_cents = int(order.get_total() * 100)
+        total = order.get_total()
+        amount_cents = int(total * 100)
+        currency = 'usd'
 
         # Metadata to associate the payment with the order
         metadata = {
@@ -29,38 +92,81 @@ def create_payment_intent(order, request=None):
             'user_id': str(order.user.id) if order.user else 'guest',
         }
 
-        # Create a payment intent
-        intent = stripe.PaymentIntent.create(
-            amount=amount_cents,
-            currency='usd',
-            metadata=metadata,
-            description=f"Payment for Order #{order.order_number}",
-        )
+        # Hold the items while the customer pays
+        reserve_stock(order)
+
+        payment = Payment.objects.filter(order=order, status='pending').first()
+        intent = None
+        if payment is not None and payment.payment_intent_id:
+            intent = _reuse_payment_intent(order, payment, amount_cents, currency)
 
-        # Create or update payment record
-        payment, created = Payment.objects.update_or_create(
-            order=order,
-            defaults={
-                'payment_intent_id': intent.id,
-                'amount': order.get_total(),
-                'status': 'pending'
-            }
+        if intent is None:
+            if payment is None:
+                payment = Payment.objects.create(order=order, amount=total, status='pending')
+            # Each creation attempt gets its own idempotency key; the
+            # client's retries of this call reuse it
+            Payment.objects.filter(id=payment.id).update(intent_attempts=F('intent_attempts') + 1)
+            payment.refresh_from_db(fields=['intent_attempts'])
+            created_intent = get_stripe_client().create_payment_intent(
+                amount=amount_cents,
+                currency=currency,
+                metadata=metadata,
+                description=f"Payment for Order #{order.order_number}",
+                idempotency_key=payment_intent_key(payment)
+            )
+            intent = {key: created_intent[key] for key in ('id', 'client_secret', 'amount', 'currency')}
+        get_intent_cache().set(
+            _intent_cache_key(order),
+            intent,
+            getattr(settings, 'PAYMENT_INTENT_CACHE_TTL', 60 * 60)
         )
 
+        # Point the payment record at the intent
+        if payment.payment_intent_id != intent['id'] or payment.amount != total:
+            payment.payment_intent_id = intent['id']
+            payment.amount = total
+            payment.save(update_fields=['payment_intent_id', 'amount', 'updated_at'])
+
         return {
-            'clientSecret': intent.client_secret,
+            'clientSecret': intent['client_secret'],
             'payment_id': payment.id,
             'success': True
         }
 
+    except InsufficientStock as e:
+        logger.info(f"Checkout of order {order.order_number} refused: {str(e)}")
+        return {
+            'error': str(e),
+            'success': False
+        }
+    except PaymentGatewayError as e:
+        logger.error(f"Error creating payment intent: {str(e)}")
+        release_reservations(order)
+        return {
+            'error': "The payment service is temporarily unavailable, please try again." if e.retryable else str(e),
+            'success': False
+        }
     except Exception as e:
         logger.error(f"Error creating payment intent: {str(e)}")
+        release_reservations(order)
         return {
             'error': str(e),
             'success': False
         }
 
 
+def announce_order_paid(order, paid_at):
+    """
+    Send order_paid for a committed payment
+
+    The payment can no longer be rolled back, so a failing receiver is
+    logged rather than allowed to stop the others or fail the handler.
+    """
+    for receiver, result in order_paid.send_robust(sender=Order, order=order, paid_at=paid_at):
+        if isinstance(result, Exception):
+            logger.error(f"Error in order_paid receiver {getattr(receiver, '__name__', receiver)}: {str(result)}")
+
+
 def handle_payment_success(payment_intent):
     """
     Handle successful payment
@@ -68,23 +174,37 @@ def handle_payment_success(payment_intent):
     # Get the order from the metadata
     order_number = payment_intent['metadata']['order_number']
     try:
-        order = Order.objects.get(order_number=order_number)
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(order_number=order_number)
+            payment = Payment.objects.get(payment_intent_id=payment_intent['id'])
 
-        # Update order status
-        order.status = 'paid'
-        order.save()
+            # Already applied (e.g. a second event for the same intent)
+            if order.status == 'paid' and payment.status == 'completed':
+                return True, order
 
-        # Update payment record
-        payment = Payment.objects.get(payment_intent_id=payment_intent['id'])
-        payment.status = 'completed'
-        payment.transaction_id = payment_intent['id']
-        payment.save()
+            # Update order status
+            order.status = 'paid'
+            order.save()
 
-        # Update inventory (reduce stock)
-        for item in order.items.all():
-            product = item.product
-            product.stock -= item.quantity
-            product.save()
+            # Update payment record
+            payment.status = 'completed'
+            payment.transaction_id = payment_intent['id']
+            payment.paid_at = timezone.now()
+            payment.save()
+
+            # Update inventory (reduce stock) with one conditional UPDATE
+            try:
+                decrement_stock(order)
+            except InsufficientStock as e:
+                # The customer has been charged, so the order stays paid and
+                # the shortfall is left for manual fulfilment or a refund;
+                # its holds mustn't block other checkouts until they expire
+                release_reservations(order)
+                logger.error(f"Order {order_number} paid with insufficient stock: {str(e)}")
+
+            # Receivers run once the payment is committed, outside the order lock
+            paid_at = payment.paid_at
+            transaction.on_commit(lambda: announce_order_paid(order, paid_at))
 
         # Send confirmation email
         # send_order_confirmation_email(order)
@@ -116,6 +236,8 @@ def handle_payment_failure(payment_intent):
         payment.status = 'failed'
         payment.save()
 
+        release_reservations(order)
+
         # Log the failure reason if available
         if 'last_payment_error' in payment_intent and payment_intent['last_payment_error']:
             logger.error(f"Payment failed: {payment_intent['last_payment_error']['message']}")
@@ -133,7 +255,7 @@ def handle_payment_failure(payment_intent):
 @require_POST
 def stripe_webhook(request):
     """
-    Handle Stripe webhooks
+    Handle Stripe webhooks: verify the signature and queue the event
     """
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
@@ -151,18 +273,13 @@ def stripe_webhook(request):
         logger.error(f"Invalid webhook signature: {str(e)}")
         return HttpResponse(status=400)
 
-    # Handle the event
-    if event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        success, order = handle_payment_success(payment_intent)
-        if not success:
-            return HttpResponse(status=500)
-
-    elif event['type'] == 'payment_intent.payment_failed':
-        payment_intent = event['data']['object']
-        success, order = handle_payment_failure(payment_intent)
-        if not success:
-            return HttpResponse(status=500)
+    # Queue the event; workers ('manage.py process_webhooks') apply it, so
+    # Stripe gets its acknowledgement without waiting on order updates
+    try:
+        enqueue_event(event)
+    except Exception as e:
+        logger.error(f"Error queueing webhook event {event['id']}: {str(e)}")
+        return HttpResponse(status=500)
 
     # Return a 200 response to acknowledge receipt of the event
     return HttpResponse(status=200)
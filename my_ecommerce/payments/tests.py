@@ -0,0 +1,326 @@
+import time
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from orders.models import Order, OrderItem
+from products.models import Product
+from search.synthetic import SyntheticCatalog, build_instance
+from . import gateway
+from .fake_stripe import FakeStripeServer
+from .gateway import CircuitBreaker, CircuitOpenError, PaymentGatewayError, StripeClient
+from .models import Payment, Refund, ReservedStock, StockReservation
+from .refunds import BulkRefundEngine
+from .signals import order_paid
+from .stripe_integration import create_payment_intent, handle_payment_success
+
+
+class FakeStripeMixin:
+    """
+    Start one fake Stripe server per test class and reset it between tests
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeStripeServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        with self.fake.lock:
+            self.fake.forced_failures.clear()
+            # Test databases reuse IDs, and with them idempotency keys
+            self.fake.idempotency.clear()
+        self.fake.latency = 0.0
+
+    def make_client(self, failure_threshold=5, reset_timeout=30.0, **kwargs):
+        kwargs.setdefault('backoff', 0.001)
+        kwargs.setdefault('backoff_max', 0.001)
+        return StripeClient(
+            self.fake.api_key,
+            api_base=self.fake.url,
+            breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+            **kwargs
+        )
+
+
+class StripeClientTests(FakeStripeMixin, SimpleTestCase):
+
+    def test_retries_server_errors_with_the_same_key(self):
+        client = self.make_client(max_retries=2)
+        self.fake.fail_next(2)
+
+        intent = client.create_payment_intent(1000, 'usd', idempotency_key='retry-test')
+
+        self.assertEqual(intent['amount'], 1000)
+        self.assertEqual(client.stats()['retries'], 2)
+        self.assertEqual(client.stats()['attempts'], 3)
+
+    def test_gives_up_after_max_retries(self):
+        client = self.make_client(max_retries=1)
+        self.fake.fail_next(2)
+
+        with self.assertRaises(PaymentGatewayError) as raised:
+            client.create_payment_intent(1000, 'usd')
+
+        self.assertEqual(raised.exception.status, 500)
+        self.assertTrue(raised.exception.retryable)
+        self.assertEqual(client.stats()['failures'], 1)
+
+    def test_does_not_retry_invalid_requests(self):
+        client = self.make_client(max_retries=2)
+
+        with self.assertRaises(PaymentGatewayError) as raised:
+            client.request('POST', '/v1/payment_intents', {'currency': 'usd'})
+
+        self.assertEqual(raised.exception.status, 400)
+        self.assertFalse(raised.exception.retryable)
+        self.assertEqual(client.stats()['attempts'], 1)
+
+    def test_idempotent_replay_returns_the_first_result(self):
+        client = self.make_client()
+
+        first = client.create_payment_intent(1000, 'usd', idempotency_key='replay-test')
+        second = client.create_payment_intent(1000, 'usd', idempotency_key='replay-test')
+
+        self.assertEqual(first['id'], second['id'])
+
+    def test_timed_out_call_is_replayed_not_repeated(self):
+        client = self.make_client(max_retries=0, timeout=(1.0, 0.05))
+        count = len(self.fake.payment_intents)
+        self.fake.latency = 0.2
+
+        with self.assertRaises(PaymentGatewayError) as raised:
+            client.create_payment_intent(1000, 'usd', idempotency_key='timeout-test')
+        self.assertIsNone(raised.exception.status)
+        self.assertTrue(raised.exception.retryable)
+
+        # The server finished the first call; retrying it must not create a second intent
+        time.sleep(0.3)
+        self.fake.latency = 0.0
+        client.create_payment_intent(1000, 'usd', idempotency_key='timeout-test')
+        self.assertEqual(len(self.fake.payment_intents), count + 1)
+
+    def test_circuit_opens_half_opens_and_closes(self):
+        client = self.make_client(failure_threshold=2, reset_timeout=0.1, max_retries=0)
+        self.fake.fail_next(2)
+        for _ in range(2):
+            with self.assertRaises(PaymentGatewayError):
+                client.create_payment_intent(1000, 'usd')
+        self.assertEqual(client.breaker.state, 'open')
+
+        # Refused without reaching the server
+        requests_before = self.fake.requests
+        with self.assertRaises(CircuitOpenError):
+            client.create_payment_intent(1000, 'usd')
+        self.assertEqual(self.fake.requests, requests_before)
+
+        # A failed probe opens the circuit again
+        time.sleep(0.15)
+        self.fake.fail_next(1)
+        with self.assertRaises(PaymentGatewayError):
+            client.create_payment_intent(1000, 'usd')
+        self.assertEqual(client.breaker.state, 'open')
+
+        # A successful probe closes it
+        time.sleep(0.15)
+        client.create_payment_intent(1000, 'usd')
+        self.assertEqual(client.breaker.state, 'closed')
+        self.assertEqual(client.stats()['circuit_opened'], 2)
+
+    def test_unexpected_probe_error_reopens_circuit(self):
+        client = self.make_client(failure_threshold=1, reset_timeout=0.05, max_retries=0)
+        self.fake.fail_next(1)
+        with self.assertRaises(PaymentGatewayError):
+            client.create_payment_intent(1000, 'usd')
+
+        time.sleep(0.1)
+        with mock.patch.object(client.session, 'request', side_effect=ValueError('bad response')):
+            with self.assertRaises(ValueError):
+                client.create_payment_intent(1000, 'usd')
+        self.assertEqual(client.breaker.state, 'open')
+
+        time.sleep(0.1)
+        client.create_payment_intent(1000, 'usd')
+        self.assertEqual(client.breaker.state, 'closed')
+
+
+class CheckoutTests(FakeStripeMixin, TestCase):
+    """
+    Checkout, payment and refund paths against the fake Stripe server
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog = SyntheticCatalog(products=2, seed=7, reviews_per_product=0)
+        catalog.generate_catalog()
+        cls.user_id = catalog.user_ids[0]
+        cls.product = Product.objects.get(id=catalog.product_ids[0])
+
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(STRIPE_SECRET_KEY=self.fake.api_key, STRIPE_API_BASE=self.fake.url)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # The shared client reads the settings when it is first created
+        gateway._client = None
+        self.addCleanup(setattr, gateway, '_client', None)
+        caches['default'].clear()
+        Product.objects.filter(id=self.product.id).update(stock=3)
+
+    def make_order(self, number, quantity):
+        order = build_instance(Order, user_id=self.user_id, order_number=number, status='pending')
+        order.save()
+        build_instance(OrderItem, order=order, product=self.product, quantity=quantity, price=Decimal('10.00')).save()
+        return order
+
+    def reserved(self):
+        return ReservedStock.objects.filter(product=self.product).values_list('quantity', flat=True).first() or 0
+
+    def checkout_and_pay(self, number, quantity=1):
+        order = self.make_order(number, quantity)
+        self.assertTrue(create_payment_intent(order)['success'])
+        payment = Payment.objects.get(order=order)
+        self.fake.succeed(payment.payment_intent_id)
+        handle_payment_success(self.fake.payment_intents[payment.payment_intent_id])
+        payment.refresh_from_db()
+        return payment
+
+    def test_checkout_holds_stock(self):
+        order = self.make_order('T-1', 2)
+
+        result = create_payment_intent(order)
+
+        self.assertTrue(result['success'])
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(StockReservation.objects.filter(order=order).count(), 1)
+
+    def test_checkout_refused_while_stock_is_held(self):
+        self.assertTrue(create_payment_intent(self.make_order('T-1', 2))['success'])
+
+        result = create_payment_intent(self.make_order('T-2', 2))
+
+        self.assertFalse(result['success'])
+        self.assertEqual(self.reserved(), 2)
+
+    def test_gateway_outage_releases_the_hold(self):
+        order = self.make_order('T-1', 2)
+        self.fake.fail_next(10)
+
+        result = create_payment_intent(order)
+
+        self.assertFalse(result['success'])
+        self.assertFalse(StockReservation.objects.filter(order=order).exists())
+        self.assertEqual(self.reserved(), 0)
+
+    def test_checkout_retries_through_a_transient_failure(self):
+        order = self.make_order('T-1', 1)
+        self.fake.fail_next(1)
+
+        self.assertTrue(create_payment_intent(order)['success'])
+        self.assertEqual(len({p.payment_intent_id for p in Payment.objects.filter(order=order)}), 1)
+
+    def test_payment_takes_items_out_of_stock(self):
+        payment = self.checkout_and_pay('T-1', 2)
+
+        self.assertEqual(payment.status, 'completed')
+        self.assertIsNotNone(payment.paid_at)
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 1)
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_payment_short_of_stock_releases_the_hold(self):
+        order = self.make_order('T-1', 2)
+        self.assertTrue(create_payment_intent(order)['success'])
+        Product.objects.filter(id=self.product.id).update(stock=1)
+        payment = Payment.objects.get(order=order)
+        self.fake.succeed(payment.payment_intent_id)
+
+        success, order = handle_payment_success(self.fake.payment_intents[payment.payment_intent_id])
+
+        self.assertTrue(success)
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 1)
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.filter(order=order).exists())
+
+    def test_order_paid_is_sent_after_commit(self):
+        received = []
+
+        def receiver(sender, order, **kwargs):
+            received.append(order.order_number)
+        order_paid.connect(receiver)
+        self.addCleanup(order_paid.disconnect, receiver)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.checkout_and_pay('T-1')
+        self.assertEqual(received, [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(received, ['T-1'])
+
+    def test_bulk_refund_leaves_failed_calls_pending_and_resumes(self):
+        payments = [self.checkout_and_pay('T-1'), self.checkout_and_pay('T-2')]
+        refunds_before = len(self.fake.refunds)
+        engine = BulkRefundEngine(workers=1, rate=1000, client=self.make_client(max_retries=0))
+        self.fake.fail_next(1)
+
+        report = engine.run((payment.id, None, 'test') for payment in payments)
+        self.assertEqual((report['processed'], report['pending']), (1, 1))
+
+        report = engine.submit_pending()
+        self.assertEqual(report['processed'], 1)
+        self.assertEqual(Refund.objects.filter(status='processed').count(), 2)
+        self.assertEqual(len(self.fake.refunds), refunds_before + 2)
+        self.assertEqual(set(Payment.objects.values_list('status', flat=True)), {'refunded'})
+
+    def test_resubmitted_refund_is_not_repeated(self):
+        payment = self.checkout_and_pay('T-1')
+        engine = BulkRefundEngine(workers=1, rate=1000, client=self.make_client())
+        engine.run([(payment.id, Decimal('5.00'), 'test')])
+        refunds_before = len(self.fake.refunds)
+
+        engine.submit(Refund.objects.select_related('payment__order'))
+
+        self.assertEqual(len(self.fake.refunds), refunds_before)
+
+    def test_resume_leaves_shopper_refunds_alone(self):
+        payment = self.checkout_and_pay('T-1')
+        Refund.objects.create(payment=payment, amount=Decimal('5.00'), reason='Damaged')
+        engine = BulkRefundEngine(workers=1, rate=1000, client=self.make_client())
+
+        report = engine.submit_pending()
+
+        self.assertEqual(report['total'], 0)
+        self.assertEqual(Refund.objects.get().status, 'pending')
+
+    def test_partial_refund_keeps_the_payment_refundable(self):
+        payment = self.checkout_and_pay('T-1')
+        engine = BulkRefundEngine(workers=1, rate=1000, client=self.make_client())
+
+        engine.run([(payment.id, Decimal('4.00'), 'test')])
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.amount_refunded), ('completed', Decimal('4.00')))
+
+        engine.run([(payment.id, None, 'test')])
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.amount_refunded), ('refunded', payment.amount))
+
+    def test_unexpected_error_leaves_the_refund_pending(self):
+        payment = self.checkout_and_pay('T-1')
+        client = self.make_client()
+        engine = BulkRefundEngine(workers=1, rate=1000, client=client)
+
+        with mock.patch.object(client, 'create_refund', side_effect=KeyError('id')):
+            report = engine.run([(payment.id, None, 'test')])
+
+        self.assertEqual(report['pending'], 1)
+        refund = Refund.objects.get()
+        self.assertEqual(refund.status, 'pending')
+        self.assertIn('id', refund.error_message)
+        self.assertEqual(engine.submit_pending()['processed'], 1)
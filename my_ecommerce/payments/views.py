@@ -2,11 +2,13 @@ import json
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db.models import F
 from django.http import JsonResponse, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from orders.models import Order
+from .gateway import CircuitOpenError, PaymentGatewayError, get_stripe_client, refund_key
 from .models import Payment, Refund
 from .forms import RefundForm
 from .stripe_integration import (
@@ -174,26 +176,27 @@ def process_refund_view(request, payment_id):
         # Get the latest refund request
         refund = Refund.objects.filter(payment=payment, status='pending').latest('created_at')
 
-        # Process refund through Stripe
-        import stripe
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-
-        stripe_refund = stripe.Refund.create(
+        # Process refund through Stripe; keyed by the refund request so a
+        # retry never refunds twice
+        stripe_refund = get_stripe_client().create_refund(
             payment_intent=payment.payment_intent_id,
             amount=int(refund.amount * 100),  # Convert to cents
+            idempotency_key=refund_key(refund)
         )
 
         # Update refund status
-        refund.refund_id = stripe_refund.id
+        refund.refund_id = stripe_refund['id']
         refund.status = 'processed'
         refund.save()
 
-        # Update payment status
-        payment.status = 'refunded'
-        payment.save()
+        # Add to the refunded total; the payment only counts as refunded
+        # once the refunds cover all of it
+        Payment.objects.filter(id=payment.id).update(amount_refunded=F('amount_refunded') + refund.amount)
+        payment.refresh_from_db(fields=['amount_refunded'])
+        if payment.amount_refunded >= payment.amount:
+            payment.status = 'refunded'
+            payment.save(update_fields=['status', 'updated_at'])
 
-        # Update order status if full refund
-        if refund.amount >= payment.amount:
             order.status = 'refunded'
             order.save()
 
@@ -203,6 +206,9 @@ def process_refund_view(request, payment_id):
     except Refund.DoesNotExist:
         messages.error(request, "No pending refund request found.")
         return redirect('orders:detail', order_id=order.id)
-    except stripe.error.StripeError as e:
+    except CircuitOpenError:
+        messages.error(request, "Refunds are temporarily unavailable, please try again in a few minutes.")
+        return redirect('payments:refund_request', payment_id=payment.id)
+    except PaymentGatewayError as e:
         messages.error(request, f"Stripe error: {str(e)}")
-        return redirect('payments:refund_request', payment_id=payment.id)
\ No newline at end of file
+        return redirect('payments:refund_request', payment_id=payment.id)
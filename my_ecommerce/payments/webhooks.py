@@ -0,0 +1,253 @@
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# Attempts before an event is marked failed and left for inspection
+MAX_ATTEMPTS = 8
+
+# Retry delays grow as BASE * 2^attempt seconds, capped at MAX
+BACKOFF_BASE = 5
+BACKOFF_MAX = 60 * 30
+
+# Events left 'processing' longer than this (a crashed worker) are retried
+LOCK_TIMEOUT = datetime.timedelta(minutes=5)
+
+
+class WebhookProcessingError(Exception):
+    """
+    Raised when a handler reports failure, rolling back its changes
+    """
+
+
+def enqueue_event(event):
+    """
+    Store a verified Stripe event for the workers in a single INSERT;
+    redeliveries of an already stored event are ignored
+    """
+    data_object = event['data']['object']
+    payment_intent_id = None
+    if data_object.get('object') == 'payment_intent':
+        payment_intent_id = data_object.get('id')
+    else:
+        payment_intent_id = data_object.get('payment_intent')
+
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(
+            event_id=event['id'],
+            event_type=event['type'],
+            payment_intent_id=payment_intent_id,
+            payload=event.to_dict() if hasattr(event, 'to_dict') else dict(event),
+            stripe_created=event.get('created') or 0,
+        )],
+        ignore_conflicts=True
+    )
+
+
+def get_handlers():
+    # Imported here to avoid a circular import with stripe_integration
+    from .stripe_integration import handle_payment_success, handle_payment_failure
+
+    return {
+        'payment_intent.succeeded': handle_payment_success,
+        'payment_intent.payment_failed': handle_payment_failure,
+    }
+
+
+def claim_events(worker_id, limit=10):
+    """
+    Lock and mark up to `limit` due events as processing
+
+    An event is only claimed when it is the oldest unfinished event of its
+    PaymentIntent, so each intent's events are handled one at a time in
+    the order Stripe created them. The check is repeated after locking
+    every unfinished event of the intent (without waiting: an intent with
+    a row locked by another worker is skipped), so two workers can never
+    both pass it for the same intent.
+    """
+    now = timezone.now()
+    unfinished = ['pending', 'processing']
+    earlier_unfinished = WebhookEvent.objects.filter(
+        payment_intent_id=OuterRef('payment_intent_id'),
+        status__in=unfinished,
+    ).filter(
+        Q(stripe_created__lt=OuterRef('stripe_created')) |
+        Q(stripe_created=OuterRef('stripe_created'), id__lt=OuterRef('id'))
+    )
+
+    claimed = []
+    with transaction.atomic():
+        candidates = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True).filter(
+                Q(status='pending', available_at__lte=now) |
+                Q(status='processing', locked_at__lt=now - LOCK_TIMEOUT)
+            ).filter(
+                Q(payment_intent_id__isnull=True) | ~Exists(earlier_unfinished)
+            ).order_by('stripe_created', 'id')[:limit]
+        )
+        for event in candidates:
+            if event.payment_intent_id is not None:
+                intent_events = WebhookEvent.objects.filter(
+                    payment_intent_id=event.payment_intent_id,
+                    status__in=unfinished
+                )
+                try:
+                    with transaction.atomic():
+                        list(intent_events.select_for_update(nowait=True).values_list('id', flat=True))
+                except DatabaseError:
+                    continue
+                first_id = intent_events.order_by('stripe_created', 'id').values_list('id', flat=True).first()
+                if first_id != event.id:
+                    continue
+            claimed.append(event)
+
+        if claimed:
+            WebhookEvent.objects.filter(id__in=[event.id for event in claimed]).update(
+                status='processing',
+                locked_by=worker_id,
+                locked_at=now
+            )
+    return claimed
+
+
+def _retry_delay(attempts):
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    # Full jitter keeps retries of a burst from arriving together
+    return datetime.timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def process_event(event, handlers=None):
+    """
+    Run an event's handler and record the outcome
+
+    The handler's database changes and the 'processed' mark commit in one
+    transaction, so an event's effects are applied exactly once even if a
+    worker dies part way.
+
+    Returns:
+        True if the event was processed
+    """
+    handlers = handlers or get_handlers()
+    handler = handlers.get(event.event_type)
+    try:
+        with transaction.atomic():
+            if handler is not None:
+                success, order = handler(event.payload['data']['object'])
+                if not success:
+                    raise WebhookProcessingError(f"Handler for {event.event_type} reported failure")
+            WebhookEvent.objects.filter(id=event.id).update(
+                status='processed',
+                attempts=event.attempts + 1,
+                processed_at=timezone.now(),
+                last_error=None
+            )
+        return True
+    except Exception as e:
+        attempts = event.attempts + 1
+        if attempts >= MAX_ATTEMPTS:
+            status, available_at = 'failed', timezone.now()
+            logger.error(f"Giving up on webhook event {event.event_id} after {attempts} attempts: {str(e)}")
+        else:
+            status, available_at = 'pending', timezone.now() + _retry_delay(attempts)
+            logger.error(f"Error processing webhook event {event.event_id} (attempt {attempts}): {str(e)}")
+        WebhookEvent.objects.filter(id=event.id).update(
+            status=status,
+            attempts=attempts,
+            available_at=available_at,
+            locked_by=None,
+            locked_at=None,
+            last_error=str(e)
+        )
+        return False
+
+
+class WebhookWorkerPool:
+    """
+    Threads that claim and process queued webhook events until stopped
+
+    Args:
+        workers: Number of worker threads
+        batch_size: Events claimed per round trip
+        poll_interval: Seconds to sleep when the queue is empty
+    """
+
+    def __init__(self, workers=4, batch_size=10, poll_interval=1.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+
+    def run_worker(self, number, once=False):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{number}"
+        handlers = get_handlers()
+        errors = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    close_old_connections()
+                    events = claim_events(worker_id, self.batch_size)
+                    if not events:
+                        if once:
+                            return
+                        self._stop.wait(self.poll_interval)
+                        continue
+                    for event in events:
+                        ok = process_event(event, handlers)
+                        with self._lock:
+                            if ok:
+                                self.processed += 1
+                            else:
+                                self.failed += 1
+                    errors = 0
+                except Exception as e:
+                    # e.g. a dropped connection: back off and keep the worker
+                    # alive; claimed events are retried after LOCK_TIMEOUT
+                    errors += 1
+                    logger.error(f"Error in webhook worker {worker_id}: {str(e)}")
+                    self._stop.wait(min(self.poll_interval * 2 ** min(errors, 16), BACKOFF_MAX))
+        finally:
+            close_old_connections()
+
+    def run(self, once=False):
+        """
+        Run the workers; with once=True return when the queue is drained
+        """
+        threads = [
+            threading.Thread(target=self.run_worker, args=(number, once), name=f"webhook-worker-{number}")
+            for number in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self._stop.set()
+
+
+def get_worker_pool(**overrides):
+    options = {
+        'workers': getattr(settings, 'WEBHOOK_WORKERS', 4),
+        'batch_size': getattr(settings, 'WEBHOOK_BATCH_SIZE', 10),
+        'poll_interval': getattr(settings, 'WEBHOOK_POLL_INTERVAL', 1.0),
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return WebhookWorkerPool(**options)
@@ -0,0 +1,334 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+from django.conf import settings
+from .copurchase import get_data_dir
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ('view', 'add_to_cart', 'add_to_wishlist', 'purchase', 'search')
+
+# Actions shed first when the queue is filling up
+LOW_PRIORITY_ACTIONS = ('view',)
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.log'
+
+
+def get_activity_dir():
+    path = getattr(settings, 'ACTIVITY_LOG_DIR', None) or os.path.join(get_data_dir(), 'activity')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ActivityLogWriter:
+    """
+    Append-only, segmented log of user activity events
+
+    Requests put events on a bounded queue and return immediately; a
+    background thread appends them in batches, one JSON object per line,
+    to the current segment file. Segments are written as '<name>.open' and
+    renamed to '<name>.log' once they reach `segment_bytes` (or on exit).
+    Each process writes its own segments, so no file locking is needed.
+
+    Backpressure: once the queue is `shed_ratio` full, low-priority events
+    (views) are dropped; when it is completely full every event is
+    dropped. Drops are counted, never blocking the request.
+    """
+
+    def __init__(self, directory, max_size=50000, batch_size=1000, flush_interval=1.0,
+                 segment_bytes=64 * 1024 * 1024, shed_ratio=0.8):
+        self.directory = directory
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.shed_size = int(max_size * shed_ratio)
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._segment = None
+        self._segment_name = None
+        self._segment_size = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def emit(self, event):
+        """
+        Queue an event dict; returns False when it was dropped
+        """
+        if event.get('action') in LOW_PRIORITY_ACTIONS and self._queue.qsize() >= self.shed_size:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self._ensure_writer()
+        return True
+
+    def _ensure_writer(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write_batch(self._drain([first]))
+
+    def _drain(self, batch):
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _open_segment(self):
+        # Names sort by creation time; host and PID keep writers apart
+        self._segment_name = f"activity-{time.time_ns():020d}-{socket.gethostname()}-{os.getpid()}"
+        self._segment = open(os.path.join(self.directory, self._segment_name + OPEN_SUFFIX), 'ab')
+        self._segment_size = 0
+
+    def _seal_segment(self):
+        if self._segment is None:
+            return
+        self._segment.close()
+        base = os.path.join(self.directory, self._segment_name)
+        os.replace(base + OPEN_SUFFIX, base + SEALED_SUFFIX)
+        self._segment = None
+
+    def _write_batch(self, batch):
+        data = b''.join(
+            json.dumps(event, separators=(',', ':'), default=str).encode() + b'\n' for event in batch
+        )
+        with self._write_lock:
+            try:
+                if self._segment is None:
+                    self._open_segment()
+                self._segment.write(data)
+                self._segment.flush()
+                self._segment_size += len(data)
+                self.written += len(batch)
+                if self._segment_size >= self.segment_bytes:
+                    self._seal_segment()
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Error writing activity events: {str(e)}")
+
+    def flush(self):
+        """
+        Write everything queued so far
+        """
+        while True:
+            batch = self._drain([])
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            self._seal_segment()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_activity_writer():
+    """
+    Get the process-wide activity log writer, configured from settings
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ActivityLogWriter(
+                    get_activity_dir(),
+                    max_size=getattr(settings, 'ACTIVITY_LOG_QUEUE_SIZE', 50000),
+                    batch_size=getattr(settings, 'ACTIVITY_LOG_BATCH_SIZE', 1000),
+                    flush_interval=getattr(settings, 'ACTIVITY_LOG_FLUSH_INTERVAL', 1.0),
+                    segment_bytes=getattr(settings, 'ACTIVITY_LOG_SEGMENT_BYTES', 64 * 1024 * 1024),
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def log_activity(action, user_id=None, session_key=None, product_id=None, category_id=None,
+                 search_term=None, quantity=None):
+    """
+    Queue one activity event
+
+    Returns:
+        False if the event was dropped under backpressure
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown activity action: {action}")
+
+    event = {'ts': round(time.time(), 3), 'action': action}
+    for key, value in (('user_id', user_id), ('session', session_key), ('product_id', product_id),
+                       ('category_id', category_id), ('search_term', search_term), ('quantity', quantity)):
+        if value is not None:
+            event[key] = value
+    return get_activity_writer().emit(event)
+
+
+class ActivityReader:
+    """
+    Incremental reader of the activity log for offline jobs
+
+    Each consumer has a named checkpoint holding the byte offset reached
+    in every segment; a consumer is registered by its checkpoint file or by
+    listing its name in settings.ACTIVITY_LOG_READERS, and segments are
+    only pruned once every registered reader has consumed them. `events()` yields only events written since the last
+    `commit()`, so a job that fails part way re-reads them on its next run.
+    Lines still being written to open segments are left for the next run.
+
+    Example:
+        reader = ActivityReader('copurchase')
+        for event in reader.events():
+            ...
+        reader.commit()
+    """
+
+    def __init__(self, name, directory=None):
+        self.name = name
+        self.directory = directory or get_activity_dir()
+        self.checkpoint_path = os.path.join(self.directory, f"checkpoint-{name}.json")
+        self.offsets = self._load_checkpoint()
+        self._pending = dict(self.offsets)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as checkpoint:
+                return json.load(checkpoint)
+        except FileNotFoundError:
+            return {}
+
+    def segments(self):
+        """
+        Return (name, path, sealed) for every segment, oldest first
+        """
+        segments = []
+        for filename in os.listdir(self.directory):
+            for suffix in (SEALED_SUFFIX, OPEN_SUFFIX):
+                if filename.startswith('activity-') and filename.endswith(suffix):
+                    segments.append((filename[:-len(suffix)], os.path.join(self.directory, filename),
+                                     suffix == SEALED_SUFFIX))
+        return sorted(segments)
+
+    def events(self, actions=None, max_events=None):
+        """
+        Yield event dicts written since the last commit
+
+        Args:
+            actions: Optional collection of actions to keep
+            max_events: Stop after this many events (the rest stay unread)
+        """
+        count = 0
+        for name, path, sealed in self.segments():
+            offset = self._pending.get(name, 0)
+            try:
+                segment = open(path, 'rb')
+            except FileNotFoundError:
+                # Sealed (renamed) or pruned since listing; picked up next time
+                continue
+            with segment:
+                segment.seek(offset)
+                for line in segment:
+                    if not line.endswith(b'\n'):
+                        # Partially written line in an open segment
+                        break
+                    offset += len(line)
+                    self._pending[name] = offset
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        logger.error(f"Skipping malformed activity event in {name}")
+                        continue
+                    if actions is not None and event.get('action') not in actions:
+                        continue
+                    yield event
+                    count += 1
+                    if max_events is not None and count >= max_events:
+                        return
+
+    def commit(self):
+        """
+        Save the position reached by `events()`
+        """
+        # Forget segments that have been pruned
+        existing = {name for name, path, sealed in self.segments()}
+        self.offsets = {name: offset for name, offset in self._pending.items() if name in existing}
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.json')
+        with os.fdopen(handle, 'w') as checkpoint:
+            json.dump(self.offsets, checkpoint)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def reader_offsets(self):
+        """
+        Return {reader name: committed offsets} for every registered reader
+        """
+        readers = {name: {} for name in getattr(settings, 'ACTIVITY_LOG_READERS', [])}
+        for filename in os.listdir(self.directory):
+            if filename.startswith('checkpoint-') and filename.endswith('.json'):
+                name = filename[len('checkpoint-'):-len('.json')]
+                try:
+                    with open(os.path.join(self.directory, filename)) as checkpoint:
+                        readers[name] = json.load(checkpoint)
+                except (OSError, ValueError) as e:
+                    # An unreadable checkpoint must block pruning, not allow it
+                    logger.error(f"Error reading activity checkpoint {filename}: {str(e)}")
+                    readers[name] = {}
+        readers[self.name] = self.offsets
+        return readers
+
+    def prune(self, max_age_days=30):
+        """
+        Delete sealed segments older than `max_age_days` that every
+        registered reader has fully consumed
+
+        Returns:
+            Number of segments deleted
+        """
+        cutoff = time.time() - max_age_days * 86400
+        readers = self.reader_offsets()
+        deleted = 0
+        for name, path, sealed in self.segments():
+            if not sealed or os.path.getmtime(path) >= cutoff:
+                continue
+            size = os.path.getsize(path)
+            if any(offsets.get(name, 0) < size for offsets in readers.values()):
+                continue
+            os.remove(path)
+            self.offsets.pop(name, None)
+            self._pending.pop(name, None)
+            deleted += 1
+        if deleted:
+            self.commit()
+        return deleted
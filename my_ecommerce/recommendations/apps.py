@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class RecommendationsConfig(AppConfig):
+    name = 'recommendations'
+
+    def ready(self):
+        # Register signal handlers that keep recommendation data current
+        from . import signals  # noqa: F401
@@ -0,0 +1,323 @@
+import logging
+import os
+import tempfile
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+from products.models import Product
+from search.stats import paid_order_items
+from .models import PendingCoPurchase, ProductAssociation
+
+logger = logging.getLogger(__name__)
+
+KIND = 'bought_together'
+
+# Neighbours kept per product
+TOP_K = 20
+
+# Pairs bought together fewer times than this are treated as noise
+MIN_CO_COUNT = 2
+
+# Order items read per batch while streaming
+CHUNK_SIZE = 20000
+
+STATE_FILE = 'copurchase.npz'
+
+
+def get_data_dir():
+    """
+    Directory for the recommendation jobs' on-disk state
+    """
+    default = os.path.join(str(getattr(settings, 'BASE_DIR', '.')), 'recommendations_data')
+    path = getattr(settings, 'RECOMMENDATIONS_DATA_DIR', default)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class CoPurchaseMatrix:
+    """
+    Sparse item-item co-occurrence counts over orders
+
+    Products are mapped to dense indices; `counts[i, j]` is the number of
+    orders containing both products (the diagonal holds the number of
+    orders containing each product). Only paid orders are counted. The
+    matrix, the index mapping and the IDs of the queued orders it last
+    took in are saved together, so later runs only read newly paid orders
+    (see PendingCoPurchase).
+    """
+
+    def __init__(self, product_ids=None, counts=None, order_count=0, consumed=None):
+        self.product_ids = np.asarray(product_ids if product_ids is not None else [], dtype=np.int64)
+        self.index = {int(product_id): i for i, product_id in enumerate(self.product_ids)}
+        size = len(self.product_ids)
+        self.counts = counts if counts is not None else sparse.csr_matrix((size, size), dtype=np.int32)
+        self.order_count = order_count
+        # Queued orders counted by the last run, dequeued once it is saved
+        self.consumed = np.asarray(consumed if consumed is not None else [], dtype=np.int64)
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Load the saved matrix, or None if there is no usable saved state
+        """
+        path = path or os.path.join(get_data_dir(), STATE_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as state:
+            if 'consumed' not in state:
+                # Saved by a version that tracked the last order ID
+                return None
+            size = len(state['product_ids'])
+            counts = sparse.csr_matrix(
+                (state['data'], state['indices'], state['indptr']),
+                shape=(size, size)
+            )
+            return cls(
+                product_ids=state['product_ids'],
+                counts=counts,
+                order_count=int(state['order_count']),
+                consumed=state['consumed']
+            )
+
+    def save(self, path=None):
+        path = path or os.path.join(get_data_dir(), STATE_FILE)
+        # Write to a temporary file first so readers never see a partial file
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npz')
+        with os.fdopen(handle, 'wb') as output:
+            np.savez(
+                output,
+                product_ids=self.product_ids,
+                data=self.counts.data,
+                indices=self.counts.indices,
+                indptr=self.counts.indptr,
+                order_count=self.order_count,
+                consumed=self.consumed
+            )
+        os.replace(temp_path, path)
+
+    def _indices_for(self, product_ids):
+        """
+        Map product IDs to matrix indices, growing the mapping for new products
+        """
+        new_ids = [product_id for product_id in dict.fromkeys(product_ids.tolist()) if product_id not in self.index]
+        if new_ids:
+            start = len(self.product_ids)
+            self.product_ids = np.concatenate([self.product_ids, np.asarray(new_ids, dtype=np.int64)])
+            for offset, product_id in enumerate(new_ids):
+                self.index[product_id] = start + offset
+        return np.fromiter((self.index[product_id] for product_id in product_ids.tolist()), dtype=np.int64,
+                           count=len(product_ids))
+
+    def add_orders(self, order_ids, product_ids):
+        """
+        Add the co-purchases of a batch of order lines
+
+        Args:
+            order_ids: Array of order IDs, one per order line
+            product_ids: Array of product IDs, one per order line
+
+        Returns:
+            Array of the matrix indices of the products in the batch
+        """
+        if not len(order_ids):
+            return np.empty(0, dtype=np.int64)
+
+        columns = self._indices_for(product_ids)
+        orders, rows = np.unique(order_ids, return_inverse=True)
+        size = len(self.product_ids)
+
+        # Order x product incidence matrix; an order counts a product once
+        # however many lines it has for it
+        incidence = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(len(orders), size)
+        )
+        incidence.data[:] = 1
+
+        delta = (incidence.T @ incidence).tocsr()
+        current = self.counts
+        if current.shape != delta.shape:
+            current = sparse.csr_matrix(
+                (current.data, current.indices, np.pad(current.indptr, (0, size - current.shape[0]), mode='edge')),
+                shape=(size, size)
+            )
+        self.counts = (current + delta).tocsr()
+        self.order_count += len(orders)
+        return np.unique(columns)
+
+    def neighbours(self, rows, top_k=TOP_K, metric='lift', min_co_count=MIN_CO_COUNT):
+        """
+        Yield (product_id, [(related_product_id, score, co_count), ...]) for
+        the given matrix rows, best neighbours first
+
+        Scores normalize co-purchase counts by popularity so bestsellers
+        don't appear next to everything:
+            lift: P(i and j) / (P(i) * P(j))
+            jaccard: |i and j| / |i or j|
+        """
+        popularity = self.counts.diagonal().astype(np.float64)
+        total = float(max(self.order_count, 1))
+        indptr, indices, data = self.counts.indptr, self.counts.indices, self.counts.data
+
+        for row in rows:
+            start, end = indptr[row], indptr[row + 1]
+            columns = indices[start:end]
+            co_counts = data[start:end]
+            keep = (columns != row) & (co_counts >= min_co_count)
+            columns, co_counts = columns[keep], co_counts[keep].astype(np.float64)
+            if not len(columns):
+                yield int(self.product_ids[row]), []
+                continue
+
+            if metric == 'jaccard':
+                scores = co_counts / (popularity[row] + popularity[columns] - co_counts)
+            else:
+                scores = co_counts * total / (popularity[row] * popularity[columns])
+
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k - 1)[:top_k]
+            else:
+                best = np.arange(len(scores))
+            best = best[np.lexsort((-co_counts[best], -scores[best]))]
+            yield int(self.product_ids[row]), [
+                (int(self.product_ids[columns[i]]), float(scores[i]), int(co_counts[i])) for i in best
+            ]
+
+
+def iter_order_lines(order_ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield (order_ids, product_ids) arrays of paid order lines, never
+    splitting an order across chunks
+
+    Args:
+        order_ids: Only read these orders; all paid orders by default
+    """
+    lines = paid_order_items()
+    if order_ids is not None:
+        lines = lines.filter(order_id__in=list(order_ids))
+    lines = lines.order_by('order_id').values_list('order_id', 'product_id')
+
+    order_ids, product_ids = [], []
+    for order_id, product_id in lines.iterator(chunk_size=chunk_size):
+        if len(order_ids) >= chunk_size and order_id != order_ids[-1]:
+            yield np.asarray(order_ids, dtype=np.int64), np.asarray(product_ids, dtype=np.int64)
+            order_ids, product_ids = [], []
+        order_ids.append(order_id)
+        product_ids.append(product_id)
+    if order_ids:
+        yield np.asarray(order_ids, dtype=np.int64), np.asarray(product_ids, dtype=np.int64)
+
+
+def store_neighbours(neighbours, kind=KIND):
+    """
+    Replace the stored association rows of one kind for the given products
+
+    Args:
+        neighbours: Iterable of (product_id, [(related_id, score, co_count), ...])
+        kind: ProductAssociation kind to write
+
+    Returns:
+        Number of association rows written
+    """
+    written = 0
+    batch_ids, batch_rows = [], []
+
+    def flush():
+        # Skip neighbours deleted since their orders were counted
+        related_ids = {row.related_product_id for row in batch_rows}
+        existing = set(Product.objects.filter(id__in=related_ids).values_list('id', flat=True))
+        batch_rows[:] = [row for row in batch_rows if row.related_product_id in existing]
+        with transaction.atomic():
+            ProductAssociation.objects.filter(kind=kind, product_id__in=batch_ids).delete()
+            ProductAssociation.objects.bulk_create(batch_rows, batch_size=5000)
+
+    for product_id, related in neighbours:
+        batch_ids.append(product_id)
+        batch_rows.extend(
+            ProductAssociation(
+                product_id=product_id,
+                related_product_id=related_id,
+                kind=kind,
+                score=score,
+                co_count=co_count
+            )
+            for related_id, score, co_count in related
+        )
+        if len(batch_ids) >= 1000:
+            flush()
+            written += len(batch_rows)
+            batch_ids, batch_rows = [], []
+    if batch_ids:
+        flush()
+        written += len(batch_rows)
+    return written
+
+
+def build_copurchase_associations(full=False, top_k=TOP_K, metric='lift'):
+    """
+    Update the co-purchase matrix with newly paid orders and rewrite the
+    bought-together neighbours of every product they touched
+
+    Incremental runs leave untouched products' neighbours as they were, so
+    their scores drift slightly as the order total grows; run with
+    full=True periodically (e.g. weekly) to rescore everything.
+
+    Args:
+        full: Discard the saved matrix and rebuild from all paid orders
+        top_k: Neighbours kept per product
+        metric: 'lift' or 'jaccard'
+
+    Returns:
+        Dictionary with the number of new orders, updated products and rows
+    """
+    matrix = None if full else CoPurchaseMatrix.load()
+    if matrix is None:
+        full = True
+        matrix = CoPurchaseMatrix()
+    else:
+        # The previous run may have stopped between saving and dequeuing
+        PendingCoPurchase.objects.filter(order_id__in=matrix.consumed.tolist()).delete()
+    previous_order_count = matrix.order_count
+
+    touched = set()
+    if full:
+        read = set()
+        for order_ids, product_ids in iter_order_lines():
+            touched.update(matrix.add_orders(order_ids, product_ids).tolist())
+            read.update(np.unique(order_ids).tolist())
+        # Orders queued before the read was taken are counted in it
+        queued = PendingCoPurchase.objects.values_list('order_id', flat=True)
+        consumed = [order_id for order_id in queued.iterator(chunk_size=CHUNK_SIZE) if order_id in read]
+    else:
+        consumed = list(PendingCoPurchase.objects.order_by('order_id').values_list('order_id', flat=True))
+        for start in range(0, len(consumed), CHUNK_SIZE):
+            for order_ids, product_ids in iter_order_lines(consumed[start:start + CHUNK_SIZE]):
+                touched.update(matrix.add_orders(order_ids, product_ids).tolist())
+
+    rows = range(len(matrix.product_ids)) if full else sorted(touched)
+    written = store_neighbours(matrix.neighbours(rows, top_k=top_k, metric=metric))
+    matrix.consumed = np.asarray(consumed, dtype=np.int64)
+    matrix.save()
+    for start in range(0, len(consumed), CHUNK_SIZE):
+        PendingCoPurchase.objects.filter(order_id__in=consumed[start:start + CHUNK_SIZE]).delete()
+
+    summary = {
+        'orders': matrix.order_count - previous_order_count,
+        'products': len(rows),
+        'associations': written,
+    }
+    logger.info(f"Built co-purchase associations: {summary}")
+    return summary
+
+
+def get_bought_together_ids(product_id, limit=4):
+    """
+    IDs of the products most often bought with a product, best first
+    """
+    return list(
+        ProductAssociation.objects.filter(
+            product_id=product_id,
+            kind=KIND
+        ).order_by('-score').values_list('related_product_id', flat=True)[:limit]
+    )
@@ -0,0 +1,222 @@
+import contextlib
+import datetime
+import logging
+import statistics
+import tempfile
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from orders.models import Order
+from payments.signals import order_paid
+from products.models import Product
+from search.benchmark import summarize
+from search.stats import reconcile_product_stats
+from search.synthetic import SyntheticCatalog
+from .copurchase import build_copurchase_associations
+from .factorization import train_als
+from .personalized import refresh_recommendations
+from .popularity import rebuild_daily_sales
+from .similarity import build_similar_products
+from .utils import (
+    get_frequently_bought_together, get_related_products, get_personalized_recommendations, get_popular_products
+)
+
+logger = logging.getLogger(__name__)
+
+FUNCTIONS = ('frequently_bought_together', 'related_products', 'personalized', 'popular')
+
+
+@contextlib.contextmanager
+def evaluation_environment(verbosity=0):
+    """
+    Swap in throwaway test databases, private in-memory caches and a
+    temporary data directory for the recommendation jobs
+
+    The test databases are created like the test runner does and destroyed
+    on exit, so the synthetic orders, and everything the order_paid
+    receivers write while they are replayed, are thrown away with them.
+    """
+    caches_config = {
+        alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f"evaluation-{alias}"}
+        for alias in settings.CACHES
+    }
+    with tempfile.TemporaryDirectory() as data_dir, override_settings(
+        CACHES=caches_config,
+        RECOMMENDATIONS_DATA_DIR=data_dir
+    ):
+        old_config = setup_databases(verbosity, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity)
+
+
+class FunctionScore:
+    """
+    Accumulated accuracy, coverage and cost of one recommendation function
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.precision = []
+        self.recall = []
+        self.latencies = []
+        self.query_counts = []
+        self.recommended = set()
+
+    def add(self, recommended_ids, targets, k, latency_ms, query_count):
+        self.latencies.append(latency_ms)
+        self.query_counts.append(query_count)
+        self.recommended.update(recommended_ids)
+        if not targets:
+            return
+        hits = len(set(recommended_ids[:k]) & targets)
+        self.precision.append(hits / k)
+        self.recall.append(hits / len(targets))
+
+    def result(self, k, catalog_size):
+        return {
+            'function': self.name,
+            'calls': len(self.latencies),
+            'evaluated': len(self.precision),
+            f'precision@{k}': round(statistics.mean(self.precision), 4) if self.precision else None,
+            f'recall@{k}': round(statistics.mean(self.recall), 4) if self.recall else None,
+            'coverage': round(len(self.recommended) / catalog_size, 4) if catalog_size else None,
+            'latency_ms': summarize(self.latencies) if self.latencies else None,
+            'queries': round(statistics.mean(self.query_counts), 2) if self.query_counts else None,
+        }
+
+
+class ReplayEvaluation:
+    """
+    Replay a synthetic order history in time order and score the
+    recommendation functions against what each shopper actually bought
+
+    The oldest `train_fraction` of the orders is written first and the
+    offline jobs are built from it. Every later order is then replayed:
+    the functions are called as they would be just before the purchase
+    (for the order's first product and its buyer), scored against the
+    order's other products, and only then is the order written and
+    announced with order_paid so incremental updates run, as in
+    production. The co-purchase matrix is updated every `refresh_every`
+    replayed orders.
+
+    Args:
+        products: Synthetic catalog size
+        seed: Random seed for the catalog and orders
+        k: Number of recommendations requested and scored
+        train_fraction: Share of orders used as history
+        max_orders: Limit on the number of replayed orders
+        refresh_every: Replayed orders between incremental offline updates
+    """
+
+    def __init__(self, products=10000, seed=42, k=10, train_fraction=0.8, max_orders=2000, refresh_every=500):
+        self.catalog = SyntheticCatalog(products=products, seed=seed)
+        self.seed = seed
+        self.k = k
+        self.train_fraction = train_fraction
+        self.max_orders = max_orders
+        self.refresh_every = refresh_every
+
+    def build_offline(self):
+        """
+        Run the offline jobs the recommendation functions read
+        """
+        timings = {}
+        for name, job in (
+            ('product_stats', reconcile_product_stats),
+            ('copurchase', lambda: build_copurchase_associations(full=True)),
+            ('similar_products', build_similar_products),
+            ('popularity', rebuild_daily_sales),
+            ('personalized', refresh_recommendations),
+        ):
+            started = time.perf_counter()
+            job()
+            timings[name] = round(time.perf_counter() - started, 3)
+        if getattr(settings, 'RECOMMENDATIONS_STRATEGY', 'precomputed') == 'als':
+            started = time.perf_counter()
+            train_als()
+            timings['als'] = round(time.perf_counter() - started, 3)
+        return timings
+
+    def _measure(self, callable_):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            result = callable_()
+            elapsed = (time.perf_counter() - started) * 1000
+        return [product.id for product in result], elapsed, len(context.captured_queries)
+
+    def evaluate_order(self, scores, user, anchor, purchased_ids):
+        """
+        Score every function for one replayed order
+        """
+        k = self.k
+        others = set(purchased_ids) - {anchor.id}
+        calls = {
+            'frequently_bought_together': (lambda: get_frequently_bought_together(anchor, k), others),
+            'related_products': (lambda: get_related_products(anchor, k), others),
+            'personalized': (lambda: get_personalized_recommendations(user, k), set(purchased_ids)),
+            'popular': (lambda: get_popular_products(k), set(purchased_ids)),
+        }
+        for name, (call, targets) in calls.items():
+            recommended_ids, latency_ms, query_count = self._measure(call)
+            scores[name].add(recommended_ids, targets, k, latency_ms, query_count)
+
+    def run(self, progress=None):
+        """
+        Generate the fixture, replay the held-out orders and return a
+        JSON-serializable report
+
+        Everything runs inside evaluation_environment(), so the configured
+        databases, caches and saved recommendation data are never touched.
+        """
+        with evaluation_environment():
+            return self._run(progress)
+
+    def _run(self, progress):
+        started = time.perf_counter()
+        self.catalog.generate_catalog()
+        plans = sorted(self.catalog.iter_order_plans(), key=lambda plan: plan[1])
+        split = int(len(plans) * self.train_fraction)
+        history, replay = plans[:split], plans[split:split + self.max_orders]
+        self.catalog.generate_orders(history)
+        generate_seconds = time.perf_counter() - started
+
+        offline_timings = self.build_offline()
+
+        User = get_user_model()
+        users = User.objects.in_bulk({user_id for user_id, ordered_at, lines in replay})
+        products = Product.objects.in_bulk({lines[0][0] for user_id, ordered_at, lines in replay})
+        scores = {name: FunctionScore(name) for name in FUNCTIONS}
+
+        for position, plan in enumerate(replay):
+            user_id, ordered_at, lines = plan
+            purchased_ids = [product_id for product_id, quantity in lines]
+            self.evaluate_order(scores, users[user_id], products[purchased_ids[0]], purchased_ids)
+
+            order_ids = self.catalog.generate_orders([plan], first_number=split + position)
+            order_paid.send(sender=Order, order=Order.objects.get(id=order_ids[0]), paid_at=ordered_at)
+
+            if (position + 1) % self.refresh_every == 0:
+                build_copurchase_associations()
+                if progress:
+                    progress(position + 1, len(replay))
+
+        catalog_size = Product.objects.filter(is_active=True).count()
+        return {
+            'meta': {
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'seed': self.seed,
+                'k': self.k,
+                'products': self.catalog.product_count,
+                'history_orders': len(history),
+                'replayed_orders': len(replay),
+                'database': connection.vendor,
+                'strategy': getattr(settings, 'RECOMMENDATIONS_STRATEGY', 'precomputed'),
+                'generate_seconds': round(generate_seconds, 3),
+                'offline_seconds': offline_timings,
+            },
+            'results': [scores[name].result(self.k, catalog_size) for name in FUNCTIONS],
+        }
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from orders.models import OrderItem
+from wishlist.models import WishlistItem
+from .activity import ActivityReader
+from .copurchase import get_data_dir
+
+logger = logging.getLogger(__name__)
+
+# Implicit feedback strength of each interaction
+INTERACTION_WEIGHTS = {
+    'purchase': 1.0,
+    'add_to_wishlist': 0.5,
+    'add_to_cart': 0.3,
+    'view': 0.1,
+}
+
+MANIFEST_FILE = 'als.json'
+
+# Trained model versions kept on disk
+KEEP_VERSIONS = 2
+
+
+def get_model_dir():
+    path = os.path.join(get_data_dir(), 'als')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_interactions(include_activity=True):
+    """
+    Collect implicit feedback as (user_ids, product_ids, weights, purchased)
+    arrays; `purchased` marks interactions that are purchases
+
+    Purchases come from order items and wishlist adds from wishlists; views
+    and cart adds from the activity log when it has any.
+    """
+    users, products, weights, purchased = [], [], [], []
+
+    def add(user_id, product_id, weight, is_purchase=False):
+        users.append(user_id)
+        products.append(product_id)
+        weights.append(weight)
+        purchased.append(is_purchase)
+
+    lines = OrderItem.objects.filter(order__user__isnull=False).values_list('order__user_id', 'product_id')
+    for user_id, product_id in lines.iterator(chunk_size=20000):
+        add(user_id, product_id, INTERACTION_WEIGHTS['purchase'], True)
+
+    wished = WishlistItem.objects.values_list('wishlist__user_id', 'product_id')
+    for user_id, product_id in wished.iterator(chunk_size=20000):
+        add(user_id, product_id, INTERACTION_WEIGHTS['add_to_wishlist'])
+
+    if include_activity:
+        # Never committed, so every training run reads all retained events
+        reader = ActivityReader('factorization')
+        for event in reader.events(actions=('view', 'add_to_cart')):
+            if event.get('user_id') is not None and event.get('product_id') is not None:
+                add(event['user_id'], event['product_id'], INTERACTION_WEIGHTS[event['action']])
+
+    return (
+        np.asarray(users, dtype=np.int64),
+        np.asarray(products, dtype=np.int64),
+        np.asarray(weights, dtype=np.float32),
+        np.asarray(purchased, dtype=bool),
+    )
+
+
+def _solve(fixed, confidence, regularization):
+    """
+    One ALS half-step: recompute every row of the other side
+
+    For row u with observed items i the normal equations are
+        (Y'Y + Y_i'(C_i - 1)Y_i + lambda I) x_u = Y_i' C_i 1
+    which only touch the row's own items besides the shared Y'Y.
+    """
+    size = fixed.shape[1]
+    gram = fixed.T @ fixed + regularization * np.eye(size, dtype=np.float64)
+    output = np.zeros((confidence.shape[0], size), dtype=np.float32)
+    indptr, indices, data = confidence.indptr, confidence.indices, confidence.data
+    for row in range(confidence.shape[0]):
+        start, end = indptr[row], indptr[row + 1]
+        if start == end:
+            continue
+        observed = fixed[indices[start:end]]
+        row_confidence = data[start:end]
+        matrix = gram + (observed.T * (row_confidence - 1.0)) @ observed
+        output[row] = np.linalg.solve(matrix, observed.T @ row_confidence)
+    return output
+
+
+def train_als(factors=64, iterations=15, regularization=0.05, alpha=40.0, seed=42, include_activity=True):
+    """
+    Train an implicit-feedback ALS model (Hu, Koren & Volinsky) and save it
+
+    Args:
+        factors: Number of latent factors
+        iterations: Number of alternating passes
+        regularization: L2 penalty
+        alpha: Confidence scaling; confidence = 1 + alpha * weight
+        seed: Random seed for the initial factors
+        include_activity: Also learn from logged views and cart adds
+
+    Returns:
+        Training report dict (sizes, timings, scoring throughput)
+    """
+    started = time.perf_counter()
+    user_ids, product_ids, weights, purchased = load_interactions(include_activity)
+    load_seconds = time.perf_counter() - started
+    if not len(user_ids):
+        logger.info("No interactions to train the recommender on")
+        return {'users': 0, 'items': 0, 'interactions': 0}
+
+    users, user_rows = np.unique(user_ids, return_inverse=True)
+    items, item_columns = np.unique(product_ids, return_inverse=True)
+    shape = (len(users), len(items))
+
+    # Repeated interactions add up
+    strength = sparse.csr_matrix((weights, (user_rows, item_columns)), shape=shape, dtype=np.float32)
+    confidence = strength.copy()
+    confidence.data = 1.0 + alpha * confidence.data
+    confidence_t = confidence.T.tocsr()
+    bought = sparse.csr_matrix(
+        (np.ones(int(purchased.sum()), dtype=np.int8), (user_rows[purchased], item_columns[purchased])),
+        shape=shape
+    )
+    bought.data[:] = 1
+
+    rng = np.random.default_rng(seed)
+    user_factors = (rng.standard_normal((shape[0], factors)) * 0.01).astype(np.float32)
+    item_factors = (rng.standard_normal((shape[1], factors)) * 0.01).astype(np.float32)
+
+    iteration_seconds = []
+    for _ in range(iterations):
+        iteration_started = time.perf_counter()
+        user_factors = _solve(item_factors.astype(np.float64), confidence, regularization)
+        item_factors = _solve(user_factors.astype(np.float64), confidence_t, regularization)
+        iteration_seconds.append(time.perf_counter() - iteration_started)
+
+    version = save_model(users, items, user_factors, item_factors, bought)
+    model = get_factor_model(reload=True)
+
+    report = {
+        'version': version,
+        'users': shape[0],
+        'items': shape[1],
+        'interactions': int(strength.nnz),
+        'factors': factors,
+        'iterations': iterations,
+        'load_seconds': round(load_seconds, 3),
+        'train_seconds': round(sum(iteration_seconds), 3),
+        'seconds_per_iteration': round(sum(iteration_seconds) / iterations, 3),
+    }
+    if model is not None:
+        report.update(model.benchmark())
+    logger.info(f"Trained ALS recommender: {report}")
+    return report
+
+
+def save_model(users, items, user_factors, item_factors, bought):
+    """
+    Write a model version as .npy files and point the manifest at it
+    """
+    model_dir = get_model_dir()
+    version = f"{time.time_ns():020d}"
+    temp_dir = tempfile.mkdtemp(dir=model_dir, prefix='tmp-')
+    np.save(os.path.join(temp_dir, 'user_ids.npy'), users)
+    np.save(os.path.join(temp_dir, 'item_ids.npy'), items)
+    np.save(os.path.join(temp_dir, 'user_factors.npy'), user_factors)
+    np.save(os.path.join(temp_dir, 'item_factors.npy'), item_factors)
+    np.save(os.path.join(temp_dir, 'bought_indptr.npy'), bought.indptr)
+    np.save(os.path.join(temp_dir, 'bought_indices.npy'), bought.indices)
+    os.replace(temp_dir, os.path.join(model_dir, version))
+
+    handle, temp_path = tempfile.mkstemp(dir=model_dir, suffix='.json')
+    with os.fdopen(handle, 'w') as manifest:
+        json.dump({'version': version}, manifest)
+    os.replace(temp_path, os.path.join(model_dir, MANIFEST_FILE))
+
+    versions = sorted(name for name in os.listdir(model_dir) if name.isdigit())
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(model_dir, old), ignore_errors=True)
+    return version
+
+
+class FactorModel:
+    """
+    A trained model's factor matrices, memory-mapped read-only so worker
+    processes share one copy through the page cache
+    """
+
+    def __init__(self, path, version):
+        self.version = version
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+
+        self.user_ids = np.asarray(load('user_ids'))
+        self.item_ids = np.asarray(load('item_ids'))
+        self.user_factors = load('user_factors')
+        self.item_factors = load('item_factors')
+        self.bought_indptr = load('bought_indptr')
+        self.bought_indices = load('bought_indices')
+
+    def user_row(self, user_id):
+        row = np.searchsorted(self.user_ids, user_id)
+        if row < len(self.user_ids) and self.user_ids[row] == user_id:
+            return int(row)
+        return None
+
+    def _top_k(self, scores, k):
+        k = min(k, scores.shape[-1])
+        if k <= 0:
+            return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+        best = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        order = np.argsort(-np.take_along_axis(scores, best, axis=-1), axis=-1)
+        return np.take_along_axis(best, order, axis=-1)
+
+    def recommend(self, user_id, k=10, exclude_purchased=True):
+        """
+        Top-k product IDs for a user, or [] for users unknown to the model
+        """
+        row = self.user_row(user_id)
+        if row is None:
+            return []
+        scores = self.item_factors @ self.user_factors[row]
+        if exclude_purchased:
+            scores[self.bought_indices[self.bought_indptr[row]:self.bought_indptr[row + 1]]] = -np.inf
+        return [int(self.item_ids[i]) for i in self._top_k(scores, k) if np.isfinite(scores[i])]
+
+    def recommend_batch(self, rows, k=10):
+        """
+        Top-k item indices for many user rows with one matrix product
+        """
+        scores = np.asarray(self.user_factors[rows]) @ np.asarray(self.item_factors).T
+        for position, row in enumerate(rows):
+            scores[position, self.bought_indices[self.bought_indptr[row]:self.bought_indptr[row + 1]]] = -np.inf
+        return self._top_k(scores, k)
+
+    def benchmark(self, sample=1000, batch_size=256, k=10):
+        """
+        Measure scoring throughput on a sample of users
+        """
+        rows = np.arange(min(sample, len(self.user_ids)))
+        if not len(rows):
+            return {}
+        started = time.perf_counter()
+        for start in range(0, len(rows), batch_size):
+            self.recommend_batch(rows[start:start + batch_size], k)
+        batch_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for row in rows[:100]:
+            self.recommend(int(self.user_ids[row]), k)
+        single_seconds = time.perf_counter() - started
+        return {
+            'batch_users_per_second': round(len(rows) / max(batch_seconds, 1e-9), 1),
+            'single_user_ms': round(single_seconds * 1000 / min(len(rows), 100), 3),
+        }
+
+
+_model = None
+_model_checked_at = 0.0
+_model_lock = threading.Lock()
+
+
+def get_factor_model(reload=False):
+    """
+    Get the latest trained model, or None before the first training run
+
+    The manifest is re-read at most every RECOMMENDATIONS_MODEL_CHECK_INTERVAL
+    seconds, so processes pick up retrained models without a restart.
+    """
+    global _model, _model_checked_at
+    interval = getattr(settings, 'RECOMMENDATIONS_MODEL_CHECK_INTERVAL', 60)
+    if not reload and time.monotonic() - _model_checked_at < interval:
+        return _model
+
+    with _model_lock:
+        _model_checked_at = time.monotonic()
+        model_dir = get_model_dir()
+        try:
+            with open(os.path.join(model_dir, MANIFEST_FILE)) as manifest:
+                version = json.load(manifest)['version']
+        except FileNotFoundError:
+            return _model
+        if _model is None or _model.version != version:
+            try:
+                _model = FactorModel(os.path.join(model_dir, version), version)
+            except Exception as e:
+                logger.error(f"Error loading recommender model {version}: {str(e)}")
+    return _model
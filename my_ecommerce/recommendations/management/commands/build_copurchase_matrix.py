@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from recommendations.copurchase import TOP_K, build_copurchase_associations
+
+
+class Command(BaseCommand):
+    help = "Update the co-purchase matrix with new orders and store frequently-bought-together neighbours"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild from all paid orders instead of newly paid ones")
+        parser.add_argument('--top-k', type=int, default=TOP_K, help="Neighbours kept per product")
+        parser.add_argument('--metric', choices=['lift', 'jaccard'], default='lift')
+
+    def handle(self, *args, **options):
+        summary = build_copurchase_associations(
+            full=options['full'],
+            top_k=options['top_k'],
+            metric=options['metric']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {summary['orders']} orders, "
+            f"stored {summary['associations']} neighbours for {summary['products']} products"
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from recommendations.similarity import TOP_K, build_similar_products
+
+
+class Command(BaseCommand):
+    help = "Precompute content-based similar products for every active product"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help="Neighbours kept per product")
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--exact', action='store_true', help="Always use exact search")
+        mode.add_argument('--approximate', action='store_true', help="Always use the LSH index")
+
+    def handle(self, *args, **options):
+        approximate = None
+        if options['exact']:
+            approximate = False
+        elif options['approximate']:
+            approximate = True
+
+        summary = build_similar_products(top_k=options['top_k'], approximate=approximate)
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {summary['associations']} neighbours for {summary['products']} products "
+            f"({'approximate' if summary['approximate'] else 'exact'}, {summary['search_seconds']}s)"
+        ))
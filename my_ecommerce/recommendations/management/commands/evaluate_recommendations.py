@@ -0,0 +1,52 @@
+import json
+from django.core.management.base import BaseCommand
+from recommendations.evaluation import ReplayEvaluation
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay synthetic orders through the recommendation functions and report precision@k, recall@k, "
+        "coverage, latency and query counts. The replay runs in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help="Synthetic catalog size")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--k', type=int, default=10, help="Recommendations requested and scored")
+        parser.add_argument('--train-fraction', type=float, default=0.8, help="Share of orders used as history")
+        parser.add_argument('--max-orders', type=int, default=2000, help="Orders replayed")
+        parser.add_argument('--output', default='recommendation_evaluation.json', help="Where to write the JSON report")
+        parser.add_argument('--baseline', help="Earlier report to compare against")
+
+    def handle(self, *args, **options):
+        evaluation = ReplayEvaluation(
+            products=options['products'],
+            seed=options['seed'],
+            k=options['k'],
+            train_fraction=options['train_fraction'],
+            max_orders=options['max_orders']
+        )
+        report = evaluation.run(progress=lambda done, total: self.stdout.write(f"Replayed {done}/{total} orders"))
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = {result['function']: result for result in json.load(f)['results']}
+
+        k = options['k']
+        for result in report['results']:
+            line = (
+                f"{result['function']:<28} precision@{k}={result[f'precision@{k}']} "
+                f"recall@{k}={result[f'recall@{k}']} coverage={result['coverage']} "
+                f"p50={result['latency_ms']['p50'] if result['latency_ms'] else None}ms queries={result['queries']}"
+            )
+            previous = baseline.get(result['function'])
+            if previous and previous.get(f'precision@{k}') is not None and result[f'precision@{k}'] is not None:
+                delta = result[f'precision@{k}'] - previous[f'precision@{k}']
+                line += f" (precision {delta:+.4f} vs baseline)"
+            self.stdout.write(line)
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
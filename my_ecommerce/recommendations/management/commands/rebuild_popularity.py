@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from recommendations.popularity import RETENTION_DAYS, prune_daily_sales, rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Recompute daily popularity buckets from order items and delete expired ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=RETENTION_DAYS, help="Number of days to recompute")
+
+    def handle(self, *args, **options):
+        written = rebuild_daily_sales(options['days'])
+        pruned = prune_daily_sales()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} daily sales buckets, pruned {pruned}"))
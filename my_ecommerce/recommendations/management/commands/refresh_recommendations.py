@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from recommendations.personalized import refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = "Recompute precomputed recommendation lists for active users and the global fallback list"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true', help="Only refresh lists marked stale by recent views")
+        parser.add_argument('--days', type=int, default=90, help="Activity window defining active users")
+
+    def handle(self, *args, **options):
+        refreshed = refresh_recommendations(stale_only=options['stale'], days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed recommendations for {refreshed} users"))
@@ -0,0 +1,25 @@
+import json
+from django.core.management.base import BaseCommand
+from recommendations.factorization import train_als
+
+
+class Command(BaseCommand):
+    help = "Train the implicit-feedback ALS recommender and report training time and scoring throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factors', type=int, default=64)
+        parser.add_argument('--iterations', type=int, default=15)
+        parser.add_argument('--regularization', type=float, default=0.05)
+        parser.add_argument('--alpha', type=float, default=40.0, help="Confidence scaling of interactions")
+        parser.add_argument('--no-activity', action='store_true', help="Ignore views and cart adds from the activity log")
+
+    def handle(self, *args, **options):
+        report = train_als(
+            factors=options['factors'],
+            iterations=options['iterations'],
+            regularization=options['regularization'],
+            alpha=options['alpha'],
+            include_activity=not options['no_activity']
+        )
+        self.stdout.write(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Trained recommender on {report['interactions']} interactions"))
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.db import models
+from orders.models import Order
+from products.models import Product
+
+
+class ProductAssociation(models.Model):
+    """
+    Precomputed top-k neighbour of a product, written by the offline
+    recommendation jobs and served in one indexed query
+    """
+    KIND_CHOICES = (
+        ('bought_together', 'Frequently bought together'),
+        ('similar', 'Similar products'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='associations')
+    related_product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    score = models.FloatField()
+    co_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('product', 'related_product', 'kind')
+        indexes = [
+            models.Index(fields=['product', 'kind', '-score'], name='association_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_product_id} ({self.kind})"
+
+
+class RecentlyViewed(models.Model):
+    """
+    Persisted recently-viewed product IDs of a logged-in user, most recent
+    first, so the list follows them across devices
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recently_viewed'
+    )
+    product_ids = models.JSONField(default=list, blank=True)
+    version = models.PositiveIntegerField(default=0, help_text="Incremented on every write, for optimistic locking")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'recently viewed'
+
+    def __str__(self):
+        return f"Recently viewed by user {self.user_id}"
+
+
+class RecommendationList(models.Model):
+    """
+    Precomputed ranked product IDs for one user ('user:<id>') or the shared
+    list served to cold users ('global')
+    """
+    key = models.CharField(max_length=64, unique=True)
+    product_ids = models.JSONField(default=list, blank=True)
+    is_stale = models.BooleanField(default=False, db_index=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations for {self.key}"
+
+
+class ProductDailySales(models.Model):
+    """
+    Paid order lines and units of a product on one day
+
+    The category is copied onto the bucket so per-category popularity is
+    summed without joining products.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    category_id = models.IntegerField(blank=True, null=True)
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'day')
+        indexes = [
+            models.Index(fields=['day'], name='daily_sales_day_idx'),
+            models.Index(fields=['category_id', 'day'], name='daily_sales_category_idx'),
+        ]
+
+    def __str__(self):
+        return f"Sales of product {self.product_id} on {self.day}"
+
+
+class PendingCoPurchase(models.Model):
+    """
+    Paid order whose lines the co-purchase matrix has not counted yet
+
+    Queued by the order_paid receiver once the payment has committed, so
+    the next matrix update picks up every paid order once, whatever order
+    their payments commit in. An order lost to a crash between the commit
+    and the signal is recovered by the next full rebuild.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    queued_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Co-purchase update for order {self.order_id}"
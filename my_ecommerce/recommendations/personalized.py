@@ -0,0 +1,257 @@
+import datetime
+import logging
+from array import array
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from orders.models import Order, OrderItem
+from products.models import Product
+from .copurchase import KIND as BOUGHT_TOGETHER
+from .models import ProductAssociation, RecentlyViewed, RecommendationList
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = 'global'
+
+# Product IDs stored per list; requests take a prefix
+LIST_SIZE = 50
+
+# Candidates considered per purchased category
+CATEGORY_CANDIDATES = 30
+
+# Users refreshed per batch
+BATCH_SIZE = 500
+
+
+def list_key(user_id):
+    return f"user:{user_id}"
+
+
+def _cache():
+    return caches[getattr(settings, 'RECOMMENDATIONS_CACHE', 'default')]
+
+
+def _cache_key(key):
+    return f"recommendations:{key}"
+
+
+def _pack(product_ids):
+    return array('q', product_ids).tobytes()
+
+
+def _unpack(packed):
+    product_ids = array('q')
+    product_ids.frombytes(packed)
+    return product_ids.tolist()
+
+
+def compute_global_recommendations(size=LIST_SIZE):
+    """
+    Best sellers of the last 30 days, topped up with the best rated products
+    """
+    products = Product.objects.filter(is_active=True)
+    product_ids = list(
+        products.filter(stats__recent_sales_count__gt=0).order_by(
+            '-stats__recent_sales_count', F('stats__avg_rating').desc(nulls_last=True)
+        ).values_list('id', flat=True)[:size]
+    )
+    if len(product_ids) < size:
+        product_ids += list(
+            products.exclude(id__in=product_ids).order_by(
+                F('stats__avg_rating').desc(nulls_last=True), '-created_at'
+            ).values_list('id', flat=True)[:size - len(product_ids)]
+        )
+    return product_ids
+
+
+class RecommendationBuilder:
+    """
+    Computes ranked recommendation lists for batches of users
+
+    Per-category candidate lists and the global list are loaded once per
+    run and shared by all users in it.
+
+    Args:
+        size: Number of product IDs per list
+        global_ids: Fallback list used to top lists up; computed when omitted
+    """
+
+    def __init__(self, size=LIST_SIZE, global_ids=None):
+        self.size = size
+        self.global_ids = global_ids if global_ids else compute_global_recommendations(size)
+        self._category_candidates = {}
+
+    def category_candidates(self, category_ids):
+        missing = [category_id for category_id in category_ids if category_id not in self._category_candidates]
+        for category_id in missing:
+            self._category_candidates[category_id] = list(
+                Product.objects.filter(category_id=category_id, is_active=True).order_by(
+                    F('stats__avg_rating').desc(nulls_last=True), '-stats__sales_count'
+                ).values_list('id', flat=True)[:CATEGORY_CANDIDATES]
+            )
+        return [self._category_candidates[category_id] for category_id in category_ids]
+
+    def build(self, user_ids):
+        """
+        Return {user_id: [product_id, ...]} for a batch of users
+        """
+        purchased = {user_id: [] for user_id in user_ids}
+        categories = {user_id: [] for user_id in user_ids}
+        lines = OrderItem.objects.filter(order__user_id__in=user_ids).order_by(
+            '-order__date_ordered'
+        ).values_list('order__user_id', 'product_id', 'product__category_id')
+        for user_id, product_id, category_id in lines:
+            if product_id not in purchased[user_id]:
+                purchased[user_id].append(product_id)
+            if category_id is not None and category_id not in categories[user_id]:
+                categories[user_id].append(category_id)
+
+        # Products bought together with each user's purchases
+        all_purchased = {product_id for product_ids in purchased.values() for product_id in product_ids}
+        neighbours = {}
+        for product_id, related_id in ProductAssociation.objects.filter(
+            product_id__in=all_purchased,
+            kind=BOUGHT_TOGETHER
+        ).order_by('product_id', '-score').values_list('product_id', 'related_product_id'):
+            neighbours.setdefault(product_id, []).append(related_id)
+
+        viewed = dict(RecentlyViewed.objects.filter(user_id__in=user_ids).values_list('user_id', 'product_ids'))
+
+        lists = {}
+        for user_id in user_ids:
+            bought = set(purchased[user_id])
+            ranked = []
+            # Round-robin over the sources so no single category dominates
+            sources = [neighbours.get(product_id, []) for product_id in purchased[user_id][:10]]
+            sources += self.category_candidates(categories[user_id][:5])
+            sources.append(viewed.get(user_id) or [])
+            for position in range(max((len(source) for source in sources), default=0)):
+                for source in sources:
+                    if position < len(source):
+                        ranked.append(source[position])
+            ranked += self.global_ids
+
+            lists[user_id] = [
+                product_id for product_id in dict.fromkeys(ranked) if product_id not in bought
+            ][:self.size]
+        return lists
+
+
+def store_recommendations(lists):
+    """
+    Write {key: [product_id, ...]} lists to the table and the cache
+    """
+    existing = RecommendationList.objects.in_bulk(list(lists), field_name='key')
+    new_rows, changed_rows = [], []
+    for key, product_ids in lists.items():
+        row = existing.get(key)
+        if row is None:
+            new_rows.append(RecommendationList(key=key, product_ids=product_ids))
+        else:
+            row.product_ids = product_ids
+            row.is_stale = False
+            row.computed_at = timezone.now()
+            changed_rows.append(row)
+    RecommendationList.objects.bulk_create(new_rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    RecommendationList.objects.bulk_update(changed_rows, ['product_ids', 'is_stale', 'computed_at'],
+                                           batch_size=BATCH_SIZE)
+    _cache().set_many({_cache_key(key): _pack(product_ids) for key, product_ids in lists.items()},
+                      getattr(settings, 'RECOMMENDATIONS_CACHE_TTL', 60 * 60 * 24))
+
+
+def active_user_ids(days=90):
+    """
+    Users who ordered or viewed products in the last `days` days
+    """
+    since = timezone.now() - datetime.timedelta(days=days)
+    user_ids = set(
+        Order.objects.filter(date_ordered__gte=since, user__isnull=False).values_list('user_id', flat=True)
+    )
+    user_ids.update(RecentlyViewed.objects.filter(updated_at__gte=since).values_list('user_id', flat=True))
+    return sorted(user_ids)
+
+
+def refresh_recommendations(user_ids=None, stale_only=False, days=90):
+    """
+    Recompute the global list and the lists of the given (default: all
+    active) users
+
+    Args:
+        user_ids: Users to refresh; defaults to active users
+        stale_only: Only refresh users whose lists were marked stale
+        days: Activity window defining active users
+
+    Returns:
+        Number of user lists written
+    """
+    builder = RecommendationBuilder()
+    store_recommendations({GLOBAL_KEY: builder.global_ids})
+
+    if stale_only:
+        keys = RecommendationList.objects.filter(is_stale=True).values_list('key', flat=True)
+        user_ids = [int(key.split(':', 1)[1]) for key in keys if key.startswith('user:')]
+    elif user_ids is None:
+        user_ids = list(active_user_ids(days))
+    user_ids = list(user_ids)
+
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        batch = user_ids[start:start + BATCH_SIZE]
+        lists = builder.build(batch)
+        store_recommendations({list_key(user_id): product_ids for user_id, product_ids in lists.items()})
+
+    logger.info(f"Refreshed recommendations for {len(user_ids)} users")
+    return len(user_ids)
+
+
+def refresh_user_recommendations(user_id):
+    """
+    Recompute one user's list right away (e.g. after they place an order)
+    """
+    try:
+        # Reuse the stored global list rather than recomputing it
+        builder = RecommendationBuilder(global_ids=get_recommended_ids())
+        lists = builder.build([user_id])
+        store_recommendations({list_key(user_id): lists[user_id]})
+    except Exception as e:
+        logger.error(f"Error refreshing recommendations for user {user_id}: {str(e)}")
+
+
+def mark_recommendations_stale(user_id):
+    """
+    Flag a user's list for the next 'refresh_recommendations --stale' run
+
+    Writes at most once per RECOMMENDATIONS_STALE_INTERVAL seconds per user,
+    so it is cheap enough to call on every product view.
+    """
+    interval = getattr(settings, 'RECOMMENDATIONS_STALE_INTERVAL', 300)
+    if not _cache().add(f"recommendations_stale:{user_id}", 1, interval):
+        return
+    updated = RecommendationList.objects.filter(key=list_key(user_id), is_stale=False).update(is_stale=True)
+    if not updated:
+        RecommendationList.objects.get_or_create(key=list_key(user_id), defaults={'is_stale': True})
+
+
+def get_recommended_ids(user_id=None):
+    """
+    Stored recommendation IDs for a user, or the global list for cold users
+    """
+    cache = _cache()
+    timeout = getattr(settings, 'RECOMMENDATIONS_CACHE_TTL', 60 * 60 * 24)
+    keys = [list_key(user_id), GLOBAL_KEY] if user_id is not None else [GLOBAL_KEY]
+    cached = cache.get_many([_cache_key(key) for key in keys])
+
+    missing = [key for key in keys if _cache_key(key) not in cached]
+    if missing:
+        rows = dict(RecommendationList.objects.filter(key__in=missing).values_list('key', 'product_ids'))
+        for key in missing:
+            # Cold users are cached as an empty list too, so they don't
+            # query the table on every request
+            cached[_cache_key(key)] = _pack(rows.get(key) or [])
+        cache.set_many({_cache_key(key): cached[_cache_key(key)] for key in missing}, timeout)
+
+    for key in keys:
+        product_ids = _unpack(cached[_cache_key(key)])
+        if product_ids:
+            return product_ids
+    return []
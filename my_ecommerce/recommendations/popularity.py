@@ -0,0 +1,181 @@
+import datetime
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from search.category_tree import get_category_tree
+from search.stats import order_paid_at, paid_order_items
+from .models import ProductDailySales
+
+logger = logging.getLogger(__name__)
+
+# Supported rolling windows, in days
+WINDOWS = (1, 7, 30)
+
+# Buckets older than this are deleted by prune_daily_sales()
+RETENTION_DAYS = 90
+
+# Products kept per top list
+TOP_N = 100
+
+
+def record_daily_sales(order, paid_at=None):
+    """
+    Add a paid order's lines to the sales buckets of the day it was paid
+
+    Missing buckets are created first and then all of them are incremented
+    with a single UPDATE statement.
+
+    Args:
+        order: Paid order
+        paid_at: When it was paid, defaults to now
+    """
+    lines = {}
+    for product_id, category_id, quantity in order.items.values_list(
+        'product_id', 'product__category_id', 'quantity'
+    ):
+        orders, units, _ = lines.get(product_id, (0, 0, category_id))
+        lines[product_id] = (orders + 1, units + (quantity or 0), category_id)
+    if not lines:
+        return
+
+    day = timezone.localdate(paid_at or timezone.now())
+    ProductDailySales.objects.bulk_create(
+        [
+            ProductDailySales(product_id=product_id, category_id=category_id, day=day)
+            for product_id, (orders, units, category_id) in lines.items()
+        ],
+        ignore_conflicts=True
+    )
+
+    def increment(index):
+        return Case(
+            *[When(product_id=product_id, then=Value(line[index])) for product_id, line in lines.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+
+    ProductDailySales.objects.filter(day=day, product_id__in=list(lines)).update(
+        orders=F('orders') + increment(0),
+        units=F('units') + increment(1)
+    )
+
+
+def rebuild_daily_sales(days=RETENTION_DAYS):
+    """
+    Recompute the buckets of the last `days` days from paid order items
+
+    Orders are bucketed by the day they were paid, like record_daily_sales()
+    does. Used to backfill the table and to correct drift; everyday
+    counting happens in record_daily_sales().
+
+    Returns:
+        Number of buckets written
+    """
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    rows = paid_order_items().annotate(
+        paid_at=order_paid_at()
+    ).filter(
+        paid_at__date__gte=since
+    ).annotate(
+        day=TruncDate('paid_at')
+    ).values('product_id', 'product__category_id', 'day').annotate(
+        line_count=Count('id'),
+        unit_count=Sum('quantity')
+    ).order_by()
+
+    buckets = [
+        ProductDailySales(
+            product_id=row['product_id'],
+            category_id=row['product__category_id'],
+            day=row['day'],
+            orders=row['line_count'],
+            units=row['unit_count'] or 0
+        )
+        for row in rows.iterator(chunk_size=5000)
+    ]
+    with transaction.atomic():
+        ProductDailySales.objects.filter(day__gte=since).delete()
+        ProductDailySales.objects.bulk_create(buckets, batch_size=5000)
+
+    get_popularity_counter().clear()
+    return len(buckets)
+
+
+def prune_daily_sales(retention_days=RETENTION_DAYS):
+    """
+    Delete buckets that no window needs anymore
+    """
+    cutoff = timezone.localdate() - datetime.timedelta(days=retention_days)
+    deleted, _ = ProductDailySales.objects.filter(day__lt=cutoff).delete()
+    return deleted
+
+
+class PopularityCounter:
+    """
+    In-memory top-N lists of the most ordered products over rolling windows
+
+    Each list is summed from the daily buckets (never from order items)
+    the first time it is needed and kept for `ttl` seconds, so guest
+    homepages are served from memory.
+    """
+
+    def __init__(self, ttl=300, top_n=TOP_N):
+        self.ttl = ttl
+        self.top_n = top_n
+        self._lists = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._lists = {}
+
+    def _compute(self, days, category_id):
+        since = timezone.localdate() - datetime.timedelta(days=days - 1)
+        buckets = ProductDailySales.objects.filter(day__gte=since, product__is_active=True)
+        if category_id is not None:
+            # Include all subcategories of the category
+            buckets = buckets.filter(category_id__in=get_category_tree().expand([category_id]))
+        return list(
+            buckets.values('product_id').annotate(
+                total=Sum('orders')
+            ).order_by('-total', 'product_id').values_list('product_id', flat=True)[:self.top_n]
+        )
+
+    def top(self, days=30, category_id=None):
+        """
+        Product IDs with the most paid order lines in the last `days` days
+
+        Args:
+            days: Window length, one of WINDOWS
+            category_id: Optional category (with its subcategories) to rank within
+        """
+        if days not in WINDOWS:
+            raise ValueError(f"Unsupported popularity window: {days} days")
+
+        key = (days, category_id)
+        entry = self._lists.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        product_ids = self._compute(days, category_id)
+        with self._lock:
+            self._lists[key] = (time.monotonic(), product_ids)
+        return product_ids
+
+
+_counter = None
+
+
+def get_popularity_counter():
+    """
+    Get the process-wide popularity counter, configured from settings
+    """
+    global _counter
+    if _counter is None:
+        _counter = PopularityCounter(ttl=getattr(settings, 'POPULARITY_CACHE_TTL', 300))
+    return _counter
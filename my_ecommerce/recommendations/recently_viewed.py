@@ -0,0 +1,243 @@
+import logging
+import time
+import uuid
+from array import array
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import F
+from django.utils import timezone
+from .models import RecentlyViewed
+
+logger = logging.getLogger(__name__)
+
+# Pre-store session key holding product IDs oldest first
+LEGACY_SESSION_KEY = 'viewed_products'
+
+# Session key holding an anonymous visitor's list token
+SESSION_TOKEN_KEY = 'recently_viewed_token'
+
+# Conflicting writes of a user's list retried (merged) before giving up
+PERSIST_ATTEMPTS = 3
+
+
+class RecentlyViewedStore:
+    """
+    Bounded most-recent-first list of viewed product IDs per user or session
+
+    Lists live in a cache backend as packed 64-bit arrays, so recording a
+    view never touches the session. Logged-in users' lists are also
+    written to the RecentlyViewed table, at most once every
+    `persist_interval` seconds, and loaded from it on a cache miss.
+
+    The table row is the shared copy of a user's list: every write checks
+    the row's version, and when another device or process wrote first the
+    two lists are merged instead of one overwriting the other. The cached
+    list is replaced by the merged one, so caches that aren't shared
+    between processes still converge on every write.
+
+    Args:
+        cache_alias: Cache backend to use; one shared by all processes
+            (e.g. Redis or Memcached) keeps lists consistent between writes
+        max_items: Number of product IDs kept per list
+        persist_interval: Minimum seconds between database writes per user
+        timeout: Seconds an idle list is kept in the cache
+    """
+
+    def __init__(self, cache_alias='default', max_items=30, persist_interval=60, timeout=60 * 60 * 24 * 14):
+        self.cache = caches[cache_alias]
+        self.max_items = max_items
+        self.persist_interval = persist_interval
+        self.timeout = timeout
+        if isinstance(self.cache, (LocMemCache, DummyCache)):
+            logger.warning(
+                f"Recently viewed products use the process-local '{cache_alias}' cache; "
+                f"lists will differ between processes until they are written to the database"
+            )
+
+    def _owner(self, request, create=False):
+        """
+        Return ('user', id) or ('session', token) for a request, or None
+        """
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return 'user', user.pk
+
+        session = getattr(request, 'session', None)
+        if session is None:
+            return None
+        token = session.get(SESSION_TOKEN_KEY)
+        if token is None and create:
+            # Set once per visitor; it survives the key rotation on login,
+            # so the list can be merged into the user's
+            token = session[SESSION_TOKEN_KEY] = uuid.uuid4().hex
+        return ('session', token) if token else None
+
+    def _cache_key(self, owner):
+        return f"recently_viewed:{owner[0]}:{owner[1]}"
+
+    def _merge(self, *lists):
+        return list(dict.fromkeys(product_id for product_ids in lists for product_id in product_ids))[:self.max_items]
+
+    def _load(self, user_id):
+        """
+        Return (product_ids, version) of a user's stored list; version 0
+        means there is no row yet
+        """
+        row = RecentlyViewed.objects.filter(user_id=user_id).values_list('product_ids', 'version').first()
+        if row is None:
+            return [], 0
+        return row[0][:self.max_items], row[1]
+
+    def _read(self, owner):
+        """
+        Return (product_ids, persisted_at, version) for an owner
+
+        The version is the one of the stored list the cached list was last
+        merged with, None when unknown.
+        """
+        entry = self.cache.get(self._cache_key(owner))
+        if entry is not None:
+            packed, persisted_at = entry[:2]
+            version = entry[2] if len(entry) > 2 else None
+            ids = array('q')
+            ids.frombytes(packed)
+            return ids.tolist(), persisted_at, version
+
+        if owner[0] == 'user':
+            product_ids, version = self._load(owner[1])
+            now = time.time()
+            self._write(owner, product_ids, now, version)
+            return product_ids, now, version
+        return [], 0.0, None
+
+    def _write(self, owner, product_ids, persisted_at, version=None):
+        packed = array('q', product_ids[:self.max_items]).tobytes()
+        self.cache.set(self._cache_key(owner), (packed, persisted_at, version), self.timeout)
+
+    def _persist(self, user_id, product_ids, version):
+        """
+        Store a user's list if the stored version is still `version`
+
+        Otherwise the stored list is merged in behind this one and the
+        write is retried.
+
+        Returns:
+            (product_ids, version) as stored, or None when the write failed
+        """
+        try:
+            product_ids = product_ids[:self.max_items]
+            for attempt in range(PERSIST_ATTEMPTS):
+                if version == 0:
+                    row, created = RecentlyViewed.objects.get_or_create(
+                        user_id=user_id,
+                        defaults={'product_ids': product_ids, 'version': 1}
+                    )
+                    if created:
+                        return product_ids, 1
+                elif version is not None:
+                    updated = RecentlyViewed.objects.filter(user_id=user_id, version=version).update(
+                        product_ids=product_ids,
+                        version=F('version') + 1,
+                        updated_at=timezone.now()
+                    )
+                    if updated:
+                        return product_ids, version + 1
+
+                # Written elsewhere since this list was read
+                stored_ids, version = self._load(user_id)
+                product_ids = self._merge(product_ids, stored_ids)
+            logger.error(f"Gave up persisting recently viewed products of user {user_id} after {PERSIST_ATTEMPTS} conflicts")
+        except Exception as e:
+            logger.error(f"Error persisting recently viewed products: {str(e)}")
+        return None
+
+    def get_ids(self, request):
+        """
+        Product IDs viewed by the request's user or session, most recent first
+        """
+        owner = self._owner(request)
+        product_ids = self._read(owner)[0] if owner else []
+        if not product_ids:
+            # Lists recorded in the session before this store existed; copied
+            # so the session data isn't modified
+            session = getattr(request, 'session', None)
+            legacy = session.get(LEGACY_SESSION_KEY) if session is not None else None
+            if legacy:
+                product_ids = list(reversed(legacy))[:self.max_items]
+        return product_ids
+
+    def add(self, request, product_id):
+        """
+        Move a product to the front of the list
+        """
+        owner = self._owner(request, create=True)
+        if owner is None:
+            return
+
+        product_ids, persisted_at, version = self._read(owner)
+        if product_ids and product_ids[0] == product_id:
+            # Reloading the same page changes nothing
+            return
+        product_ids = self._merge([product_id], product_ids)
+
+        now = time.time()
+        if owner[0] == 'user' and now - persisted_at >= self.persist_interval:
+            stored = self._persist(owner[1], product_ids, version)
+            if stored is not None:
+                product_ids, version = stored
+                persisted_at = now
+        self._write(owner, product_ids, persisted_at, version)
+
+    def merge_session_into_user(self, request, user_id):
+        """
+        Prepend an anonymous visitor's list to a user's list (on login)
+        """
+        token = request.session.get(SESSION_TOKEN_KEY)
+        if token is None:
+            return
+        session_owner = ('session', token)
+        session_ids = self._read(session_owner)[0]
+        if not session_ids:
+            return
+
+        user_owner = ('user', user_id)
+        user_ids, persisted_at, version = self._read(user_owner)
+        merged = self._merge(session_ids, user_ids)
+        stored = self._persist(user_id, merged, version)
+        if stored is not None:
+            merged, version = stored
+            persisted_at = time.time()
+        self._write(user_owner, merged, persisted_at, version)
+        self.cache.delete(self._cache_key(session_owner))
+
+    def persist_user(self, user_id):
+        """
+        Write a user's cached list through to the database (on logout)
+        """
+        user_owner = ('user', user_id)
+        if self.cache.get(self._cache_key(user_owner)) is None:
+            return
+        product_ids, persisted_at, version = self._read(user_owner)
+        stored = self._persist(user_id, product_ids, version)
+        if stored is not None:
+            self._write(user_owner, stored[0], time.time(), stored[1])
+
+
+_store = None
+
+
+def get_recently_viewed_store():
+    """
+    Get the process-wide store, configured from settings
+    """
+    global _store
+    if _store is None:
+        _store = RecentlyViewedStore(
+            cache_alias=getattr(settings, 'RECENTLY_VIEWED_CACHE', 'default'),
+            max_items=getattr(settings, 'RECENTLY_VIEWED_MAX_ITEMS', 30),
+            persist_interval=getattr(settings, 'RECENTLY_VIEWED_PERSIST_INTERVAL', 60),
+            timeout=getattr(settings, 'RECENTLY_VIEWED_TIMEOUT', settings.SESSION_COOKIE_AGE),
+        )
+    return _store
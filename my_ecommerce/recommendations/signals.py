@@ -0,0 +1,78 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import transaction
+from django.dispatch import receiver
+from payments.signals import order_paid
+from search.querylog import search_performed
+from .activity import log_activity
+from .models import PendingCoPurchase
+from .personalized import refresh_user_recommendations
+from .popularity import record_daily_sales
+from .recently_viewed import get_recently_viewed_store
+
+
+@receiver(user_logged_in)
+def merge_recently_viewed(sender, request, user, **kwargs):
+    """
+    Carry products viewed before logging in over to the user's list
+    """
+    if request is not None and hasattr(request, 'session'):
+        get_recently_viewed_store().merge_session_into_user(request, user.pk)
+
+
+@receiver(user_logged_out)
+def persist_recently_viewed(sender, request, user, **kwargs):
+    """
+    Write views not yet persisted because of the write throttle
+    """
+    if user is not None:
+        get_recently_viewed_store().persist_user(user.pk)
+
+
+@receiver(order_paid)
+def refresh_recommendations_after_order(sender, order, **kwargs):
+    """
+    Recompute the buyer's recommendation list so it drops what they bought
+    """
+    user_id = order.user_id
+    if user_id is not None:
+        transaction.on_commit(lambda: refresh_user_recommendations(user_id))
+
+
+@receiver(order_paid)
+def log_purchase_activity(sender, order, **kwargs):
+    """
+    Add a purchase event per order line to the activity log
+    """
+    user_id = order.user_id
+    lines = list(order.items.values_list('product_id', 'quantity'))
+    for product_id, quantity in lines:
+        log_activity('purchase', user_id=user_id, product_id=product_id, quantity=quantity)
+
+
+@receiver(order_paid)
+def queue_copurchase_update(sender, order, **kwargs):
+    """
+    Queue a paid order for the next co-purchase matrix update
+    """
+    PendingCoPurchase.objects.bulk_create([PendingCoPurchase(order=order)], ignore_conflicts=True)
+
+
+@receiver(order_paid)
+def count_daily_sales(sender, order, paid_at=None, **kwargs):
+    """
+    Add a paid order's lines to the popularity buckets of its payment day
+    """
+    record_daily_sales(order, paid_at)
+
+
+@receiver(search_performed)
+def log_search_activity(sender, query_string, user_id=None, session_key=None, **kwargs):
+    """
+    Add a search event to the activity log
+    """
+    log_activity(
+        'search',
+        user_id=user_id,
+        session_key=session_key if user_id is None else None,
+        search_term=query_string[:255]
+    )
@@ -0,0 +1,245 @@
+import logging
+import math
+import re
+import time
+import zlib
+from collections import Counter
+import numpy as np
+from scipy import sparse
+from products.models import Product
+from search.category_tree import get_category_tree
+from .copurchase import store_neighbours
+from .models import ProductAssociation
+
+logger = logging.getLogger(__name__)
+
+KIND = 'similar'
+
+# Neighbours kept per product
+TOP_K = 20
+
+# Size of the hashed feature space
+N_FEATURES = 2 ** 20
+
+# Score cells computed per exact-search batch (rows x products)
+BATCH_CELLS = 32 * 1024 * 1024
+
+# Catalog size from which the approximate index is used by default
+APPROXIMATE_THRESHOLD = 200000
+
+# Relative weight of each text field
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'short_description': 1.5,
+    'description': 1.0,
+}
+BRAND_WEIGHT = 2.0
+CATEGORY_WEIGHT = 2.0
+ANCESTOR_WEIGHT = 1.0
+
+TOKEN_RE = re.compile(r'\w{2,}')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def feature_index(token):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(token.encode('utf-8')) % N_FEATURES
+
+
+def product_features(name, short_description, description, brand_id, category_id, tree):
+    """
+    Weighted term counts of one product as {feature: weight}
+    """
+    features = Counter()
+    for field, text in (('name', name), ('short_description', short_description), ('description', description)):
+        for token in tokenize(text):
+            features[feature_index(token)] += FIELD_WEIGHTS[field]
+    if brand_id is not None:
+        features[feature_index(f"brand:{brand_id}")] += BRAND_WEIGHT
+    if category_id is not None:
+        features[feature_index(f"category:{category_id}")] += CATEGORY_WEIGHT
+        for ancestor_id in tree.ancestors(category_id):
+            features[feature_index(f"category:{ancestor_id}")] += ANCESTOR_WEIGHT
+    return features
+
+
+class SimilarityIndex:
+    """
+    L2-normalized hashed TF-IDF vectors of the catalog as a sparse matrix,
+    so cosine similarity is a sparse matrix product
+
+    Args:
+        product_ids: Array of product IDs, one per matrix row
+        matrix: CSR matrix (products x N_FEATURES) with unit-length rows
+    """
+
+    def __init__(self, product_ids, matrix):
+        self.product_ids = product_ids
+        self.matrix = matrix
+
+    @classmethod
+    def build(cls, rows):
+        """
+        Args:
+            rows: Iterable of (id, name, short_description, description,
+                brand_id, category_id) tuples
+        """
+        tree = get_category_tree()
+        product_ids, indptr, indices, data = [], [0], [], []
+        for product_id, name, short_description, description, brand_id, category_id in rows:
+            features = product_features(name, short_description, description, brand_id, category_id, tree)
+            product_ids.append(product_id)
+            indices.extend(features.keys())
+            # Sublinear term frequency
+            data.extend(1.0 + math.log(weight) if weight >= 1 else weight for weight in features.values())
+            indptr.append(len(indices))
+
+        matrix = sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr)),
+            shape=(len(product_ids), N_FEATURES)
+        )
+        matrix.sum_duplicates()
+
+        # Inverse document frequency
+        document_frequency = np.bincount(matrix.indices, minlength=N_FEATURES)
+        idf = np.log((1.0 + len(product_ids)) / (1.0 + document_frequency)).astype(np.float32) + 1.0
+        matrix = (matrix @ sparse.diags(idf)).tocsr()
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        matrix = (sparse.diags(1.0 / norms) @ matrix).tocsr().astype(np.float32)
+        return cls(np.asarray(product_ids, dtype=np.int64), matrix)
+
+    def _top(self, row, candidates, scores, top_k):
+        keep = candidates != row
+        candidates, scores = candidates[keep], scores[keep]
+        keep = scores > 0
+        candidates, scores = candidates[keep], scores[keep]
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return int(self.product_ids[row]), [
+            (int(self.product_ids[candidates[i]]), float(scores[i]), 0) for i in order
+        ]
+
+    def neighbours(self, top_k=TOP_K):
+        """
+        Exact top-k cosine neighbours of every product
+
+        Rows are scored against the whole catalog in batches sized so one
+        batch's dense score block stays around BATCH_CELLS cells.
+        """
+        count = len(self.product_ids)
+        transposed = self.matrix.T.tocsr()
+        batch_size = max(1, BATCH_CELLS // max(count, 1))
+        all_columns = np.arange(count)
+        for start in range(0, count, batch_size):
+            end = min(start + batch_size, count)
+            scores = (self.matrix[start:end] @ transposed).toarray()
+            for offset in range(end - start):
+                yield self._top(start + offset, all_columns, scores[offset], top_k)
+
+    def approximate_neighbours(self, top_k=TOP_K, bits=12, tables=8, max_bucket=2000, seed=42):
+        """
+        Approximate top-k neighbours using random-hyperplane LSH
+
+        Products are hashed into `tables` bucket tables by the signs of
+        `bits` random projections each; only products sharing a bucket in
+        some table are scored exactly. Similar vectors collide with high
+        probability, so far fewer pairs are scored than in exact search.
+        """
+        count = len(self.product_ids)
+        rng = np.random.default_rng(seed)
+
+        # Project only the features in use, not the whole hashed space
+        used, columns = np.unique(self.matrix.indices, return_inverse=True)
+        compact = sparse.csr_matrix(
+            (self.matrix.data, columns.ravel(), self.matrix.indptr),
+            shape=(count, len(used))
+        )
+        weights = 1 << np.arange(bits, dtype=np.int64)
+        codes = np.zeros((count, tables), dtype=np.int64)
+        for table in range(tables):
+            planes = rng.standard_normal((len(used), bits)).astype(np.float32)
+            signs = np.asarray(compact @ planes) > 0
+            codes[:, table] = signs.astype(np.int64) @ weights
+
+        buckets = []
+        for table in range(tables):
+            order = np.argsort(codes[:, table], kind='stable')
+            sorted_codes = codes[order, table]
+            boundaries = np.flatnonzero(np.diff(sorted_codes)) + 1
+            starts = np.concatenate([[0], boundaries])
+            ends = np.concatenate([boundaries, [count]])
+            bucket_of = np.empty(count, dtype=np.int64)
+            for bucket, (start, end) in enumerate(zip(starts, ends)):
+                bucket_of[order[start:end]] = bucket
+            buckets.append((order, starts, ends, bucket_of))
+
+        for row in range(count):
+            members = []
+            for order, starts, ends, bucket_of in buckets:
+                bucket = bucket_of[row]
+                members.append(order[starts[bucket]:ends[bucket]][:max_bucket])
+            candidates = np.unique(np.concatenate(members))
+            scores = (self.matrix[candidates] @ self.matrix[row].T).toarray().ravel()
+            yield self._top(row, candidates, scores, top_k)
+
+
+def build_similar_products(top_k=TOP_K, approximate=None):
+    """
+    Rebuild the similar-products neighbours of every active product
+
+    Args:
+        top_k: Neighbours kept per product
+        approximate: Use the LSH index; defaults to catalogs of at least
+            APPROXIMATE_THRESHOLD products
+
+    Returns:
+        Dictionary with the catalog size, rows written and timings
+    """
+    started = time.perf_counter()
+    rows = Product.objects.filter(is_active=True).order_by('id').values_list(
+        'id', 'name', 'short_description', 'description', 'brand_id', 'category_id'
+    )
+    index = SimilarityIndex.build(rows.iterator(chunk_size=5000))
+    vectorize_seconds = time.perf_counter() - started
+
+    if approximate is None:
+        approximate = len(index.product_ids) >= APPROXIMATE_THRESHOLD
+
+    started = time.perf_counter()
+    if approximate:
+        neighbours = index.approximate_neighbours(top_k)
+    else:
+        neighbours = index.neighbours(top_k)
+    written = store_neighbours(neighbours, kind=KIND)
+
+    # Drop rows of products that are no longer active
+    ProductAssociation.objects.filter(kind=KIND).exclude(product__is_active=True).delete()
+
+    summary = {
+        'products': len(index.product_ids),
+        'associations': written,
+        'approximate': approximate,
+        'vectorize_seconds': round(vectorize_seconds, 3),
+        'search_seconds': round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Built similar products: {summary}")
+    return summary
+
+
+def get_similar_ids(product_id, limit=6):
+    """
+    IDs of the products most similar to a product, best first
+    """
+    return list(
+        ProductAssociation.objects.filter(
+            product_id=product_id,
+            kind=KIND
+        ).order_by('-score').values_list('related_product_id', flat=True)[:limit]
+    )
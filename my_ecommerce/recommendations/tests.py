@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from .activity import ActivityLogWriter, ActivityReader
+
+
+class ActivityLogTests(SimpleTestCase):
+    """
+    Segmented activity log, reader checkpoints and pruning
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # Write from the test thread instead of the background writer
+        patcher = mock.patch.object(ActivityLogWriter, '_ensure_writer')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_segment(self, *product_ids):
+        writer = ActivityLogWriter(self.directory)
+        for product_id in product_ids:
+            writer.emit({'action': 'view', 'product_id': product_id})
+        writer.close()
+
+    def age_segments(self, days=60):
+        old = time.time() - days * 86400
+        for name, path, sealed in ActivityReader('age', self.directory).segments():
+            os.utime(path, (old, old))
+
+    def read(self, name, **kwargs):
+        reader = ActivityReader(name, self.directory)
+        product_ids = [event['product_id'] for event in reader.events(**kwargs)]
+        reader.commit()
+        return product_ids
+
+    def test_reader_resumes_after_its_checkpoint(self):
+        self.write_segment(1, 2)
+        self.assertEqual(self.read('copurchase'), [1, 2])
+
+        self.write_segment(3)
+
+        self.assertEqual(self.read('copurchase'), [3])
+        self.assertEqual(self.read('copurchase'), [])
+        # Each reader keeps its own position
+        self.assertEqual(self.read('popularity'), [1, 2, 3])
+
+    def test_uncommitted_events_are_read_again(self):
+        self.write_segment(1, 2, 3)
+
+        reader = ActivityReader('copurchase', self.directory)
+        self.assertEqual([event['product_id'] for event in reader.events(max_events=2)], [1, 2])
+
+        self.assertEqual(self.read('copurchase'), [1, 2, 3])
+
+    def test_prune_waits_for_every_reader(self):
+        self.write_segment(1, 2)
+        self.read('copurchase')
+        self.read('popularity', max_events=1)
+        self.age_segments()
+
+        self.assertEqual(ActivityReader('copurchase', self.directory).prune(), 0)
+
+        self.read('popularity')
+        self.assertEqual(ActivityReader('copurchase', self.directory).prune(), 1)
+        self.assertEqual(ActivityReader('copurchase', self.directory).segments(), [])
+
+    def test_prune_waits_for_configured_readers_without_a_checkpoint(self):
+        self.write_segment(1)
+        self.read('copurchase')
+        self.age_segments()
+
+        with override_settings(ACTIVITY_LOG_READERS=['similarity']):
+            self.assertEqual(ActivityReader('copurchase', self.directory).prune(), 0)
+            self.read('similarity')
+            self.assertEqual(ActivityReader('copurchase', self.directory).prune(), 1)
+
+    def test_prune_keeps_recent_segments(self):
+        self.write_segment(1)
+        self.read('copurchase')
+
+        self.assertEqual(ActivityReader('copurchase', self.directory).prune(max_age_days=30), 0)
@@ -1,11 +1,19 @@
-from django.db.models import Count, Q, F, ExpressionWrapper, FloatField
-from django.db.models.functions import Coalesce
-from django.utils import timezone
-import datetime
+from django.conf import settings
+from django.db.models import Q, F
 from products.models import Product, Category
-from orders.models import OrderItem
 from reviews.models import Review
+from search.category_tree import get_category_tree
+from .activity import log_activity
+from .copurchase import get_bought_together_ids
+from .factorization import get_factor_model
+from .personalized import get_recommended_ids, mark_recommendations_stale
+from .popularity import get_popularity_counter
+from .recently_viewed import get_recently_viewed_store
+from .similarity import get_similar_ids
 import random
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 def get_recently_viewed_products(request, limit=6):
@@ -17,24 +25,17 @@ def get_recently_viewed_products(request, limit=6):
         limit: Maximum number of products to return
 
     Returns:
-        QuerySet of recently viewed products
+        List of recently viewed products, most recent first
     """
-    # Get recently viewed product IDs from session
-    viewed_products = request.session.get('viewed_products', [])
-
-    # Reverse the list to get most recent first
-    viewed_products.reverse()
-
-    # Get the products
-    products = []
-    for product_id in viewed_products[:limit]:
-        try:
-            product = Product.objects.get(id=product_id, is_active=True)
-            products.append(product)
-        except Product.DoesNotExist:
-            pass
+    # Get recently viewed product IDs, most recent first
+    viewed_products = get_recently_viewed_store().get_ids(request)
+    if not viewed_products:
+        return []
 
-    return products
+    # Fetch them in one query; inactive products are skipped and the
+    # remaining ones keep their recency order
+    products = Product.objects.filter(is_active=True).in_bulk(viewed_products)
+    return [products[pid] for pid in viewed_products if pid in products][:limit]
 
 
 def add_product_to_recently_viewed(request, product):
@@ -48,126 +49,94 @@ def add_product_to_recently_viewed(request, product):
     if isinstance(product, Product):
         product_id = product.id
     else:
-        product_id = product
-
-    # Get current list from session
-    viewed_products = request.session.get('viewed_products', [])
-
-    # Remove if already in list
-    if product_id in viewed_products:
-        viewed_products.remove(product_id)
-
-    # Add to the end of the list
-    viewed_products.append(product_id)
+        product_id = int(product)
 
-    # Keep only the last 30 products
-    viewed_products = viewed_products[-30:]
+    get_recently_viewed_store().add(request, product_id)
 
-    # Save back to session
-    request.session['viewed_products'] = viewed_products
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        mark_recommendations_stale(user.pk)
 
 
 def get_frequently_bought_together(product, limit=4):
     """
     Get products that are frequently bought together with the given product
 
+    Neighbours come from the co-purchase matrix built offline by
+    'manage.py build_copurchase_matrix' (see recommendations.copurchase).
+
     Args:
         product: Product object
         limit: Maximum number of products to return
 
     Returns:
-        QuerySet of products frequently bought with the given product
+        List of products frequently bought with the given product, most
+        related first
     """
-    # Get orders containing the product
-    orders_with_product = OrderItem.objects.filter(
-        product_variant__product=product
-    ).values_list('order_id', flat=True)
-
-    # Get products from these orders, excluding the current product
-    product_ids = OrderItem.objects.filter(
-        order_id__in=orders_with_product
-    ).exclude(
-        product_variant__product=product
-    ).values_list(
-        'product_variant__product', flat=True
-    )
-
-    # Count occurrences of each product
-    product_counts = {}
-    for pid in product_ids:
-        product_counts[pid] = product_counts.get(pid, 0) + 1
-
-    # Sort by count, highest first
-    sorted_products = sorted(product_counts.items(), key=lambda x: x[1], reverse=True)
-
-    # Get top products
-    top_product_ids = [p[0] for p in sorted_products[:limit]]
+    # Read a few spare neighbours in case some are no longer active
+    top_product_ids = get_bought_together_ids(product.id, limit * 2)
 
-    # Get product objects
     if top_product_ids:
-        return Product.objects.filter(id__in=top_product_ids, is_active=True)
-    else:
-        # Fallback: return related products by category
-        return get_related_products(product, limit)
+        products = Product.objects.filter(is_active=True).in_bulk(top_product_ids)
+        related = [products[pid] for pid in top_product_ids if pid in products][:limit]
+        if related:
+            return related
+
+    # Fallback: return related products by category
+    return get_related_products(product, limit)
 
 
 def get_related_products(product, limit=6):
     """
     Get related products based on category
 
+    Neighbours come from the content-similarity index built offline by
+    'manage.py build_similar_products' (see recommendations.similarity),
+    which compares names, descriptions, brand and category.
+
     Args:
         product: Product object
         limit: Maximum number of products to return
 
     Returns:
-        QuerySet of related products
-    """
-    # Get products from the same category
-    related = Product.objects.filter(
-        category=product.category,
-        is_active=True
-    ).exclude(
-        id=product.id
-    )
-
-    # If not enough products, get from parent category
-    if related.count() < limit and product.category.parent:
-        parent_category_products = Product.objects.filter(
-            category=product.category.parent,
-            is_active=True
-        ).exclude(
-            id=product.id
-        )
-        related = related | parent_category_products
-
-    # If still not enough, get from same brand
-    if related.count() < limit:
-        brand_products = Product.objects.filter(
-            brand=product.brand,
-            is_active=True
-        ).exclude(
+        List of related products, most similar first
+    """
+    # Read a few spare neighbours in case some are no longer active
+    similar_ids = get_similar_ids(product.id, limit * 2)
+    if similar_ids:
+        products = Product.objects.filter(is_active=True).in_bulk(similar_ids)
+        related = [products[pid] for pid in similar_ids if pid in products][:limit]
+        if related:
+            return related
+
+    # Fallback for products the index hasn't seen yet: same category,
+    # parent category or brand, best rated first
+    matches = Q(category_id=product.category_id) | Q(brand_id=product.brand_id)
+    parent_category_id = get_category_tree().parent(product.category_id)
+    if parent_category_id:
+        matches |= Q(category_id=parent_category_id)
+
+    return list(
+        Product.objects.filter(matches, is_active=True).exclude(
             id=product.id
-        )
-        related = related | brand_products
-
-    # Sort by rating
-    related = related.annotate(
-        avg_rating=Coalesce(
-            ExpressionWrapper(
-                F('reviews__rating__sum') * 1.0 / F('reviews__rating__count'),
-                output_field=FloatField()
-            ),
-            0.0
-        )
-    ).order_by('-avg_rating', '-created_at')
-
-    return related.distinct()[:limit]
+        ).order_by(
+            F('stats__avg_rating').desc(nulls_last=True), '-created_at'
+        )[:limit]
+    )
 
 
 def get_personalized_recommendations(user, limit=10):
     """
     Get personalized product recommendations based on user's purchase history
 
+    The strategy is chosen by settings.RECOMMENDATIONS_STRATEGY:
+        'precomputed' (default): lists precomputed by
+            'manage.py refresh_recommendations' and refreshed when the
+            user orders (see recommendations.personalized)
+        'als': scored live from the matrix factorization model trained by
+            'manage.py train_recommender' (see recommendations.factorization)
+    Users unknown to the strategy get the shared global list.
+
     Args:
         user: User object
         limit: Maximum number of products to return
@@ -175,131 +144,94 @@ def get_personalized_recommendations(user, limit=10):
     Returns:
         List of recommended products
     """
-    if not user.is_authenticated:
-        # For guest users, return popular products
-        return get_popular_products(limit)
-
-    # Get products the user has purchased
-    purchased_products = OrderItem.objects.filter(
-        order__user=user
-    ).values_list('product_variant__product', flat=True).distinct()
-
-    # Get products the user has viewed but not purchased
-    viewed_product_ids = user.request.session.get('viewed_products', [])
-    viewed_not_purchased = [pid for pid in viewed_product_ids if pid not in purchased_products]
-
-    # Get categories of purchased products
-    purchased_categories = Product.objects.filter(
-        id__in=purchased_products
-    ).values_list('category', flat=True).distinct()
-
-    # Get highly rated products from these categories
-    recommendations = Product.objects.filter(
-        category__in=purchased_categories,
-        is_active=True
-    ).exclude(
-        id__in=purchased_products
-    ).annotate(
-        avg_rating=Coalesce(
-            ExpressionWrapper(
-                F('reviews__rating__sum') * 1.0 / F('reviews__rating__count'),
-                output_field=FloatField()
-            ),
-            0.0
-        )
-    ).order_by('-avg_rating')[:limit]
+    user_id = user.pk if user.is_authenticated else None
+    recommended_ids = []
 
-    # If not enough recommendations, add from viewed but not purchased
-    if recommendations.count() < limit and viewed_not_purchased:
-        viewed_products = Product.objects.filter(
-            id__in=viewed_not_purchased,
-            is_active=True
-        ).exclude(
-            id__in=[p.id for p in recommendations]
-        )[:limit - recommendations.count()]
+    if user_id is not None and getattr(settings, 'RECOMMENDATIONS_STRATEGY', 'precomputed') == 'als':
+        model = get_factor_model()
+        if model is not None:
+            recommended_ids = model.recommend(user_id, limit * 2)
 
-        recommendations = list(recommendations) + list(viewed_products)
+    if not recommended_ids:
+        recommended_ids = get_recommended_ids(user_id)
 
-    # If still not enough, add popular products
-    if len(recommendations) < limit:
-        popular = get_popular_products(limit - len(recommendations))
-        popular_ids = [p.id for p in popular]
-
-        # Exclude products already in recommendations
-        popular = [p for p in popular if p.id not in [r.id for r in recommendations]]
-
-        recommendations.extend(popular)
+    if not recommended_ids:
+        # Nothing computed yet
+        return get_popular_products(limit)
 
-    return recommendations[:limit]
+    # Fetch a prefix of the list in one query, keeping its order
+    candidate_ids = recommended_ids[:limit * 2]
+    products = Product.objects.filter(is_active=True).in_bulk(candidate_ids)
+    return [products[pid] for pid in candidate_ids if pid in products][:limit]
 
 
-def get_popular_products(limit=10):
+def get_popular_products(limit=10, days=30, category=None):
     """
     Get popular products based on orders and views
 
+    Rankings come from rolling daily sales buckets kept in memory (see
+    recommendations.popularity), so no order items are scanned.
+
     Args:
         limit: Maximum number of products to return
+        days: Popularity window in days (1, 7 or 30)
+        category: Optional Category object or ID to rank within
 
     Returns:
-        QuerySet of popular products
+        List of popular products, most popular first
     """
-    # Get products with most orders in last 30 days
-    thirty_days_ago = timezone.now() - datetime.timedelta(days=30)
-
-    popular = Product.objects.filter(
-        orderitem__order__date_ordered__gte=thirty_days_ago,
-        is_active=True
-    ).annotate(
-        order_count=Count('productvariant__orderitem')
-    ).order_by('-order_count')[:limit]
+    category_id = getattr(category, 'pk', category)
+    popular_ids = get_popularity_counter().top(days, category_id)[:limit]
 
     # If not enough products, supplement with highest rated products
-    if popular.count() < limit:
-        highest_rated = Product.objects.filter(
-            is_active=True
-        ).exclude(
-            id__in=[p.id for p in popular]
-        ).annotate(
-            avg_rating=Coalesce(
-                ExpressionWrapper(
-                    F('reviews__rating__sum') * 1.0 / F('reviews__rating__count'),
-                    output_field=FloatField()
-                ),
-                0.0
-            )
-        ).order_by('-avg_rating')[:limit - popular.count()]
-
-        popular = list(popular) + list(highest_rated)
-
-    return popular
-
-
-def record_user_activity(user, product=None, category=None, search_term=None, action=None):
+    if len(popular_ids) < limit:
+        highest_rated = Product.objects.filter(is_active=True).exclude(id__in=popular_ids)
+        if category_id is not None:
+            highest_rated = highest_rated.filter(category__id__in=get_category_tree().expand([category_id]))
+        popular_ids += list(
+            highest_rated.order_by(
+                F('stats__avg_rating').desc(nulls_last=True), '-created_at'
+            ).values_list('id', flat=True)[:limit - len(popular_ids)]
+        )
+
+    products = Product.objects.filter(is_active=True).in_bulk(popular_ids)
+    return [products[pid] for pid in popular_ids if pid in products]
+
+
+def record_user_activity(user, product=None, category=None, search_term=None, action=None, request=None):
     """
     Record user activity for recommendation algorithm
 
+    Events are queued for the append-only activity log and written in the
+    background (see recommendations.activity); offline jobs read them with
+    an ActivityReader. Under heavy load view events may be dropped.
+
     Args:
         user: User object
         product: Product object (optional)
         category: Category object (optional)
         search_term: Search term (optional)
-        action: Action type (view, purchase, add_to_cart, add_to_wishlist)
+        action: Action type (view, purchase, add_to_cart, add_to_wishlist, search)
+        request: HTTP request object (optional), used for anonymous users' session
     """
-    # This is a placeholder function
-    # In a real implementation, you would store user activity data
-    # This could be done using a UserActivity model or an external service
+    user_id = user.pk if user is not None and user.is_authenticated else None
+    session_key = None
+    if user_id is None and request is not None and hasattr(request, 'session'):
+        session_key = request.session.session_key
 
-    # Example implementation:
-    """
-    from .models import UserActivity
-
-    UserActivity.objects.create(
-        user=user,
-        product=product,
-        category=category,
-        search_term=search_term,
-        action=action,
-        timestamp=timezone.now()
-    )
-    """
-    pass
\ No newline at end of file
+    if category is None and product is not None:
+        category_id = getattr(product, 'category_id', None)
+    else:
+        category_id = getattr(category, 'pk', category)
+
+    try:
+        log_activity(
+            action,
+            user_id=user_id,
+            session_key=session_key,
+            product_id=getattr(product, 'pk', product),
+            category_id=category_id,
+            search_term=search_term
+        )
+    except ValueError as e:
+        logger.error(f"Error recording user activity: {str(e)}")
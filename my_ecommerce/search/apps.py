@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class SearchConfig(AppConfig):
+    name = 'search'
+
+    def ready(self):
+        # Register signal handlers that keep search data structures current
+        from . import signals  # noqa: F401
@@ -0,0 +1,321 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from django.conf import settings
+from products.models import Product, Category, Brand
+
+logger = logging.getLogger(__name__)
+
+Suggestion = namedtuple('Suggestion', ['text', 'kind', 'object_id', 'weight'])
+
+# Prefixes up to this length get a precomputed top list, since their
+# ranges in the sorted key array are too large to scan per request
+SHORT_PREFIX_LENGTH = 3
+
+# Longer prefixes whose range holds more keys than this get a top list too,
+# so no lookup scans more than MAX_SCAN keys
+MAX_SCAN = 500
+
+# Number of suggestions kept per precomputed prefix
+TOP_K = 20
+
+# Fold pending updates into the sorted arrays after this many
+MAX_PENDING = 1000
+
+PrefixArrays = namedtuple('PrefixArrays', ['suggestions', 'keys', 'identities', 'top'])
+
+
+def normalize(text):
+    """
+    Lowercase and collapse whitespace
+    """
+    return ' '.join((text or '').lower().split())
+
+
+def suggestion_keys(text):
+    """
+    Index a suggestion under every word start, so "Apple iPhone 15" is
+    found by "app", "iph" and "15"
+    """
+    words = normalize(text).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+def _top_identities(identities, suggestions):
+    weights = {identity: suggestions[identity].weight for identity in identities}
+    return heapq.nlargest(TOP_K, weights, key=lambda identity: (weights[identity], identity))
+
+
+def build_prefix_arrays(suggestions):
+    """
+    Build the sorted key array and top-k tables for a set of suggestions
+    """
+    entries = []
+    by_identity = {}
+    for suggestion in suggestions:
+        identity = (suggestion.kind, suggestion.object_id)
+        by_identity[identity] = suggestion
+        for key in suggestion_keys(suggestion.text):
+            entries.append((key, identity))
+    entries.sort()
+
+    keys = [key for key, identity in entries]
+    identities = [identity for key, identity in entries]
+
+    top = defaultdict(list)
+    for key, identity in entries:
+        weight = by_identity[identity].weight
+        for length in range(1, min(len(key), SHORT_PREFIX_LENGTH) + 1):
+            heap = top[key[:length]]
+            item = (weight, identity)
+            if len(heap) < TOP_K:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    top = {prefix: [identity for weight, identity in heap] for prefix, heap in top.items()}
+
+    # Extend the table one character at a time below every prefix whose
+    # range is still too large to scan
+    frontier = [prefix for prefix in top if len(prefix) == SHORT_PREFIX_LENGTH]
+    while frontier:
+        next_frontier = []
+        for prefix in frontier:
+            start = bisect_left(keys, prefix)
+            end = bisect_left(keys, prefix + '\uffff')
+            if end - start <= MAX_SCAN:
+                continue
+            position = start
+            while position < end:
+                extended = keys[position][:len(prefix) + 1]
+                if len(extended) == len(prefix):
+                    # Keys equal to the prefix itself sort first
+                    position = bisect_right(keys, extended, position, end)
+                    continue
+                group_end = bisect_left(keys, extended + '\uffff', position, end)
+                if group_end - position > MAX_SCAN:
+                    top[extended] = _top_identities(identities[position:group_end], by_identity)
+                    next_frontier.append(extended)
+                position = group_end
+        frontier = next_frontier
+
+    return PrefixArrays(by_identity, keys, identities, top)
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index of weighted suggestions
+
+    Lookups binary-search the sorted key array for the prefix range; short
+    prefixes, and longer ones matching more than MAX_SCAN keys, are answered
+    from a precomputed top-k table. Updates collect in a small pending set
+    that is merged at query time and folded into the arrays once it grows
+    past MAX_PENDING. The arrays are rebuilt in the background, outside the
+    lock, and swapped in as one immutable PrefixArrays.
+    """
+
+    def __init__(self, suggestions=()):
+        self.built_at = time.monotonic()
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._removed = set()
+        self._compacting = False
+        self._arrays = build_prefix_arrays(suggestions)
+
+    def __len__(self):
+        return len(self._arrays.suggestions)
+
+    def get(self, kind, object_id):
+        identity = (kind, object_id)
+        with self._lock:
+            if identity in self._removed:
+                return None
+            return self._pending.get(identity) or self._arrays.suggestions.get(identity)
+
+    def upsert(self, suggestion):
+        with self._lock:
+            identity = (suggestion.kind, suggestion.object_id)
+            self._removed.discard(identity)
+            self._pending[identity] = suggestion
+            if len(self._pending) > MAX_PENDING and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self.compact, daemon=True).start()
+
+    def remove(self, kind, object_id):
+        with self._lock:
+            identity = (kind, object_id)
+            self._pending.pop(identity, None)
+            self._removed.add(identity)
+
+    def compact(self):
+        """
+        Fold pending updates and removals into the sorted arrays
+
+        The new arrays are built from a copy without holding the lock, so
+        lookups and updates carry on meanwhile; updates made during the
+        build stay pending.
+        """
+        with self._lock:
+            self._compacting = True
+            arrays = self._arrays
+            pending = dict(self._pending)
+            removed = set(self._removed)
+        try:
+            suggestions = dict(arrays.suggestions)
+            suggestions.update(pending)
+            for identity in removed:
+                suggestions.pop(identity, None)
+            new_arrays = build_prefix_arrays(suggestions.values())
+
+            with self._lock:
+                self._arrays = new_arrays
+                for identity, suggestion in pending.items():
+                    if self._pending.get(identity) is suggestion:
+                        del self._pending[identity]
+                # Removals are now reflected by the arrays, unless the
+                # suggestion came back while they were built
+                self._removed -= {identity for identity in removed if identity not in self._pending}
+        except Exception as e:
+            logger.error(f"Error compacting autocomplete index: {str(e)}")
+        finally:
+            self._compacting = False
+
+    def suggest(self, prefix, limit=8):
+        """
+        Return up to `limit` suggestions starting with the prefix, heaviest first
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        with self._lock:
+            arrays = self._arrays
+            pending = list(self._pending.items())
+            hidden = self._removed | set(self._pending)
+
+        identities = arrays.top.get(prefix)
+        if identities is None:
+            if len(prefix) <= SHORT_PREFIX_LENGTH:
+                identities = []
+            else:
+                # At most MAX_SCAN keys, or the prefix would have a top list
+                start = bisect_left(arrays.keys, prefix)
+                end = bisect_left(arrays.keys, prefix + '\uffff')
+                identities = arrays.identities[start:end]
+
+        candidates = {}
+        for identity in identities:
+            if identity not in hidden:
+                candidates[identity] = arrays.suggestions[identity]
+        for identity, suggestion in pending:
+            if any(key.startswith(prefix) for key in suggestion_keys(suggestion.text)):
+                candidates[identity] = suggestion
+
+        return heapq.nlargest(limit, candidates.values(), key=lambda s: (s.weight, s.text))
+
+
+def build_autocomplete_index():
+    """
+    Build the prefix index from products, brands and categories
+
+    Products are weighted by sales; brands and categories by the summed
+    weight of their active products.
+    """
+    suggestions = []
+    brand_weights = defaultdict(int)
+    category_weights = defaultdict(int)
+
+    products = Product.objects.filter(is_active=True).values_list(
+        'id', 'name', 'brand_id', 'category_id', 'stats__sales_count'
+    )
+    for product_id, name, brand_id, category_id, sales_count in products.iterator(chunk_size=5000):
+        weight = 1 + (sales_count or 0)
+        suggestions.append(Suggestion(name, 'product', product_id, weight))
+        brand_weights[brand_id] += weight
+        category_weights[category_id] += weight
+
+    for brand_id, name in Brand.objects.values_list('id', 'name'):
+        suggestions.append(Suggestion(name, 'brand', brand_id, brand_weights.get(brand_id, 0)))
+    for category_id, name in Category.objects.values_list('id', 'name'):
+        suggestions.append(Suggestion(name, 'category', category_id, category_weights.get(category_id, 0)))
+
+    index = PrefixIndex(suggestions)
+    logger.info(f"Built autocomplete index with {len(index)} suggestions")
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def _rebuild_in_background():
+    global _index, _rebuilding
+    try:
+        _index = build_autocomplete_index()
+    except Exception as e:
+        logger.error(f"Error rebuilding autocomplete index: {str(e)}")
+    finally:
+        _rebuilding = False
+
+
+def get_autocomplete_index():
+    """
+    Get the process-wide autocomplete index, building it on first use
+
+    Signal handlers keep the index current for edits made by this process.
+    Edits made elsewhere, and changed sales weights, are picked up by a
+    periodic background rebuild (settings.SEARCH_AUTOCOMPLETE_MAX_AGE
+    seconds, SEARCH_INDEX_MAX_AGE by default), during which the old index
+    keeps serving suggestions.
+    """
+    global _index, _rebuilding
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_autocomplete_index()
+        return _index
+
+    max_age = getattr(settings, 'SEARCH_AUTOCOMPLETE_MAX_AGE', getattr(settings, 'SEARCH_INDEX_MAX_AGE', 3600))
+    if max_age and time.monotonic() - _index.built_at > max_age and not _rebuilding:
+        with _index_lock:
+            if not _rebuilding:
+                _rebuilding = True
+                threading.Thread(target=_rebuild_in_background, daemon=True).start()
+    return _index
+
+
+def update_autocomplete_product(product_id):
+    """
+    Refresh one product's suggestion if this process has loaded the index
+    """
+    index = _index
+    if index is None:
+        return
+    row = Product.objects.filter(id=product_id).values_list('name', 'is_active', 'stats__sales_count').first()
+    if row is None or not row[1]:
+        index.remove('product', product_id)
+    else:
+        index.upsert(Suggestion(row[0], 'product', product_id, 1 + (row[2] or 0)))
+
+
+def update_autocomplete_label(kind, object_id, name):
+    """
+    Refresh a brand or category suggestion after a rename
+    """
+    index = _index
+    if index is None:
+        return
+    existing = index.get(kind, object_id)
+    index.upsert(Suggestion(name, kind, object_id, existing.weight if existing else 0))
+
+
+def remove_autocomplete_entry(kind, object_id):
+    """
+    Drop a suggestion if this process has loaded the index
+    """
+    if _index is not None:
+        _index.remove(kind, object_id)
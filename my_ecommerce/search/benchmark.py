@@ -0,0 +1,217 @@
+import datetime
+import json
+import math
+import random
+import statistics
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from products.models import Product, Brand
+from .category_tree import get_category_tree
+from .synthetic import ADJECTIVES, NOUNS, DESCRIPTION_WORDS
+from .utils import basic_search, advanced_search, get_search_facets, get_related_search_terms
+
+SORT_MODES = [None, 'price_low', 'price_high', 'newest', 'rating', 'popularity', 'bestseller']
+
+PAGE_SIZE = 24
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    index = min(len(ordered), max(1, math.ceil(fraction * len(ordered)))) - 1
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        'p50': round(percentile(latencies, 0.50), 3),
+        'p95': round(percentile(latencies, 0.95), 3),
+        'p99': round(percentile(latencies, 0.99), 3),
+        'mean': round(statistics.mean(latencies), 3),
+        'max': round(max(latencies), 3),
+    }
+
+
+def _plan_rows(plan):
+    """
+    Sum the rows read by scan nodes of a PostgreSQL JSON plan
+    """
+    rows = 0
+    if 'Scan' in plan.get('Node Type', ''):
+        loops = plan.get('Actual Loops', 1)
+        rows += (plan.get('Actual Rows', 0) + plan.get('Rows Removed by Filter', 0)) * loops
+    for child in plan.get('Plans', ()):
+        rows += _plan_rows(child)
+    return rows
+
+
+def rows_scanned(queryset):
+    """
+    Rows read by the scans of a query, via EXPLAIN ANALYZE (PostgreSQL only)
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+        explain = cursor.fetchone()[0]
+    if isinstance(explain, str):
+        explain = json.loads(explain)
+    return _plan_rows(explain[0]['Plan'])
+
+
+class SearchBenchmark:
+    """
+    Run a fixed, seeded query mix through the search functions and report
+    latency percentiles, SQL query counts and rows scanned for every
+    function, sort mode and filter combination
+    """
+
+    def __init__(self, seed=42, queries=20, repeat=3):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.repeat = repeat
+        self.queries = self._query_mix(queries)
+        self.filter_sets = self._filter_sets()
+
+    def _query_mix(self, count):
+        queries = []
+        for _ in range(count):
+            shape = self.rng.random()
+            if shape < 0.4:
+                queries.append(self.rng.choice(NOUNS))
+            elif shape < 0.7:
+                queries.append(f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)}")
+            elif shape < 0.9:
+                queries.append(self.rng.choice(DESCRIPTION_WORDS))
+            else:
+                # Queries that match nothing exercise the empty-result path
+                queries.append(f"zzq{self.rng.randint(0, 9999)}")
+        return queries
+
+    def _filter_sets(self):
+        tree = get_category_tree()
+        roots = sorted(category_id for category_id in tree.names if tree.parent(category_id) is None)
+        leaves = sorted(category_id for category_id in tree.names if not tree.descendant_ids(category_id, False))
+        brand_ids = list(Brand.objects.order_by('id').values_list('id', flat=True)[:20])
+        prices = Product.objects.filter(is_active=True).order_by('base_price').values_list('base_price', flat=True)
+        total = prices.count()
+        low = prices[total // 4] if total else 0
+        high = prices[(3 * total) // 4] if total else 0
+
+        filter_sets = {'none': {}, 'price': {'price_min': low, 'price_max': high}}
+        if roots:
+            filter_sets['category_root'] = {'categories': [roots[0]]}
+        if leaves:
+            filter_sets['category_leaf'] = {'categories': [leaves[0]]}
+        if brand_ids:
+            filter_sets['brands'] = {'brands': brand_ids[:3]}
+        if roots and brand_ids:
+            filter_sets['combined'] = {
+                'price_min': low, 'price_max': high, 'categories': [roots[0]], 'brands': brand_ids[:10],
+            }
+        return filter_sets
+
+    def _measure(self, callable_):
+        """
+        Return (latency_ms, query_count, result) for one call
+        """
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            result = callable_()
+            elapsed = (time.perf_counter() - started) * 1000
+        return elapsed, len(context.captured_queries), result
+
+    def run_search(self, function, sort_by, filter_name, filters):
+        latencies, query_counts, scanned = [], [], []
+        for _ in range(self.repeat):
+            for query in self.queries:
+                def first_page():
+                    return list(function(query, sort_by=sort_by, **filters)[:PAGE_SIZE])
+                elapsed, queries, result = self._measure(first_page)
+                latencies.append(elapsed)
+                query_counts.append(queries)
+
+        # EXPLAIN once per query, outside the timed runs
+        for query in self.queries:
+            rows = rows_scanned(function(query, sort_by=sort_by, **filters)[:PAGE_SIZE])
+            if rows is not None:
+                scanned.append(rows)
+
+        return {
+            'function': function.__name__,
+            'sort_by': sort_by,
+            'filters': filter_name,
+            'latency_ms': summarize(latencies),
+            'queries': round(statistics.mean(query_counts), 2),
+            'rows_scanned': round(statistics.mean(scanned), 1) if scanned else None,
+        }
+
+    def run_facets(self, filter_name, filters):
+        latencies, query_counts = [], []
+        for _ in range(self.repeat):
+            for query in self.queries:
+                elapsed, queries, result = self._measure(
+                    lambda: get_search_facets(basic_search.__wrapped__(query, **filters))
+                )
+                latencies.append(elapsed)
+                query_counts.append(queries)
+        return {
+            'function': 'get_search_facets',
+            'sort_by': None,
+            'filters': filter_name,
+            'latency_ms': summarize(latencies),
+            'queries': round(statistics.mean(query_counts), 2),
+            'rows_scanned': None,
+        }
+
+    def run_related_terms(self):
+        latencies, query_counts = [], []
+        for _ in range(self.repeat):
+            for query in self.queries:
+                elapsed, queries, result = self._measure(lambda: get_related_search_terms(query))
+                latencies.append(elapsed)
+                query_counts.append(queries)
+        return {
+            'function': 'get_related_search_terms',
+            'sort_by': None,
+            'filters': 'none',
+            'latency_ms': summarize(latencies),
+            'queries': round(statistics.mean(query_counts), 2),
+            'rows_scanned': None,
+        }
+
+    def run(self, progress=None):
+        """
+        Run the full matrix and return a JSON-serializable report
+        """
+        results = []
+        # Time the undecorated functions, so runs neither log nor write SearchEvent rows
+        for function in (basic_search.__wrapped__, advanced_search.__wrapped__):
+            for sort_by in SORT_MODES:
+                for filter_name, filters in self.filter_sets.items():
+                    results.append(self.run_search(function, sort_by, filter_name, filters))
+                    if progress:
+                        progress(results[-1])
+        for filter_name, filters in self.filter_sets.items():
+            results.append(self.run_facets(filter_name, filters))
+            if progress:
+                progress(results[-1])
+        results.append(self.run_related_terms())
+        if progress:
+            progress(results[-1])
+
+        return {
+            'meta': {
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'seed': self.seed,
+                'repeat': self.repeat,
+                'queries': self.queries,
+                'database': connection.vendor,
+                'products': Product.objects.count(),
+            },
+            'results': results,
+        }
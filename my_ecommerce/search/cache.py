@@ -0,0 +1,238 @@
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict, namedtuple
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.cache import cache
+from products.models import Product
+from .querylog import record_search
+from .utils import advanced_search, get_search_facets
+
+# Shared generation token; bumping it invalidates every cached result
+GENERATION_CACHE_KEY = 'search:results:generation'
+
+SearchResults = namedtuple('SearchResults', ['product_ids', 'facets'])
+
+
+class SearchResultCache:
+    """
+    Bounded in-process LRU cache of search results with TTL expiry
+
+    Entries are evicted least-recently-used first once either the entry
+    count or the approximate memory bound is exceeded.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_generation(self, generation):
+        """
+        Drop every entry once the catalog generation has moved on
+        """
+        if generation == self.generation:
+            return
+        with self._lock:
+            if generation != self.generation:
+                self.evictions += len(self._entries)
+                self._entries.clear()
+                self.size = 0
+                self.generation = generation
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < now:
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size):
+        # Entries larger than a tenth of the budget would churn the cache
+        if size > self.max_bytes // 10:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size += size
+            while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def _discard(self, key):
+        expires_at, size, value = self._entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'generation': self.generation,
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    """
+    Get the process-wide search result cache, configured from settings
+    """
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = SearchResultCache(
+                    max_entries=getattr(settings, 'SEARCH_CACHE_MAX_ENTRIES', 1000),
+                    max_bytes=getattr(settings, 'SEARCH_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+                    ttl=getattr(settings, 'SEARCH_CACHE_TTL', 300),
+                )
+    return _result_cache
+
+
+def get_search_generation():
+    """
+    Return the current catalog generation, creating one if needed
+    """
+    generation = cache.get(GENERATION_CACHE_KEY)
+    if generation is None:
+        cache.add(GENERATION_CACHE_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_CACHE_KEY)
+    return generation
+
+
+def invalidate_search_results():
+    """
+    Start a new catalog generation so no process serves older results
+    """
+    cache.set(GENERATION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def _normalize_ids(values):
+    ids = set()
+    for value in values or ():
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return tuple(sorted(ids))
+
+
+def _normalize_price(value):
+    if value is None or value == '':
+        return None
+    try:
+        return str(Decimal(str(value)).quantize(Decimal('0.01')))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def normalize_search_key(query_string, sort_by=None, price_min=None, price_max=None, categories=None, brands=None):
+    """
+    Build a canonical key for a search so equivalent requests share entries
+    """
+    return (
+        ' '.join((query_string or '').lower().split()),
+        sort_by or '',
+        _normalize_price(price_min),
+        _normalize_price(price_max),
+        _normalize_ids(categories),
+        _normalize_ids(brands),
+    )
+
+
+def _estimate_size(product_ids, facets):
+    size = sys.getsizeof(product_ids) + 512
+    for name, values in facets.items():
+        if isinstance(values, list):
+            size += 128 * len(values)
+    return size
+
+
+def cached_search(query_string, search_function=None, with_facets=True, request=None, **filters):
+    """
+    Run a search through the result cache
+
+    Results are cached as an ordered array of product IDs plus the facets
+    for the full result set. Product, price, stock, review and category
+    changes bump a shared catalog generation, and the cache drops all its
+    entries once it sees a new one, so a result never outlives an edit.
+
+    Args:
+        query_string: The search term entered by the user
+        search_function: basic_search or advanced_search (the default)
+        with_facets: Whether to compute facets on a cache miss
+        request: Current request, recorded with the search event
+        **filters: sort_by, price_min, price_max, categories, brands
+
+    Returns:
+        SearchResults(product_ids, facets)
+    """
+    started = time.perf_counter()
+    search_function = search_function or advanced_search
+    generation = get_search_generation()
+    key = (search_function.__name__, with_facets) + normalize_search_key(query_string, **filters)
+
+    result_cache = get_search_cache()
+    result_cache.set_generation(generation)
+    results = result_cache.get(key)
+
+    if results is None:
+        # Call the undecorated function; the event is recorded below with the hit count
+        products = getattr(search_function, '__wrapped__', search_function)(query_string, **filters)
+        product_ids = array('q', products.values_list('id', flat=True))
+        facets = get_search_facets(products) if with_facets else {}
+
+        results = SearchResults(product_ids, facets)
+        result_cache.set(key, results, _estimate_size(product_ids, facets))
+
+    filters = dict(filters)
+    sort_by = filters.pop('sort_by', None)
+    record_search(
+        query_string,
+        filters,
+        sort_by=sort_by,
+        hit_count=len(results.product_ids),
+        latency_ms=(time.perf_counter() - started) * 1000,
+        request=request
+    )
+    return results
+
+
+def get_products_for_ids(product_ids):
+    """
+    Load products for a slice of cached IDs with one query, keeping order
+    """
+    products = Product.objects.filter(is_active=True).in_bulk(list(product_ids))
+    return [products[product_id] for product_id in product_ids if product_id in products]
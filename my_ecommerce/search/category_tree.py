@@ -0,0 +1,164 @@
+import threading
+import uuid
+from array import array
+from collections import defaultdict
+from django.core.cache import cache
+from products.models import Category
+
+# Shared version token; bumping it makes every process rebuild its snapshot
+VERSION_CACHE_KEY = 'search:category_tree:version'
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+class CategoryTree:
+    """
+    Immutable in-process snapshot of the category tree
+
+    Categories are stored in preorder, so the subtree of every category is
+    a contiguous slice of that order. This acts as a precomputed closure
+    table: descendant lookups are a slice, with no database round trips.
+    """
+
+    def __init__(self, rows, version=None):
+        """
+        Args:
+            rows: Iterable of (id, parent_id, name) tuples
+            version: Version token the snapshot was built for
+        """
+        self.version = version
+        self.names = {}
+        self.parents = {}
+        children = defaultdict(list)
+
+        for category_id, parent_id, name in rows:
+            self.names[category_id] = name
+            self.parents[category_id] = parent_id
+            children[parent_id].append(category_id)
+
+        # Categories whose parent is missing are treated as roots
+        roots = [cid for cid, pid in self.parents.items() if pid is None or pid not in self.names]
+
+        self.order = array('q')
+        self.start = {}
+        self.end = {}
+
+        for root in sorted(roots):
+            # Iterative depth-first walk; the exit marker closes the interval
+            stack = [(root, False)]
+            while stack:
+                category_id, leaving = stack.pop()
+                if leaving:
+                    self.end[category_id] = len(self.order)
+                    continue
+                if category_id in self.start:
+                    continue
+                self.start[category_id] = len(self.order)
+                self.order.append(category_id)
+                stack.append((category_id, True))
+                for child_id in sorted(children.get(category_id, ()), reverse=True):
+                    stack.append((child_id, False))
+
+    def __contains__(self, category_id):
+        return category_id in self.start
+
+    def descendant_ids(self, category_id, include_self=True):
+        """
+        Return the IDs of all descendants of a category (preorder)
+        """
+        if category_id not in self.start:
+            return []
+        start = self.start[category_id]
+        if not include_self:
+            start += 1
+        return list(self.order[start:self.end[category_id]])
+
+    def expand(self, category_ids):
+        """
+        Return the IDs of the given categories and all their descendants
+
+        Overlapping subtrees are merged first, so the cost is proportional
+        to the size of the result. Unknown or malformed IDs are ignored.
+
+        Args:
+            category_ids: Iterable of category IDs (ints or numeric strings)
+
+        Returns:
+            Set of category IDs
+        """
+        intervals = []
+        for category_id in category_ids:
+            try:
+                category_id = int(category_id)
+            except (TypeError, ValueError):
+                continue
+            if category_id in self.start:
+                intervals.append((self.start[category_id], self.end[category_id]))
+
+        result = set()
+        covered_until = -1
+        for start, end in sorted(intervals):
+            if end <= covered_until:
+                # Nested inside a subtree that was already added
+                continue
+            start = max(start, covered_until)
+            result.update(self.order[start:end])
+            covered_until = end
+        return result
+
+    def parent(self, category_id):
+        """
+        Return the parent ID of a category, or None for roots
+        """
+        return self.parents.get(category_id)
+
+    def ancestors(self, category_id):
+        """
+        Return the IDs of the ancestors of a category, nearest first
+        """
+        ancestors = []
+        parent_id = self.parents.get(category_id)
+        while parent_id is not None and parent_id in self.names and parent_id not in ancestors:
+            ancestors.append(parent_id)
+            parent_id = self.parents.get(parent_id)
+        return ancestors
+
+
+def get_tree_version():
+    """
+    Return the current shared tree version, creating one if needed
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def get_category_tree():
+    """
+    Get the category tree snapshot for the current version
+
+    The snapshot is rebuilt with a single query when another process (or
+    this one) has invalidated it since it was built.
+    """
+    global _snapshot
+
+    version = get_tree_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            rows = Category.objects.values_list('id', 'parent_id', 'name')
+            _snapshot = CategoryTree(rows.iterator(), version=version)
+        return _snapshot
+
+
+def invalidate_category_tree():
+    """
+    Invalidate the category tree snapshot in every process
+    """
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
@@ -0,0 +1,114 @@
+import logging
+import threading
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from products.models import Product
+from .models import ProductSearchDocument
+
+logger = logging.getLogger(__name__)
+
+# Number of products whose documents are rebuilt per UPDATE statement
+REINDEX_BATCH_SIZE = 2000
+
+# Product fields that contribute to the stored search document
+DOCUMENT_FIELDS = {'name', 'short_description', 'description', 'brand', 'brand_id', 'category', 'category_id'}
+
+
+def search_documents_enabled():
+    """
+    Stored search documents are only maintained on PostgreSQL
+    """
+    return connection.vendor == 'postgresql'
+
+
+def get_search_vector():
+    """
+    Build the weighted search vector stored for each product
+
+    Weights: name A, short_description/brand/category B, description C
+    """
+    return (
+            SearchVector('name', weight='A') +
+            SearchVector('short_description', weight='B') +
+            SearchVector('description', weight='C') +
+            SearchVector('brand__name', weight='B') +
+            SearchVector('category__name', weight='B')
+    )
+
+
+def update_search_documents(product_ids):
+    """
+    Create or refresh the stored search documents for the given products
+
+    Each batch is refreshed with a single UPDATE that computes the vector
+    in the database, so no product text is loaded into Python.
+
+    Args:
+        product_ids: Iterable of product IDs to reindex
+
+    Returns:
+        Number of documents updated
+    """
+    product_ids = list(product_ids)
+    updated = 0
+
+    for start in range(0, len(product_ids), REINDEX_BATCH_SIZE):
+        batch = product_ids[start:start + REINDEX_BATCH_SIZE]
+
+        # Make sure a document row exists for every product in the batch
+        ProductSearchDocument.objects.bulk_create(
+            [ProductSearchDocument(product_id=product_id) for product_id in batch],
+            ignore_conflicts=True
+        )
+
+        document = Product.objects.filter(
+            pk=OuterRef('pk')
+        ).annotate(
+            document=get_search_vector()
+        ).values('document')[:1]
+
+        updated += ProductSearchDocument.objects.filter(
+            product_id__in=batch
+        ).update(document=Subquery(document))
+
+    return updated
+
+
+def remove_search_document(product_id):
+    """
+    Delete the stored search document of a deleted product
+    """
+    ProductSearchDocument.objects.filter(product_id=product_id).delete()
+
+
+def reindex_products(**lookups):
+    """
+    Rebuild the search documents of every product matching the lookups,
+    e.g. reindex_products(brand_id=3) after a brand has been renamed
+
+    Returns:
+        Number of documents updated
+    """
+    product_ids = Product.objects.filter(**lookups).values_list('id', flat=True)
+    return update_search_documents(product_ids.iterator(chunk_size=REINDEX_BATCH_SIZE))
+
+
+def reindex_products_in_background(**lookups):
+    """
+    Run reindex_products in a background thread, so e.g. renaming a large
+    brand doesn't hold up the request that saved it
+
+    A reindex cut short by a restart is redone with the
+    rebuild_search_documents command.
+    """
+    def run():
+        try:
+            updated = reindex_products(**lookups)
+            logger.info(f"Reindexed {updated} search documents for {lookups}")
+        except Exception as e:
+            logger.error(f"Error reindexing search documents for {lookups}: {str(e)}")
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name='search-document-reindex', daemon=True).start()
@@ -0,0 +1,252 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Floor
+from django.utils.module_loading import import_string
+from products.models import Product
+from .category_tree import get_category_tree
+
+# How per-group values of each aggregate are combined into the facet total
+FOLDS = {
+    Count: sum,
+    Sum: sum,
+    Min: min,
+    Max: max,
+}
+
+
+class Facet:
+    """
+    Base class for facets computed by the FacetEngine
+
+    Facets are aggregated in the database. A facet declares aggregates over
+    the matching products and/or expressions to count the products by; the
+    engine computes all facets with one GROUP BY query (see FacetEngine).
+    Facet instances hold configuration only, so they can be shared between
+    threads.
+    """
+    name = None
+
+    def get_annotations(self):
+        """
+        Return extra expressions the aggregates or grouping refer to
+        """
+        return {}
+
+    def get_aggregates(self):
+        """
+        Return {key: aggregate expression} computed over the matching products
+        """
+        return {}
+
+    def get_group_by(self):
+        """
+        Return the expression to count the matching products by, if any
+
+        A tuple of expressions counts by their combination; the keys of
+        `counts` are then tuples too.
+        """
+        return None
+
+    def result(self, aggregates, counts):
+        """
+        Build the facet from its aggregates and its {value: product count}
+        (None when the facet doesn't group)
+        """
+        raise NotImplementedError
+
+
+class PriceRangeFacet(Facet):
+    name = 'price_range'
+
+    def get_aggregates(self):
+        return {'min_price': Min('base_price'), 'max_price': Max('base_price')}
+
+    def result(self, aggregates, counts):
+        return aggregates
+
+
+class CategoryFacet(Facet):
+    name = 'categories'
+
+    def get_group_by(self):
+        return F('category_id')
+
+    def result(self, aggregates, counts):
+        # Names come from the in-process category tree snapshot
+        names = get_category_tree().names
+        categories = [
+            {'id': category_id, 'name': names.get(category_id, ''), 'product_count': count}
+            for category_id, count in counts.items()
+            if category_id is not None
+        ]
+        return sorted(categories, key=lambda c: (-c['product_count'], c['name']))
+
+
+class BrandFacet(Facet):
+    name = 'brands'
+
+    def get_group_by(self):
+        # The name depends on the ID only, so grouping by it too is free and
+        # saves looking the brands up afterwards
+        return (F('brand_id'), F('brand__name'))
+
+    def result(self, aggregates, counts):
+        brands = [
+            {'id': brand_id, 'name': name or '', 'product_count': count}
+            for (brand_id, name), count in counts.items()
+            if brand_id is not None
+        ]
+        return sorted(brands, key=lambda b: (-b['product_count'], b['name']))
+
+
+class RatingBucketFacet(Facet):
+    """
+    Count products per "N stars & up" rating bucket
+    """
+    name = 'ratings'
+
+    def __init__(self, thresholds=(4, 3, 2, 1)):
+        self.thresholds = tuple(sorted(thresholds, reverse=True))
+
+    def get_annotations(self):
+        return {'facet_avg_rating': F('stats__avg_rating')}
+
+    def get_aggregates(self):
+        return {
+            f"min_{threshold}": Count('id', filter=Q(facet_avg_rating__gte=threshold))
+            for threshold in self.thresholds
+        }
+
+    def result(self, aggregates, counts):
+        return [
+            {'min_rating': threshold, 'product_count': aggregates[f"min_{threshold}"]}
+            for threshold in self.thresholds
+        ]
+
+
+class PriceHistogramFacet(Facet):
+    """
+    Count products per fixed-width price bucket
+    """
+    name = 'price_histogram'
+
+    def __init__(self, bucket_width=50):
+        self.bucket_width = bucket_width
+
+    def get_group_by(self):
+        return Floor(F('base_price') / Value(self.bucket_width))
+
+    def result(self, aggregates, counts):
+        buckets = {}
+        for bucket, count in counts.items():
+            if bucket is not None:
+                buckets[int(bucket)] = buckets.get(int(bucket), 0) + count
+        return [
+            {
+                'min_price': bucket * self.bucket_width,
+                'max_price': (bucket + 1) * self.bucket_width,
+                'product_count': buckets[bucket],
+            }
+            for bucket in sorted(buckets)
+        ]
+
+
+DEFAULT_FACETS = (PriceRangeFacet(), CategoryFacet(), BrandFacet())
+
+
+class FacetEngine:
+    """
+    Compute several facets with a single aggregate query
+
+    The matching products are narrowed down by an id IN (search query)
+    subquery, so joins in the search query can't count a product twice.
+    The products are grouped by every grouping facet's expressions at once
+    and each group carries the product count and every facet's aggregates;
+    the groups are then folded in Python into per-facet counts and totals
+    (see FOLDS). Aggregates that can't be folded from groups, such as Avg,
+    get one extra aggregate query. Only aggregated rows leave the database.
+    """
+
+    def __init__(self, facets=DEFAULT_FACETS):
+        self.facets = list(facets)
+
+    def compute(self, products_queryset):
+        queryset = Product.objects.filter(id__in=products_queryset.order_by().values('id'))
+        annotations = {}
+        for facet in self.facets:
+            annotations.update(facet.get_annotations())
+
+        # Aliases are prefixed per facet so their keys can't clash
+        group_columns = {}
+        tuple_keys = set()
+        aggregates = {}
+        for position, facet in enumerate(self.facets):
+            group_by = facet.get_group_by()
+            if group_by is not None:
+                if isinstance(group_by, tuple):
+                    tuple_keys.add(position)
+                    expressions = group_by
+                else:
+                    expressions = (group_by,)
+                group_columns[position] = [f"facet{position}_value{index}" for index in range(len(expressions))]
+                annotations.update(zip(group_columns[position], expressions))
+            for key, expression in facet.get_aggregates().items():
+                aggregates[f"facet{position}_{key}"] = expression
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+
+        folded = {alias: expression for alias, expression in aggregates.items() if type(expression) in FOLDS}
+        totals = {}
+        counts = {position: defaultdict(int) for position in group_columns}
+        if group_columns:
+            columns = [column for position_columns in group_columns.values() for column in position_columns]
+            rows = queryset.values(*columns).annotate(facet_count=Count('id'), **folded).order_by()
+            for row in rows:
+                for position, position_columns in group_columns.items():
+                    if position in tuple_keys:
+                        key = tuple(row[column] for column in position_columns)
+                    else:
+                        key = row[position_columns[0]]
+                    counts[position][key] += row['facet_count']
+                for alias, expression in folded.items():
+                    value = row[alias]
+                    if value is not None:
+                        total = totals.get(alias)
+                        totals[alias] = value if total is None else FOLDS[type(expression)]((total, value))
+            for alias, expression in folded.items():
+                if totals.get(alias) is None:
+                    # What aggregate() returns over no (or only NULL) rows
+                    totals[alias] = 0 if isinstance(expression, Count) else None
+            remaining = {alias: expression for alias, expression in aggregates.items() if alias not in folded}
+        else:
+            remaining = aggregates
+        if remaining:
+            totals.update(queryset.aggregate(**remaining))
+
+        results = {}
+        for position, facet in enumerate(self.facets):
+            prefix = f"facet{position}_"
+            facet_aggregates = {
+                alias[len(prefix):]: value for alias, value in totals.items() if alias.startswith(prefix)
+            }
+            facet_counts = dict(counts[position]) if position in counts else None
+            results[facet.name] = facet.result(facet_aggregates, facet_counts)
+        return results
+
+
+def get_extra_facets():
+    """
+    Instantiate the extra facets configured in settings.SEARCH_EXTRA_FACETS
+
+    Each entry is a dotted path to a Facet class, or a (path, kwargs) pair,
+    e.g. [('search.facets.PriceHistogramFacet', {'bucket_width': 25})]
+    """
+    facets = []
+    for entry in getattr(settings, 'SEARCH_EXTRA_FACETS', []):
+        if isinstance(entry, str):
+            path, kwargs = entry, {}
+        else:
+            path, kwargs = entry
+        facets.append(import_string(path)(**kwargs))
+    return facets
@@ -0,0 +1,456 @@
+import logging
+import math
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+from products.models import Product
+from .category_tree import get_category_tree
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Same relative weights PostgreSQL's ts_rank gives A, B and C labels,
+# matching the weights advanced_search stores in the search document
+FIELD_WEIGHTS = {
+    'name': 1.0,
+    'short_description': 0.4,
+    'brand': 0.4,
+    'category': 0.4,
+    'description': 0.2,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Rebuild the arrays once this share of documents has been replaced or removed
+COMPACT_THRESHOLD = 0.25
+
+# Product fields whose changes require re-indexing the product
+INDEX_FIELDS = {
+    'name', 'short_description', 'description', 'brand', 'brand_id', 'category', 'category_id',
+    'base_price', 'is_active',
+}
+
+INDEX_COLUMNS = (
+    'id', 'name', 'short_description', 'description', 'brand__name', 'category__name',
+    'category_id', 'brand_id', 'base_price',
+)
+
+
+def tokenize(text):
+    """
+    Split text into lowercase alphanumeric tokens
+    """
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+class PostingList:
+    """
+    Array-backed posting list: ascending document numbers and the
+    field-weighted term frequency of the term in each document
+
+    `live` caches how many of the documents are not tombstoned, valid
+    while the index's removal counter still equals `live_at`.
+    """
+    __slots__ = ('doc_ids', 'weights', 'live', 'live_at')
+
+    def __init__(self):
+        self.doc_ids = array('I')
+        self.weights = array('f')
+        self.live = 0
+        self.live_at = -1
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def find(self, doc):
+        """
+        Return the position of a document in the list, or -1
+        """
+        position = bisect_left(self.doc_ids, doc)
+        if position < len(self.doc_ids) and self.doc_ids[position] == doc:
+            return position
+        return -1
+
+
+class InvertedIndex:
+    """
+    Compact in-memory inverted index over product text
+
+    Documents are numbered densely in insertion order, so posting lists
+    stay sorted by appending. Updates append a new document and tombstone
+    the old one; the arrays are compacted once enough tombstones pile up.
+    Category and brand filters are kept as posting lists of their own and
+    price filters read a per-document price array.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.category_postings = defaultdict(lambda: array('I'))
+        self.brand_postings = defaultdict(lambda: array('I'))
+        self.product_ids = array('q')
+        self.doc_lengths = array('f')
+        self.prices = array('d')
+        self.alive = bytearray()
+        self.doc_for_product = {}
+        self.total_length = 0.0
+        self.removals = 0
+        self.built_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_for_product)
+
+    def add(self, product_id, fields, category_id=None, brand_id=None, price=None):
+        """
+        Index (or re-index) a product
+
+        Args:
+            product_id: Product ID
+            fields: Dict of field name (see FIELD_WEIGHTS) to text
+            category_id: Category ID used for category filtering
+            brand_id: Brand ID used for brand filtering
+            price: Base price used for price filtering
+        """
+        frequencies = defaultdict(float)
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                frequencies[token] += weight
+
+        with self.lock:
+            self._remove(product_id)
+
+            doc = len(self.product_ids)
+            for term, weight in frequencies.items():
+                posting_list = self.postings.get(term)
+                if posting_list is None:
+                    posting_list = self.postings[term] = PostingList()
+                posting_list.doc_ids.append(doc)
+                posting_list.weights.append(weight)
+                posting_list.live += 1
+
+            if category_id is not None:
+                self.category_postings[category_id].append(doc)
+            if brand_id is not None:
+                self.brand_postings[brand_id].append(doc)
+
+            length = sum(frequencies.values())
+            self.product_ids.append(product_id)
+            self.doc_lengths.append(length)
+            self.prices.append(float(price) if price is not None else math.nan)
+            self.alive.append(1)
+            self.doc_for_product[product_id] = doc
+            self.total_length += length
+
+            self._maybe_compact()
+
+    def remove(self, product_id):
+        """
+        Remove a product from the index
+        """
+        with self.lock:
+            self._remove(product_id)
+            self._maybe_compact()
+
+    def _remove(self, product_id):
+        doc = self.doc_for_product.pop(product_id, None)
+        if doc is not None:
+            self.alive[doc] = 0
+            self.total_length -= self.doc_lengths[doc]
+            self.removals += 1
+
+    def _maybe_compact(self):
+        dead = len(self.product_ids) - len(self.doc_for_product)
+        if dead > 1000 and dead > COMPACT_THRESHOLD * len(self.product_ids):
+            self.compact()
+
+    def compact(self):
+        """
+        Drop tombstoned documents and renumber the remaining ones
+        """
+        with self.lock:
+            remap = {}
+            product_ids, doc_lengths, prices = array('q'), array('f'), array('d')
+            for doc, is_alive in enumerate(self.alive):
+                if is_alive:
+                    remap[doc] = len(product_ids)
+                    product_ids.append(self.product_ids[doc])
+                    doc_lengths.append(self.doc_lengths[doc])
+                    prices.append(self.prices[doc])
+
+            postings = {}
+            for term, posting_list in self.postings.items():
+                compacted = PostingList()
+                for doc, weight in zip(posting_list.doc_ids, posting_list.weights):
+                    if doc in remap:
+                        compacted.doc_ids.append(remap[doc])
+                        compacted.weights.append(weight)
+                if compacted.doc_ids:
+                    compacted.live = len(compacted.doc_ids)
+                    compacted.live_at = self.removals
+                    postings[term] = compacted
+
+            def compact_filter(filter_postings):
+                compacted = defaultdict(lambda: array('I'))
+                for key, docs in filter_postings.items():
+                    kept = array('I', (remap[doc] for doc in docs if doc in remap))
+                    if kept:
+                        compacted[key] = kept
+                return compacted
+
+            self.category_postings = compact_filter(self.category_postings)
+            self.brand_postings = compact_filter(self.brand_postings)
+            self.postings = postings
+            self.product_ids = product_ids
+            self.doc_lengths = doc_lengths
+            self.prices = prices
+            self.alive = bytearray(b'\x01' * len(product_ids))
+            self.doc_for_product = {product_id: doc for doc, product_id in enumerate(product_ids)}
+
+    def document_frequency(self, posting_list):
+        """
+        Number of live (not tombstoned) documents in a posting list
+        """
+        if len(self.doc_for_product) == len(self.product_ids):
+            return len(posting_list)
+        if posting_list.live_at != self.removals:
+            alive = self.alive
+            posting_list.live = sum(alive[doc] for doc in posting_list.doc_ids)
+            posting_list.live_at = self.removals
+        return posting_list.live
+
+    def _filter_docs(self, filter_postings, keys):
+        docs = set()
+        for key in keys:
+            docs.update(filter_postings.get(key, ()))
+        return docs
+
+    def search(self, query_string, price_min=None, price_max=None, categories=None, brands=None, limit=None):
+        """
+        Find products containing every query term, ranked with BM25
+
+        Filters are applied as posting-list intersections: the smallest of
+        the term and filter lists drives the scan and every other list is
+        probed by binary search or set membership.
+
+        Args:
+            query_string: The search term entered by the user
+            price_min: Minimum price filter
+            price_max: Maximum price filter
+            categories: List of category IDs (descendants are included)
+            brands: List of brand IDs
+
+        Returns:
+            List of (product_id, score) tuples, best match first
+        """
+        terms = list(dict.fromkeys(tokenize(query_string)))
+        if not terms:
+            return []
+
+        with self.lock:
+            posting_lists = [self.postings.get(term) for term in terms]
+            if not all(posting_lists):
+                return []
+
+            filter_sets = []
+            if categories:
+                category_ids = get_category_tree().expand(categories)
+                filter_sets.append(self._filter_docs(self.category_postings, category_ids))
+            if brands:
+                brand_ids = set()
+                for brand_id in brands:
+                    try:
+                        brand_ids.add(int(brand_id))
+                    except (TypeError, ValueError):
+                        continue
+                filter_sets.append(self._filter_docs(self.brand_postings, brand_ids))
+
+            posting_lists.sort(key=len)
+            filter_sets.sort(key=len)
+            if filter_sets and len(filter_sets[0]) < len(posting_lists[0]):
+                candidates = sorted(filter_sets[0])
+                filter_sets = filter_sets[1:]
+            else:
+                candidates = posting_lists[0].doc_ids
+
+            document_count = max(len(self.doc_for_product), 1)
+            average_length = (self.total_length / document_count) or 1.0
+            frequencies = [self.document_frequency(pl) for pl in posting_lists]
+            idfs = [
+                math.log(1 + (document_count - frequency + 0.5) / (frequency + 0.5))
+                for frequency in frequencies
+            ]
+            low = float(price_min) if price_min is not None else None
+            high = float(price_max) if price_max is not None else None
+
+            hits = []
+            for doc in candidates:
+                if not self.alive[doc]:
+                    continue
+                if low is not None and not self.prices[doc] >= low:
+                    continue
+                if high is not None and not self.prices[doc] <= high:
+                    continue
+                if any(doc not in docs for docs in filter_sets):
+                    continue
+
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc] / average_length)
+                score = 0.0
+                for posting_list, idf in zip(posting_lists, idfs):
+                    position = posting_list.find(doc)
+                    if position < 0:
+                        break
+                    frequency = posting_list.weights[position]
+                    score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                else:
+                    hits.append((self.product_ids[doc], score))
+
+        hits.sort(key=lambda hit: (-hit[1], hit[0]))
+        if limit is not None:
+            hits = hits[:limit]
+        return hits
+
+
+def _add_row(index, row):
+    product_id, name, short_description, description, brand_name, category_name, category_id, brand_id, price = row
+    index.add(
+        product_id,
+        {
+            'name': name,
+            'short_description': short_description,
+            'description': description,
+            'brand': brand_name,
+            'category': category_name,
+        },
+        category_id=category_id,
+        brand_id=brand_id,
+        price=price
+    )
+
+
+def build_product_index():
+    """
+    Build an inverted index over all active products
+    """
+    index = InvertedIndex()
+    rows = Product.objects.filter(is_active=True).values_list(*INDEX_COLUMNS)
+    for row in rows.iterator(chunk_size=5000):
+        _add_row(index, row)
+    logger.info(f"Built search index with {len(index)} products")
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+# Index updates made while a rebuild runs, replayed on the new index
+_replay = []
+
+
+def memory_index_enabled():
+    """
+    Whether search should use the in-process inverted index backend
+    """
+    return getattr(settings, 'SEARCH_BACKEND', 'database') == 'memory'
+
+
+def _rebuild_in_background():
+    global _index, _rebuilding, _replay
+    replay = []
+    try:
+        index = build_product_index()
+        with _index_lock:
+            _index = index
+            replay, _replay = _replay, []
+            _rebuilding = False
+        # The rebuild may have read rows before these updates were made
+        for update in replay:
+            update(index)
+    except Exception as e:
+        logger.error(f"Error rebuilding search index: {str(e)}")
+    finally:
+        with _index_lock:
+            _replay = []
+            _rebuilding = False
+
+
+def _current_index(update):
+    """
+    Return the loaded index (or None), queueing `update` for replay on
+    the new index when a rebuild is running
+    """
+    if not _rebuilding:
+        # A rebuild starting after this point reads the update's rows itself
+        return _index
+    with _index_lock:
+        if _rebuilding:
+            _replay.append(update)
+        return _index
+
+
+def get_product_index():
+    """
+    Get the process-wide product index, building it on first use
+
+    Signal handlers keep the index current for edits made by this process.
+    Edits made elsewhere are picked up by a periodic background rebuild
+    (settings.SEARCH_INDEX_MAX_AGE seconds), during which the old index
+    keeps serving queries.
+    """
+    global _index, _rebuilding
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_product_index()
+        return _index
+
+    max_age = getattr(settings, 'SEARCH_INDEX_MAX_AGE', 3600)
+    if max_age and time.monotonic() - _index.built_at > max_age and not _rebuilding:
+        with _index_lock:
+            if not _rebuilding:
+                _rebuilding = True
+                threading.Thread(target=_rebuild_in_background, daemon=True).start()
+    return _index
+
+
+def update_indexed_products(product_ids=None, **lookups):
+    """
+    Re-read products into the index if this process has loaded one
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    index = _current_index(lambda new_index: _apply_updates(new_index, product_ids, lookups))
+    if index is not None:
+        _apply_updates(index, product_ids, lookups)
+
+
+def _apply_updates(index, product_ids, lookups):
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    if lookups:
+        products = products.filter(**lookups)
+
+    for row in products.values_list('is_active', *INDEX_COLUMNS).iterator(chunk_size=5000):
+        if row[0]:
+            _add_row(index, row[1:])
+        else:
+            index.remove(row[1])
+
+
+def remove_indexed_product(product_id):
+    """
+    Drop a product from the index if this process has loaded one
+    """
+    index = _current_index(lambda new_index: new_index.remove(product_id))
+    if index is not None:
+        index.remove(product_id)
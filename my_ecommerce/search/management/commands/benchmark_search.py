@@ -0,0 +1,48 @@
+import json
+from django.core.management.base import BaseCommand
+from search.benchmark import SearchBenchmark
+from search.documents import search_documents_enabled, reindex_products
+from search.related_terms import build_related_terms
+from search.stats import reconcile_product_stats
+from search.synthetic import SyntheticCatalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark basic_search, advanced_search, get_search_facets and get_related_search_terms. "
+        "Use --generate only against a disposable benchmark database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', action='store_true', help="Populate a synthetic catalog first")
+        parser.add_argument('--products', type=int, default=10000, help="Synthetic catalog size")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--queries', type=int, default=20, help="Number of queries in the mix")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per query")
+        parser.add_argument('--output', default='search_benchmark.json', help="Where to write the JSON report")
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            self.stdout.write(f"Generating {options['products']} synthetic products...")
+            summary = SyntheticCatalog(products=options['products'], seed=options['seed']).generate()
+            self.stdout.write(f"Generated {summary}")
+
+            # Derived data the search paths read
+            reconcile_product_stats()
+            if search_documents_enabled():
+                reindex_products()
+            build_related_terms()
+
+        benchmark = SearchBenchmark(seed=options['seed'], queries=options['queries'], repeat=options['repeat'])
+        report = benchmark.run(progress=self.report_progress)
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['results'])} results to {options['output']}"))
+
+    def report_progress(self, result):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"{result['function']:<26} {str(result['sort_by']):<11} {result['filters']:<14} "
+            f"p50={latency['p50']:>8}ms p99={latency['p99']:>8}ms queries={result['queries']}"
+        )
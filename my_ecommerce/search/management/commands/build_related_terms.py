@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from search.querylog import iter_search_sessions
+from search.related_terms import TOP_K, build_related_terms
+
+
+class Command(BaseCommand):
+    help = "Rebuild the related search terms co-occurrence table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help="Neighbours kept per term")
+        parser.add_argument('--log-days', type=int, default=30, help="Days of search logs to include (0 to skip)")
+
+    def handle(self, *args, **options):
+        sessions = iter_search_sessions(days=options['log_days']) if options['log_days'] else None
+        rows = build_related_terms(search_sessions=sessions, top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {rows} related search terms"))
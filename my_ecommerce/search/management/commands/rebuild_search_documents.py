@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from search.documents import search_documents_enabled, reindex_products
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored full-text search documents for products"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--brand', type=int, help="Only reindex products of this brand ID")
+        parser.add_argument('--category', type=int, help="Only reindex products of this category ID")
+        parser.add_argument('--missing', action='store_true', help="Only index products without a search document")
+
+    def handle(self, *args, **options):
+        if not search_documents_enabled():
+            raise CommandError("Stored search documents require PostgreSQL")
+
+        lookups = {}
+        if options['brand']:
+            lookups['brand_id'] = options['brand']
+        if options['category']:
+            lookups['category_id'] = options['category']
+        if options['missing']:
+            lookups['search_document__isnull'] = True
+
+        updated = reindex_products(**lookups)
+        self.stdout.write(self.style.SUCCESS(f"Reindexed {updated} product search documents"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from search.stats import reconcile_product_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized product ranking stats from reviews and order items"
+
+    def handle(self, *args, **options):
+        updated = reconcile_product_stats()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled stats for {updated} products"))
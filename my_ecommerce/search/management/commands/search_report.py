@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from search.querylog import top_queries, zero_result_queries, slow_queries
+
+
+class Command(BaseCommand):
+    help = "Report top, zero-result and slow search queries from the search log"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--slow-ms', type=float, default=500, help="Latency threshold for slow queries")
+
+    def handle(self, *args, **options):
+        days, limit = options['days'], options['limit']
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Top queries (last {days} days)"))
+        for row in top_queries(days, limit):
+            self.stdout.write(
+                f"{row['searches']:>8}  {row['normalized_query']}  "
+                f"(avg hits {row['avg_hits'] or 0:.0f}, avg {row['avg_latency_ms']:.1f} ms)"
+            )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Zero-result queries"))
+        for row in zero_result_queries(days, limit):
+            self.stdout.write(f"{row['searches']:>8}  {row['normalized_query']}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Slow queries (>= {options['slow_ms']:.0f} ms)"))
+        for row in slow_queries(days, options['slow_ms'], limit):
+            self.stdout.write(
+                f"{row['searches']:>8}  {row['normalized_query']} [{row['sort_by'] or 'default'}]  "
+                f"(avg {row['avg_latency_ms']:.1f} ms, max {row['max_latency_ms']:.1f} ms)"
+            )
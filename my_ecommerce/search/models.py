@@ -0,0 +1,107 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from products.models import Product
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Stored, weighted full-text search document for a product (PostgreSQL only)
+
+    The table only exists on PostgreSQL, so the relation has no database
+    constraint and no cascade: deleting a product must not touch it on
+    other databases. Documents of deleted products are removed by a
+    post_delete signal instead.
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        primary_key=True,
+        related_name='search_document'
+    )
+    document = SearchVectorField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        required_db_vendor = 'postgresql'
+        indexes = [
+            GinIndex(fields=['document'], name='search_document_gin'),
+        ]
+
+    def __str__(self):
+        return f"Search document for product {self.product_id}"
+
+
+class ProductStats(models.Model):
+    """
+    Denormalized per-product ranking aggregates used for sorting
+
+    Kept current incrementally on review and payment events and
+    periodically reconciled against reviews and order items.
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    rating_total = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(blank=True, null=True, db_index=True)
+    sales_count = models.PositiveIntegerField(default=0, db_index=True)
+    recent_sales_count = models.PositiveIntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'product stats'
+
+    def __str__(self):
+        return f"Stats for product {self.product_id}"
+
+
+class RelatedSearchTerm(models.Model):
+    """
+    Precomputed top-k neighbour of a search term in the term co-occurrence graph
+    """
+    term = models.CharField(max_length=100)
+    related_term = models.CharField(max_length=100)
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('term', 'related_term')
+        indexes = [
+            models.Index(fields=['term', '-score'], name='related_term_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.related_term}"
+
+
+class SearchEvent(models.Model):
+    """
+    One search performed by a shopper, written in batches by the query log
+    """
+    query = models.CharField(max_length=255, blank=True)
+    normalized_query = models.CharField(max_length=255, db_index=True)
+    filters = models.JSONField(default=dict, blank=True)
+    sort_by = models.CharField(max_length=20, blank=True, null=True)
+    hit_count = models.PositiveIntegerField(blank=True, null=True)
+    latency_ms = models.FloatField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='search_events'
+    )
+    session_key = models.CharField(max_length=40, blank=True, null=True, db_index=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Search '{self.query}' ({self.hit_count} hits)"
@@ -0,0 +1,178 @@
+import datetime
+from collections import namedtuple
+from decimal import Decimal
+from django.core import signing
+from django.db.models import F, Q
+
+CURSOR_SALT = 'search.pagination.cursor'
+
+DEFAULT_PAGE_SIZE = 24
+
+SearchPage = namedtuple('SearchPage', ['products', 'next_cursor'])
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a pagination cursor is malformed, tampered with or was
+    issued for a different sort mode
+    """
+
+
+class SortKey:
+    """
+    One column of a composite keyset sort key
+
+    Args:
+        name: Attribute/annotation name read from the products
+        descending: Sort direction
+        source: Field path to annotate as `name` when it isn't a model field
+        nullable: Whether NULLs can occur (they always sort last)
+    """
+
+    def __init__(self, name, descending=False, source=None, nullable=False):
+        self.name = name
+        self.descending = descending
+        self.source = source
+        self.nullable = nullable
+
+    def order_expression(self):
+        expression = F(self.name)
+        if self.descending:
+            return expression.desc(nulls_last=True)
+        return expression.asc(nulls_last=True)
+
+    def after(self, value):
+        """
+        Q matching rows that sort strictly after the given value
+        """
+        if value is None:
+            # NULLs sort last, so nothing but other NULLs can follow
+            return Q(pk__in=[])
+        lookup = 'lt' if self.descending else 'gt'
+        condition = Q(**{f'{self.name}__{lookup}': value})
+        if self.nullable:
+            condition |= Q(**{f'{self.name}__isnull': True})
+        return condition
+
+    def equal(self, value):
+        """
+        Q matching rows with the same sort value
+        """
+        if value is None:
+            return Q(**{f'{self.name}__isnull': True})
+        return Q(**{self.name: value})
+
+
+# Every sort mode ends with the product ID so the key is unique and stable
+SORT_KEYS = {
+    'price_low': [SortKey('base_price')],
+    'price_high': [SortKey('base_price', descending=True)],
+    'newest': [SortKey('created_at', descending=True)],
+    'rating': [SortKey('avg_rating', descending=True, source='stats__avg_rating', nullable=True)],
+    'popularity': [SortKey('sales_count', descending=True, source='stats__sales_count', nullable=True)],
+    'bestseller': [SortKey('recent_sales', descending=True, source='stats__recent_sales_count', nullable=True)],
+    'rank': [SortKey('rank', descending=True)],
+    'featured': [
+        SortKey('is_featured', descending=True),
+        SortKey('avg_rating', descending=True, source='stats__avg_rating', nullable=True),
+        SortKey('name'),
+    ],
+}
+ID_KEY = SortKey('id')
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(sort_mode, values):
+    """
+    Build an opaque, signed cursor from the sort values of the last row
+    """
+    return signing.dumps(
+        {'s': sort_mode, 'v': [_encode_value(value) for value in values]},
+        salt=CURSOR_SALT,
+        compress=True
+    )
+
+
+def decode_cursor(cursor, sort_mode, key_count):
+    """
+    Decode a cursor and check that it belongs to the given sort mode
+    """
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor("Invalid pagination cursor")
+    if not isinstance(data, dict) or data.get('s') != sort_mode or len(data.get('v') or ()) != key_count:
+        raise InvalidCursor("Pagination cursor does not match the sort mode")
+    return data['v']
+
+
+def resolve_sort_mode(products, sort_by=None):
+    """
+    Map a search sort_by value to a keyset sort mode
+    """
+    has_rank = 'rank' in products.query.annotations
+    if sort_by in SORT_KEYS and (sort_by != 'rank' or has_rank):
+        return sort_by
+    if has_rank:
+        # Full-text searches default to relevance
+        return 'rank'
+    return 'featured'
+
+
+def paginate_search(products, sort_by=None, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of search results using keyset (cursor) pagination
+
+    The queryset is ordered by a composite key (sort value(s) plus product
+    ID) and the page starts strictly after the key stored in the cursor,
+    so every page costs the same as the first one regardless of depth.
+
+    Args:
+        products: QuerySet returned by basic_search/advanced_search
+        sort_by: The sort mode passed to the search function
+        cursor: Opaque cursor returned with the previous page, or None
+        page_size: Number of products per page
+
+    Returns:
+        SearchPage(products, next_cursor); next_cursor is None on the last page
+
+    Raises:
+        InvalidCursor: If the cursor cannot be used for this sort mode
+    """
+    sort_mode = resolve_sort_mode(products, sort_by)
+    keys = SORT_KEYS[sort_mode] + [ID_KEY]
+
+    annotations = {
+        key.name: F(key.source)
+        for key in keys
+        if key.source and key.name not in products.query.annotations
+    }
+    if annotations:
+        products = products.annotate(**annotations)
+    products = products.order_by(*[key.order_expression() for key in keys])
+
+    if cursor:
+        values = decode_cursor(cursor, sort_mode, len(keys))
+        # Lexicographic "row after (v1, ..., vn)" predicate
+        condition = Q(pk__in=[])
+        prefix = Q()
+        for key, value in zip(keys, values):
+            condition |= prefix & key.after(value)
+            prefix &= key.equal(value)
+        products = products.filter(condition)
+
+    page = list(products[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        last = page[-1]
+        next_cursor = encode_cursor(sort_mode, [getattr(last, key.name) for key in keys])
+
+    return SearchPage(page, next_cursor)
@@ -0,0 +1,458 @@
+import logging
+import random
+import threading
+import time
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+from products.models import Product
+from .category_tree import get_category_tree
+from .documents import get_search_vector, search_documents_enabled
+from .index import get_product_index
+from .pagination import DEFAULT_PAGE_SIZE, paginate_search
+
+logger = logging.getLogger(__name__)
+
+# Assumed share of the catalog a text match keeps when nothing better is known
+DEFAULT_TEXT_SELECTIVITY = 0.1
+
+# Assumed share of the catalog kept by one / both price bounds
+PRICE_BOUND_SELECTIVITY = 0.5
+
+# Relevance levels BM25 scores are mapped onto for ranked index searches
+RANK_TIERS = 256
+
+# Best index matches kept per search. Their IDs are bound once in the
+# filter and once more in the rank expression, which has to stay under
+# SQLite's 32766 (and PostgreSQL's 65535) query parameter limit.
+DEFAULT_INDEX_MAX_HITS = 5000
+
+
+def relevance_tiers(hits, tiers=RANK_TIERS):
+    """
+    `rank` expression for in-memory index hits
+
+    Scores are mapped onto `tiers` evenly spaced relevance levels with one
+    `id IN (...)` branch per level, so the expression stays small however
+    many products match.
+
+    Args:
+        hits: List of (product_id, score) tuples, best match first
+    """
+    levels = {}
+    if hits:
+        high, low = hits[0][1], hits[-1][1]
+        span = (high - low) or 1.0
+        for product_id, score in hits:
+            level = int((score - low) / span * (tiers - 1))
+            levels.setdefault(level, []).append(product_id)
+    return Case(
+        *[When(id__in=product_ids, then=Value(level)) for level, product_ids in levels.items() if level],
+        default=Value(0),
+        output_field=IntegerField()
+    )
+
+
+class CatalogStatistics:
+    """
+    Cached product counts per category and brand used to estimate how
+    selective a filter is, and the number of active products still without
+    a stored search document; refreshed every `ttl` seconds
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.loaded_at = None
+        self.total = 0
+        self.category_counts = {}
+        self.brand_counts = {}
+        self.missing_documents = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        active = Product.objects.filter(is_active=True).order_by()
+        self.category_counts = dict(active.values_list('category_id').annotate(count=Count('id')))
+        self.brand_counts = dict(active.values_list('brand_id').annotate(count=Count('id')))
+        self.total = sum(self.category_counts.values())
+        if search_documents_enabled():
+            self.missing_documents = active.filter(search_document__isnull=True).count()
+        self.loaded_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            with self._lock:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+                    self.refresh()
+        return self
+
+    def estimate(self, counts, ids):
+        """
+        Estimated number of active products in the given groups
+        """
+        return sum(counts.get(group_id, 0) for group_id in ids)
+
+
+_statistics = CatalogStatistics()
+
+
+class PlanRecord:
+    """
+    What the planner decided for one search and how long each stage took
+    """
+
+    def __init__(self, search):
+        self.query_string = search.query_string
+        self.text_mode = search.text_mode
+        self.plan = None
+        self.stage_order = []
+        self.estimates = {}
+        self.timings = {}
+        self.explain = None
+
+    def as_dict(self):
+        return {
+            'query_string': self.query_string,
+            'text_mode': self.text_mode,
+            'plan': self.plan,
+            'stage_order': self.stage_order,
+            'estimates': self.estimates,
+            'timings_ms': self.timings,
+            'explain': self.explain,
+        }
+
+
+class Stage:
+    """
+    One composable step of the search pipeline
+
+    `estimate` returns the expected number of matching products (None when
+    the stage doesn't filter) and `apply` narrows or orders the queryset.
+    """
+    name = None
+
+    def __init__(self, search):
+        self.search = search
+
+    def is_active(self):
+        return True
+
+    def estimate(self, statistics):
+        return None
+
+    def apply(self, products):
+        raise NotImplementedError
+
+
+class TextMatchStage(Stage):
+    name = 'text'
+
+    def __init__(self, search):
+        super().__init__(search)
+        # Product IDs the match is restricted to by the filter_first plan
+        self.restrict_ids = None
+
+    def is_active(self):
+        return bool(self.search.query_string)
+
+    def estimate(self, statistics):
+        return statistics.total * DEFAULT_TEXT_SELECTIVITY
+
+    def apply(self, products):
+        search = self.search
+        if search.text_mode == 'index':
+            # The index intersects price/category/brand posting lists itself
+            hits = get_product_index().search(
+                search.query_string,
+                price_min=search.price_min,
+                price_max=search.price_max,
+                categories=search.categories,
+                brands=search.brands,
+                limit=getattr(settings, 'SEARCH_INDEX_MAX_HITS', DEFAULT_INDEX_MAX_HITS)
+            )
+            # Like a search engine's result window, sorting, totals and facets
+            # see the best SEARCH_INDEX_MAX_HITS matches, not every match
+            products = products.filter(id__in=[product_id for product_id, score in hits])
+            if search.ranked and search.sort_by in (None, '', 'rank'):
+                products = products.annotate(rank=relevance_tiers(hits))
+            return products
+
+        if self.restrict_ids is not None:
+            # Only match within the subset the selective filter kept
+            products = products.filter(id__in=self.restrict_ids)
+
+        if search.text_mode == 'fulltext':
+            # Match and rank against the stored, GIN-indexed search document
+            # (see search.documents) instead of rebuilding the vector per query
+            search_query = SearchQuery(search.query_string)
+            if _statistics.ensure_fresh().missing_documents:
+                # Until rebuild_search_documents --missing has run, build the
+                # vector on the fly for products without a stored document
+                # rather than dropping them (slower: the GIN index is unused)
+                return products.annotate(
+                    search_text=Coalesce(F('search_document__document'), get_search_vector())
+                ).filter(
+                    search_text=search_query
+                ).annotate(
+                    rank=SearchRank(F('search_text'), search_query)
+                )
+            return products.filter(
+                search_document__document=search_query
+            ).annotate(
+                rank=SearchRank(F('search_document__document'), search_query)
+            )
+
+        # Search in product name, description, and brand name
+        return products.filter(
+            Q(name__icontains=search.query_string) |
+            Q(description__icontains=search.query_string) |
+            Q(short_description__icontains=search.query_string) |
+            Q(brand__name__icontains=search.query_string) |
+            Q(category__name__icontains=search.query_string)
+        ).distinct()
+
+
+class PriceRangeStage(Stage):
+    name = 'price'
+
+    def is_active(self):
+        return self.search.price_min is not None or self.search.price_max is not None
+
+    def estimate(self, statistics):
+        bounds = (self.search.price_min is not None) + (self.search.price_max is not None)
+        return statistics.total * PRICE_BOUND_SELECTIVITY ** bounds
+
+    def apply(self, products):
+        if self.search.price_min is not None:
+            products = products.filter(base_price__gte=self.search.price_min)
+        if self.search.price_max is not None:
+            products = products.filter(base_price__lte=self.search.price_max)
+        return products
+
+
+class CategoryStage(Stage):
+    name = 'category'
+
+    def is_active(self):
+        return bool(self.search.category_ids)
+
+    def estimate(self, statistics):
+        return statistics.estimate(statistics.category_counts, self.search.category_ids)
+
+    def apply(self, products):
+        # Includes all subcategories of the selected categories
+        return products.filter(category__id__in=self.search.category_ids)
+
+
+class BrandStage(Stage):
+    name = 'brand'
+
+    def is_active(self):
+        return bool(self.search.brands)
+
+    def estimate(self, statistics):
+        brand_ids = set()
+        for brand_id in self.search.brands:
+            try:
+                brand_ids.add(int(brand_id))
+            except (TypeError, ValueError):
+                continue
+        return statistics.estimate(statistics.brand_counts, brand_ids)
+
+    def apply(self, products):
+        return products.filter(brand__id__in=self.search.brands)
+
+
+class SortStage(Stage):
+    name = 'sort'
+
+    def apply(self, products):
+        sort_by = self.search.sort_by
+        if sort_by:
+            if sort_by == 'price_low':
+                products = products.order_by('base_price')
+            elif sort_by == 'price_high':
+                products = products.order_by('-base_price')
+            elif sort_by == 'newest':
+                products = products.order_by('-created_at')
+            elif sort_by == 'rating':
+                # Order by the denormalized average rating (see search.stats)
+                products = products.annotate(
+                    avg_rating=F('stats__avg_rating')
+                ).order_by(F('avg_rating').desc(nulls_last=True))
+            elif sort_by == 'popularity':
+                # Order by number of sales
+                products = products.annotate(
+                    sales_count=F('stats__sales_count')
+                ).order_by(F('sales_count').desc(nulls_last=True))
+            elif sort_by == 'bestseller':
+                # Order by number of sales in the last 30 days
+                products = products.annotate(
+                    recent_sales=F('stats__recent_sales_count')
+                ).order_by(F('recent_sales').desc(nulls_last=True))
+            elif sort_by == 'rank' and self.search.ranked:
+                products = products.order_by('-rank', '-is_featured')
+        elif self.search.ranked:
+            # Default sort by search rank for full-text search
+            products = products.order_by('-rank', '-is_featured')
+        else:
+            # Default sorting: featured products first, then by rating
+            products = products.annotate(
+                avg_rating=F('stats__avg_rating')
+            ).order_by('-is_featured', F('avg_rating').desc(nulls_last=True), 'name')
+        return products
+
+
+class SearchPipeline:
+    """
+    Composable search: text match, price, category and brand filters, sort
+    and (keyset) pagination, with a cost-based execution plan
+
+    Plans:
+        text_first: one SQL statement with the text match and every filter,
+            filters ordered most selective first
+        filter_first: when a filter is estimated to keep fewer products
+            than the text match and at most SEARCH_PLANNER_SUBSET_LIMIT,
+            that subset's IDs are fetched first and the text match is
+            restricted to them
+        index: the in-memory index matches text and filters together
+
+    Args:
+        query_string: The search term entered by the user
+        text_mode: 'icontains', 'fulltext' or 'index'
+        ranked: Whether results carry a relevance `rank` annotation
+        sort_by, price_min, price_max, categories, brands: As in basic_search
+    """
+
+    def __init__(self, query_string, text_mode='icontains', ranked=False, sort_by=None,
+                 price_min=None, price_max=None, categories=None, brands=None):
+        self.query_string = query_string
+        self.text_mode = text_mode
+        self.ranked = ranked and bool(query_string)
+        self.sort_by = sort_by
+        self.price_min = price_min
+        self.price_max = price_max
+        self.categories = categories
+        self.brands = brands
+        self.category_ids = get_category_tree().expand(categories) if categories else set()
+        self.record = PlanRecord(self)
+
+    def filter_stages(self):
+        stages = [PriceRangeStage(self), CategoryStage(self), BrandStage(self)]
+        return [stage for stage in stages if stage.is_active()]
+
+    def _timed(self, name, callable_):
+        started = time.perf_counter()
+        result = callable_()
+        self.record.timings[name] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    def build(self):
+        """
+        Return the QuerySet of matching products in the requested order
+        """
+        products = Product.objects.filter(is_active=True)
+        text = TextMatchStage(self)
+        filters = self.filter_stages()
+
+        if filters:
+            statistics = _statistics.ensure_fresh()
+            estimates = {stage.name: stage.estimate(statistics) for stage in filters}
+            filters.sort(key=lambda stage: estimates[stage.name])
+            if text.is_active():
+                estimates[text.name] = text.estimate(statistics)
+            self.record.estimates = {name: round(value, 1) for name, value in estimates.items()}
+        else:
+            estimates = {}
+
+        subset_limit = getattr(settings, 'SEARCH_PLANNER_SUBSET_LIMIT', 5000)
+        if not text.is_active():
+            self.record.plan = 'filters_only'
+            stages = filters
+        elif self.text_mode == 'index':
+            # The index already intersects the filters' posting lists
+            self.record.plan = 'index'
+            stages = [text] + filters
+        elif filters and estimates[filters[0].name] <= min(subset_limit, estimates[text.name]):
+            selective = filters[0]
+            subset = self._timed(
+                f'{selective.name}_subset',
+                lambda: list(selective.apply(products).order_by().values_list('id', flat=True)[:subset_limit + 1])
+            )
+            if len(subset) <= subset_limit:
+                self.record.plan = 'filter_first'
+                text.restrict_ids = subset
+                stages = [text] + filters[1:]
+            else:
+                # The estimate was off; fall back to a single statement
+                self.record.plan = 'text_first'
+                stages = [text] + filters
+        else:
+            self.record.plan = 'text_first'
+            stages = [text] + filters
+
+        for stage in stages + [SortStage(self)]:
+            products = self._timed(stage.name, lambda: stage.apply(products))
+            self.record.stage_order.append(stage.name)
+
+        run_plan_hooks(self.record, products)
+        return products
+
+    def page(self, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Pagination stage: fetch one keyset page of the results
+        """
+        products = self.build()
+        return self._timed('pagination', lambda: paginate_search(products, self.sort_by, cursor, page_size))
+
+
+_plan_hooks = []
+
+
+def add_plan_hook(hook):
+    """
+    Register a callable receiving each PlanRecord (as a dict)
+    """
+    _plan_hooks.append(hook)
+
+
+def get_plan_hooks():
+    hooks = list(_plan_hooks)
+    for path in getattr(settings, 'SEARCH_PLANNER_HOOKS', []):
+        hooks.append(import_string(path))
+    return hooks
+
+
+def run_plan_hooks(record, products):
+    """
+    Pass the plan to the instrumentation hooks, adding EXPLAIN output for
+    a sample (settings.SEARCH_PLANNER_EXPLAIN_RATE) of searches
+    """
+    hooks = get_plan_hooks()
+    if not hooks:
+        return
+
+    if random.random() < getattr(settings, 'SEARCH_PLANNER_EXPLAIN_RATE', 0.01):
+        try:
+            started = time.perf_counter()
+            record.explain = products.explain()
+            record.timings['explain'] = round((time.perf_counter() - started) * 1000, 3)
+        except Exception as e:
+            logger.error(f"Error explaining search query: {str(e)}")
+
+    data = record.as_dict()
+    data['database'] = connection.vendor
+    for hook in hooks:
+        try:
+            hook(data)
+        except Exception as e:
+            logger.error(f"Error in search plan hook: {str(e)}")
+
+
+def log_plan(data):
+    """
+    Plan hook that logs plans at INFO level, for SEARCH_PLANNER_HOOKS
+    """
+    logger.info(f"Search plan: {data}")
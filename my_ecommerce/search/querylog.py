@@ -0,0 +1,302 @@
+import atexit
+import contextvars
+import datetime
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models import Avg, Count, Max
+from django.dispatch import Signal
+from django.utils import timezone
+from .models import SearchEvent
+
+logger = logging.getLogger(__name__)
+
+# Set while a logged search runs, so nested searches (advanced_search
+# falling back to basic_search) are only recorded once
+_logging_active = contextvars.ContextVar('search_logging_active', default=False)
+
+# Sent for every recorded search with a query, e.g. for the activity log.
+# Arguments: query_string, user_id, session_key
+search_performed = Signal()
+
+
+def normalize_query(query_string):
+    return ' '.join((query_string or '').lower().split())[:255]
+
+
+class SearchEventBuffer:
+    """
+    Bounded in-process buffer of search events
+
+    Requests only append to the buffer; a background thread writes the
+    events with bulk_create every `flush_interval` seconds or as soon as a
+    batch is full. When the buffer is full new events are dropped and
+    counted rather than blocking the request.
+    """
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=2.0, count_cap=1000):
+        self.max_size = max_size
+        self.count_cap = count_cap
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._events = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def emit(self, event):
+        """
+        Queue an event (a dict of SearchEvent fields); never blocks
+        """
+        with self._condition:
+            if len(self._events) >= self.max_size:
+                self.dropped += 1
+                return False
+            self._events.append(event)
+            if len(self._events) >= self.batch_size:
+                self._condition.notify()
+        self._ensure_writer()
+        return True
+
+    def _ensure_writer(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='search-event-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._events) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered events in batches
+        """
+        while True:
+            with self._condition:
+                if not self._events:
+                    return
+                batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+            try:
+                close_old_connections()
+                for event in batch:
+                    self._count_hits(event)
+                SearchEvent.objects.bulk_create([SearchEvent(**event) for event in batch])
+                self.written += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Error writing search events: {str(e)}")
+
+    def _count_hits(self, event):
+        """
+        Fill in the hit count of an event queued with its lazy results
+
+        Counting happens here, on the writer thread, and stops at
+        `count_cap` rows, so the search request never waits for it.
+        """
+        results = event.pop('results', None)
+        if results is None or event.get('hit_count') is not None:
+            return
+        try:
+            event['hit_count'] = results.order_by()[:self.count_cap].count()
+        except Exception as e:
+            logger.error(f"Error counting search hits: {str(e)}")
+
+    def stats(self):
+        with self._condition:
+            return {
+                'buffered': len(self._events),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_event_buffer():
+    """
+    Get the process-wide search event buffer, configured from settings
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = SearchEventBuffer(
+                    max_size=getattr(settings, 'SEARCH_LOG_BUFFER_SIZE', 10000),
+                    batch_size=getattr(settings, 'SEARCH_LOG_BATCH_SIZE', 500),
+                    flush_interval=getattr(settings, 'SEARCH_LOG_FLUSH_INTERVAL', 2.0),
+                    count_cap=getattr(settings, 'SEARCH_LOG_COUNT_CAP', 1000),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def record_search(query_string, filters, sort_by=None, hit_count=None, latency_ms=0.0, request=None, results=None):
+    """
+    Queue a search event for the background writer
+
+    Pass the lazy `results` queryset instead of `hit_count` to have the
+    writer count the hits (up to SEARCH_LOG_COUNT_CAP) off the request path.
+    """
+    if not getattr(settings, 'SEARCH_LOG_ENABLED', True):
+        return
+
+    user_id = None
+    session_key = None
+    if request is not None:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            user_id = user.pk
+        session = getattr(request, 'session', None)
+        if session is not None:
+            session_key = session.session_key
+
+    filters = {key: value for key, value in filters.items() if value not in (None, '', [], ())}
+    get_event_buffer().emit({
+        'query': (query_string or '')[:255],
+        'normalized_query': normalize_query(query_string),
+        'filters': json.loads(json.dumps(filters, cls=DjangoJSONEncoder)),
+        'sort_by': sort_by,
+        'hit_count': hit_count,
+        'latency_ms': latency_ms,
+        'user_id': user_id,
+        'session_key': session_key,
+        'created_at': timezone.now(),
+        'results': results if hit_count is None else None,
+    })
+    if query_string:
+        search_performed.send(sender=None, query_string=query_string, user_id=user_id, session_key=session_key)
+
+
+def log_search(function):
+    """
+    Record a search event for every call of a search function
+
+    The decorated function accepts an extra `request` keyword argument used
+    for the user and session. Search functions return lazy querysets and
+    the wrapper leaves them lazy: the latency covers planning and index
+    matching, and the hit count is filled in by the background writer with
+    a capped COUNT. Callers that evaluate the results anyway, such as
+    search.cache.cached_search, call the undecorated function through
+    `__wrapped__` and record the event with the real hit count themselves.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(query_string, *args, request=None, **kwargs):
+        if _logging_active.get() or not getattr(settings, 'SEARCH_LOG_ENABLED', True):
+            return function(query_string, *args, **kwargs)
+
+        token = _logging_active.set(True)
+        started = time.perf_counter()
+        try:
+            result = function(query_string, *args, **kwargs)
+        finally:
+            _logging_active.reset(token)
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        try:
+            arguments = signature.bind_partial(query_string, *args, **kwargs).arguments
+            filters = dict(arguments.pop('filters', {}))
+            filters.update(arguments)
+            filters.pop('query_string', None)
+            sort_by = filters.pop('sort_by', None)
+            record_search(
+                query_string,
+                filters,
+                sort_by=sort_by,
+                latency_ms=latency_ms,
+                request=request,
+                results=result
+            )
+        except Exception as e:
+            logger.error(f"Error recording search event: {str(e)}")
+        return result
+
+    return wrapper
+
+
+def top_queries(days=7, limit=50):
+    """
+    Most frequent queries in the last `days` days
+    """
+    since = timezone.now() - datetime.timedelta(days=days)
+    return list(
+        SearchEvent.objects.filter(created_at__gte=since).exclude(normalized_query='').values(
+            'normalized_query'
+        ).annotate(
+            searches=Count('id'),
+            avg_hits=Avg('hit_count'),
+            avg_latency_ms=Avg('latency_ms'),
+        ).order_by('-searches', 'normalized_query')[:limit]
+    )
+
+
+def zero_result_queries(days=7, limit=50):
+    """
+    Most frequent queries that returned nothing in the last `days` days
+    """
+    since = timezone.now() - datetime.timedelta(days=days)
+    return list(
+        SearchEvent.objects.filter(created_at__gte=since, hit_count=0).values(
+            'normalized_query'
+        ).annotate(
+            searches=Count('id'),
+        ).order_by('-searches', 'normalized_query')[:limit]
+    )
+
+
+def slow_queries(days=7, threshold_ms=500, limit=50):
+    """
+    Queries that took at least `threshold_ms` in the last `days` days
+    """
+    since = timezone.now() - datetime.timedelta(days=days)
+    return list(
+        SearchEvent.objects.filter(created_at__gte=since, latency_ms__gte=threshold_ms).values(
+            'normalized_query', 'sort_by'
+        ).annotate(
+            searches=Count('id'),
+            avg_latency_ms=Avg('latency_ms'),
+            max_latency_ms=Max('latency_ms'),
+        ).order_by('-max_latency_ms')[:limit]
+    )
+
+
+def iter_search_sessions(days=30):
+    """
+    Yield the distinct queries of each shopper session in the last `days`
+    days, for building the related-terms graph
+    """
+    since = timezone.now() - datetime.timedelta(days=days)
+    events = SearchEvent.objects.filter(
+        created_at__gte=since,
+        session_key__isnull=False
+    ).exclude(normalized_query='').order_by('session_key', 'created_at').values_list('session_key', 'query')
+
+    current_session, queries = None, []
+    for session_key, query in events.iterator(chunk_size=5000):
+        if session_key != current_session:
+            if len(queries) > 1:
+                yield queries
+            current_session, queries = session_key, []
+        if query not in queries:
+            queries.append(query)
+    if len(queries) > 1:
+        yield queries
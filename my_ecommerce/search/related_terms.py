@@ -0,0 +1,171 @@
+import logging
+import math
+from collections import Counter, defaultdict
+from django.db import transaction
+from products.models import Product
+from .models import RelatedSearchTerm
+
+logger = logging.getLogger(__name__)
+
+# Neighbours kept per term
+TOP_K = 10
+
+# Terms (and pairs) seen fewer times than this are treated as noise
+MIN_COUNT = 2
+
+# Weight of a co-occurrence inside one shopper's search session relative
+# to one inside a product
+SEARCH_LOG_WEIGHT = 2.0
+
+MIN_WORD_LENGTH = 4
+
+
+def normalize_term(text):
+    return ' '.join((text or '').lower().split())
+
+
+def product_terms(name, brand_name, category_name):
+    """
+    Return the terms describing a product as {normalized: display}
+    """
+    terms = {}
+    for label in (brand_name, category_name):
+        if label:
+            terms.setdefault(normalize_term(label), label)
+    for word in (name or '').split():
+        word = word.strip('.,;:!?()[]"\'')
+        if len(word) >= MIN_WORD_LENGTH:
+            terms.setdefault(normalize_term(word), word)
+    return terms
+
+
+class CooccurrenceGraph:
+    """
+    Weighted term co-occurrence counts over documents (products or search
+    sessions), with integer term IDs to keep the pair table compact
+    """
+
+    def __init__(self):
+        self.term_ids = {}
+        self.display = []
+        self.term_counts = Counter()
+        self.pair_counts = Counter()
+        self.documents = 0.0
+
+    def _term_id(self, term, display):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.display)
+            self.display.append(display)
+        return term_id
+
+    def add_document(self, terms, weight=1.0):
+        """
+        Args:
+            terms: Dict of normalized term to display form
+            weight: Weight of this document's co-occurrences
+        """
+        ids = sorted({self._term_id(term, display) for term, display in terms.items()})
+        self.documents += weight
+        for i, first in enumerate(ids):
+            self.term_counts[first] += weight
+            for second in ids[i + 1:]:
+                self.pair_counts[(first, second)] += weight
+
+    def top_neighbours(self, top_k=TOP_K, min_count=MIN_COUNT):
+        """
+        Yield (term, display, score) triples, top_k per term
+
+        The score is P(related | term) weighted by the related term's
+        inverse document frequency, so ubiquitous terms don't dominate.
+        """
+        neighbours = defaultdict(list)
+        for (first, second), count in self.pair_counts.items():
+            if count < min_count:
+                continue
+            neighbours[first].append((second, count))
+            neighbours[second].append((first, count))
+
+        terms = {term_id: term for term, term_id in self.term_ids.items()}
+        for term_id, candidates in neighbours.items():
+            if self.term_counts[term_id] < min_count:
+                continue
+            scored = []
+            for other_id, count in candidates:
+                idf = math.log(1 + self.documents / self.term_counts[other_id])
+                scored.append((count / self.term_counts[term_id] * idf, self.display[other_id]))
+            scored.sort(key=lambda item: (-item[0], item[1].lower()))
+            for score, display in scored[:top_k]:
+                yield terms[term_id], display, score
+
+
+def build_related_terms(search_sessions=None, top_k=TOP_K):
+    """
+    Rebuild the related-terms table from product text and, when given,
+    search logs
+
+    Args:
+        search_sessions: Optional iterable of query lists, one per shopper
+            session; queries searched together count as related
+        top_k: Number of neighbours kept per term
+
+    Returns:
+        Number of rows written
+    """
+    graph = CooccurrenceGraph()
+
+    products = Product.objects.filter(is_active=True).values_list('name', 'brand__name', 'category__name')
+    for name, brand_name, category_name in products.iterator(chunk_size=5000):
+        graph.add_document(product_terms(name, brand_name, category_name))
+
+    for queries in search_sessions or ():
+        terms = {normalize_term(query): query.strip() for query in queries if normalize_term(query)}
+        if len(terms) > 1:
+            graph.add_document(terms, weight=SEARCH_LOG_WEIGHT)
+
+    rows = [
+        RelatedSearchTerm(term=term[:100], related_term=display[:100], score=score)
+        for term, display, score in graph.top_neighbours(top_k)
+    ]
+
+    with transaction.atomic():
+        RelatedSearchTerm.objects.all().delete()
+        RelatedSearchTerm.objects.bulk_create(rows, batch_size=5000, ignore_conflicts=True)
+
+    logger.info(f"Built {len(rows)} related search terms")
+    return len(rows)
+
+
+def get_related_terms(query_string, limit=10):
+    """
+    Look up related terms for a query in a single indexed query
+
+    The whole normalized query is preferred; multi-word queries without an
+    entry of their own combine the neighbours of their words.
+
+    Returns:
+        List of related terms, highest score first
+    """
+    query = normalize_term(query_string)
+    if not query:
+        return []
+    words = query.split(' ')
+    lookup_terms = [query] + [word for word in words if word != query]
+
+    rows = RelatedSearchTerm.objects.filter(
+        term__in=lookup_terms
+    ).values_list('term', 'related_term', 'score')
+
+    exact = defaultdict(float)
+    combined = defaultdict(float)
+    for term, related_term, score in rows:
+        if normalize_term(related_term) in lookup_terms:
+            continue
+        if term == query:
+            exact[related_term] = max(exact[related_term], score)
+        else:
+            combined[related_term] += score
+
+    scores = exact or combined
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0].lower()))
+    return [term for term, score in ranked[:limit]]
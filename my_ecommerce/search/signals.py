@@ -0,0 +1,253 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from payments.signals import order_paid
+from products.models import Product, Category, Brand
+from reviews.models import Review
+from .autocomplete import remove_autocomplete_entry, update_autocomplete_label, update_autocomplete_product
+from .cache import invalidate_search_results
+from .category_tree import invalidate_category_tree
+from .index import INDEX_FIELDS, remove_indexed_product, update_indexed_products
+from .documents import (
+    DOCUMENT_FIELDS, remove_search_document, search_documents_enabled, update_search_documents,
+    reindex_products_in_background
+)
+from .stats import ensure_product_stats, record_review_rating, record_order_sales
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_document(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Keep the stored search document in step with the product's text
+    """
+    if raw or not search_documents_enabled():
+        return
+    if update_fields is not None and not DOCUMENT_FIELDS.intersection(update_fields):
+        return
+
+    product_id = instance.pk
+    transaction.on_commit(lambda: update_search_documents([product_id]))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_search_document(sender, instance, **kwargs):
+    """
+    Drop a deleted product's search document, which isn't cascaded
+    """
+    if not search_documents_enabled():
+        return
+    remove_search_document(instance.pk)
+
+
+@receiver(pre_save, sender=Brand)
+@receiver(pre_save, sender=Category)
+def remember_previous_name(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored name of an edited brand or category
+    """
+    instance._search_previous_name = None
+    if raw or instance.pk is None:
+        return
+    instance._search_previous_name = sender.objects.filter(
+        pk=instance.pk
+    ).values_list('name', flat=True).first()
+
+
+def name_changed(instance, created=False, update_fields=None):
+    """
+    Whether a saved brand or category was renamed
+    """
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return False
+    return instance.name != getattr(instance, '_search_previous_name', None)
+
+
+@receiver(post_save, sender=Brand)
+def reindex_brand_products(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """
+    Reindex all products of a renamed brand, in the background
+    """
+    if raw or not search_documents_enabled() or not name_changed(instance, created, update_fields):
+        return
+
+    brand_id = instance.pk
+    transaction.on_commit(lambda: reindex_products_in_background(brand_id=brand_id))
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """
+    Reindex all products of a renamed category, in the background
+    """
+    if raw or not search_documents_enabled() or not name_changed(instance, created, update_fields):
+        return
+
+    category_id = instance.pk
+    transaction.on_commit(lambda: reindex_products_in_background(category_id=category_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree_snapshot(sender, raw=False, **kwargs):
+    """
+    Rebuild the in-process category tree snapshots after any tree change
+    """
+    if raw:
+        return
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_save, sender=Product)
+def create_product_stats(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Give every new product an empty stats row so it can be sorted
+    """
+    if raw or not created:
+        return
+    ensure_product_stats([instance.pk])
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored rating of an edited review
+    """
+    instance._stats_previous_rating = None
+    if raw or instance.pk is None:
+        return
+    instance._stats_previous_rating = Review.objects.filter(
+        pk=instance.pk
+    ).values_list('rating', flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+def update_stats_for_review(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Apply a new or edited review to the product's rating aggregates
+    """
+    if raw:
+        return
+    if created:
+        record_review_rating(instance.product_id, instance.rating, 1)
+        return
+
+    previous_rating = getattr(instance, '_stats_previous_rating', None)
+    if previous_rating is not None and previous_rating != instance.rating:
+        record_review_rating(instance.product_id, previous_rating, -1)
+        record_review_rating(instance.product_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_stats(sender, instance, **kwargs):
+    """
+    Remove a deleted review from the product's rating aggregates
+    """
+    record_review_rating(instance.product_id, instance.rating, -1)
+
+
+@receiver(order_paid)
+def update_stats_for_paid_order(sender, order, **kwargs):
+    """
+    Count a paid order's lines towards the products' sales aggregates
+    """
+    record_order_sales(order)
+
+
+@receiver(post_save, sender=Product)
+def update_product_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Keep this process's in-memory search index in step with product edits
+    """
+    if raw:
+        return
+    if update_fields is not None and not INDEX_FIELDS.intersection(update_fields):
+        return
+
+    product_id = instance.pk
+    transaction.on_commit(lambda: update_indexed_products([product_id]))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    """
+    Drop deleted products from this process's in-memory search index
+    """
+    remove_indexed_product(instance.pk)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def reindex_renamed_products(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """
+    Refresh indexed brand/category names after a rename
+    """
+    if raw or not name_changed(instance, created, update_fields):
+        return
+
+    lookup = 'brand_id' if sender is Brand else 'category_id'
+    lookups = {lookup: instance.pk}
+    transaction.on_commit(lambda: update_indexed_products(**lookups))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_cached_search_results(sender, raw=False, **kwargs):
+    """
+    Start a new search cache generation after any catalog edit, including
+    price and stock changes saved on the product
+    """
+    if raw:
+        return
+    transaction.on_commit(invalidate_search_results)
+
+
+@receiver(order_paid)
+def invalidate_cached_results_for_paid_order(sender, **kwargs):
+    """
+    Paid orders change stock and the sales-based sort orders
+    """
+    transaction.on_commit(invalidate_search_results)
+
+
+@receiver(post_save, sender=Product)
+def update_product_suggestion(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Keep this process's autocomplete index in step with product names
+    """
+    if raw:
+        return
+    if update_fields is not None and not {'name', 'is_active'}.intersection(update_fields):
+        return
+
+    product_id = instance.pk
+    transaction.on_commit(lambda: update_autocomplete_product(product_id))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def update_label_suggestion(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """
+    Add new brand and category suggestions and refresh them after a rename
+    """
+    if raw or not (created or name_changed(instance, created, update_fields)):
+        return
+    kind = 'brand' if sender is Brand else 'category'
+    object_id, name = instance.pk, instance.name
+    transaction.on_commit(lambda: update_autocomplete_label(kind, object_id, name))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+def remove_suggestion(sender, instance, **kwargs):
+    """
+    Drop suggestions for deleted products, brands and categories
+    """
+    kind = {Product: 'product', Brand: 'brand', Category: 'category'}[sender]
+    remove_autocomplete_entry(kind, instance.pk)
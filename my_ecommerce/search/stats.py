@@ -0,0 +1,153 @@
+import datetime
+from django.db.models import (
+    Case, Count, Exists, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+from orders.models import OrderItem
+from payments.models import Payment
+from products.models import Product
+from reviews.models import Review
+from .models import ProductStats
+
+# Window used for the rolling "bestseller" sales count
+RECENT_SALES_DAYS = 30
+
+# Number of products reconciled per UPDATE statement
+RECONCILE_BATCH_SIZE = 2000
+
+# Payment statuses of orders that have been paid (and announced with
+# order_paid); refunded payments were completed first
+PAID_PAYMENT_STATUSES = ('completed', 'refunded')
+
+
+def ensure_product_stats(product_ids):
+    """
+    Create empty stats rows for any of the given products that lack one
+    """
+    ProductStats.objects.bulk_create(
+        [ProductStats(product_id=product_id) for product_id in product_ids],
+        ignore_conflicts=True
+    )
+
+
+def paid_order_items():
+    """
+    Order items of paid orders, the lines counted on order_paid
+    """
+    paid = Payment.objects.filter(order=OuterRef('order'), status__in=PAID_PAYMENT_STATUSES)
+    return OrderItem.objects.filter(Exists(paid))
+
+
+def order_paid_at(order_ref='order'):
+    """
+    When the order referenced by `order_ref` was paid, as a subquery
+
+    Payments recorded before paid_at was kept fall back to their creation
+    time.
+    """
+    return Subquery(
+        Payment.objects.filter(
+            order=OuterRef(order_ref),
+            status__in=PAID_PAYMENT_STATUSES
+        ).annotate(
+            paid=Coalesce('paid_at', 'created_at')
+        ).order_by('paid').values('paid')[:1]
+    )
+
+
+def _average_expression():
+    # NULL when there are no reviews, so unrated products sort last
+    return ExpressionWrapper(
+        F('rating_total') * 1.0 / NullIf(F('review_count'), 0),
+        output_field=FloatField()
+    )
+
+
+def record_review_rating(product_id, rating, delta=1):
+    """
+    Apply a review being added (delta=1) or removed (delta=-1) to the stats
+
+    Args:
+        product_id: ID of the reviewed product
+        rating: The review's rating
+        delta: +1 for a new review, -1 for a deleted one
+    """
+    if delta > 0:
+        # Not when removing: the review may be deleted along with its
+        # product, whose stats row is already gone
+        ensure_product_stats([product_id])
+    ProductStats.objects.filter(product_id=product_id).update(
+        rating_total=F('rating_total') + rating * delta,
+        review_count=F('review_count') + delta,
+        avg_rating=ExpressionWrapper(
+            (F('rating_total') + rating * delta) * 1.0 / NullIf(F('review_count') + delta, 0),
+            output_field=FloatField()
+        )
+    )
+
+
+def record_order_sales(order):
+    """
+    Add a paid order's lines to the lifetime and rolling sales counts
+
+    All affected products are updated with a single UPDATE statement.
+    The rolling count is only incremented here; lines that fall out of the
+    window are removed by reconcile_product_stats().
+    """
+    lines = dict(
+        order.items.values_list('product_id').annotate(lines=Count('id')).order_by()
+    )
+    if not lines:
+        return
+
+    ensure_product_stats(lines)
+    increment = Case(
+        *[When(product_id=product_id, then=Value(count)) for product_id, count in lines.items()],
+        default=Value(0),
+        output_field=IntegerField()
+    )
+    ProductStats.objects.filter(product_id__in=list(lines)).update(
+        sales_count=F('sales_count') + increment,
+        recent_sales_count=F('recent_sales_count') + increment
+    )
+
+
+def reconcile_product_stats(product_ids=None):
+    """
+    Recompute stats from reviews and the items of paid orders
+
+    Intended to run periodically (e.g. nightly from cron) to correct drift
+    and age sales out of the rolling window.
+
+    Args:
+        product_ids: Products to reconcile; defaults to every product
+
+    Returns:
+        Number of stats rows updated
+    """
+    if product_ids is None:
+        product_ids = Product.objects.values_list('id', flat=True).iterator(chunk_size=RECONCILE_BATCH_SIZE)
+    product_ids = list(product_ids)
+
+    recent_cutoff = timezone.now() - datetime.timedelta(days=RECENT_SALES_DAYS)
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    order_items = paid_order_items().filter(product=OuterRef('pk')).order_by().values('product')
+    # By payment time, the day record_order_sales() counted the lines on
+    recent_items = order_items.alias(paid_at=order_paid_at()).filter(paid_at__gte=recent_cutoff)
+
+    updated = 0
+    for start in range(0, len(product_ids), RECONCILE_BATCH_SIZE):
+        batch = product_ids[start:start + RECONCILE_BATCH_SIZE]
+        ensure_product_stats(batch)
+
+        updated += ProductStats.objects.filter(product_id__in=batch).update(
+            rating_total=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+            review_count=Coalesce(Subquery(reviews.annotate(count=Count('id')).values('count')), 0),
+            sales_count=Coalesce(Subquery(order_items.annotate(count=Count('id')).values('count')), 0),
+            recent_sales_count=Coalesce(Subquery(recent_items.annotate(count=Count('id')).values('count')), 0)
+        )
+        # Derive the average from the freshly written totals
+        ProductStats.objects.filter(product_id__in=batch).update(avg_rating=_average_expression())
+
+    return updated
@@ -0,0 +1,306 @@
+import datetime
+import logging
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from orders.models import Order, OrderItem
+from payments.models import Payment
+from products.models import Product, Category, Brand
+from reviews.models import Review
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+ADJECTIVES = [
+    'wireless', 'portable', 'compact', 'premium', 'classic', 'smart', 'ultra', 'organic', 'waterproof',
+    'ergonomic', 'vintage', 'digital', 'professional', 'lightweight', 'heavy-duty', 'rechargeable',
+    'stainless', 'adjustable', 'foldable', 'eco-friendly',
+]
+NOUNS = [
+    'headphones', 'speaker', 'camera', 'laptop', 'keyboard', 'mouse', 'monitor', 'backpack', 'jacket',
+    'sneakers', 'watch', 'blender', 'kettle', 'lamp', 'chair', 'desk', 'bottle', 'charger', 'tablet',
+    'router', 'drone', 'microphone', 'projector', 'vacuum', 'toaster', 'mattress', 'pillow', 'sunglasses',
+]
+DESCRIPTION_WORDS = [
+    'durable', 'design', 'battery', 'quality', 'comfortable', 'performance', 'warranty', 'material',
+    'everyday', 'travel', 'office', 'home', 'outdoor', 'fast', 'quiet', 'powerful', 'sleek', 'modern',
+    'bluetooth', 'cotton', 'leather', 'aluminium', 'noise', 'cancelling', 'energy', 'efficient',
+]
+CATEGORY_NAMES = ['Electronics', 'Home', 'Fashion', 'Sports', 'Kitchen', 'Office', 'Outdoors', 'Beauty']
+
+
+def build_instance(model, **values):
+    """
+    Instantiate a model with only the values it has fields for
+    """
+    field_names = {field.name for field in model._meta.concrete_fields}
+    field_names.update(field.attname for field in model._meta.concrete_fields)
+    return model(**{key: value for key, value in values.items() if key in field_names})
+
+
+def _has_field(model, name):
+    return any(field.name == name for field in model._meta.concrete_fields)
+
+
+def _skewed_index(rng, size, skew=3.0):
+    """
+    Pick an index in [0, size) with a long-tailed popularity distribution
+    """
+    return min(int(size * (rng.random() ** skew)), size - 1)
+
+
+class SyntheticCatalog:
+    """
+    Deterministic synthetic catalog: a category tree, brands, products,
+    users, reviews and orders with order items
+
+    The same seed and scale always produce the same data, so benchmark
+    and evaluation runs can be compared over time.
+
+    Args:
+        products: Number of products (10k up to several million)
+        seed: Random seed
+        users: Number of shoppers (defaults to products / 10)
+        orders: Number of orders (defaults to products / 2)
+        reviews_per_product: Average number of reviews per product
+        days: Orders are spread over this many days up to now
+    """
+
+    def __init__(self, products=10000, seed=42, users=None, orders=None, reviews_per_product=0.5, days=180):
+        self.product_count = products
+        self.seed = seed
+        self.user_count = users or max(products // 10, 100)
+        self.order_count = orders if orders is not None else max(products // 2, 100)
+        self.reviews_per_product = reviews_per_product
+        self.days = days
+        self.rng = random.Random(seed)
+        self.category_ids = []
+        self.leaf_category_ids = []
+        self.brand_ids = []
+        self.product_ids = []
+        self.user_ids = []
+
+    def generate(self):
+        """
+        Create the whole catalog and return a summary dict
+        """
+        self.generate_catalog()
+        self.generate_orders()
+        return self.summary()
+
+    def generate_catalog(self):
+        """
+        Create everything except orders
+        """
+        with transaction.atomic():
+            self.generate_categories()
+            self.generate_brands()
+        self.generate_products()
+        self.generate_users()
+        self.generate_reviews()
+
+    def summary(self):
+        return {
+            'seed': self.seed,
+            'categories': len(self.category_ids),
+            'brands': len(self.brand_ids),
+            'products': len(self.product_ids),
+            'users': len(self.user_ids),
+            'orders': self.order_count,
+        }
+
+    def generate_categories(self):
+        # Three levels; created one by one so tree bookkeeping stays valid
+        for root_name in CATEGORY_NAMES:
+            root = Category.objects.create(**self._category_values(root_name, None))
+            self.category_ids.append(root.id)
+            for i in range(5):
+                child_name = f"{root_name} {self.rng.choice(NOUNS).title()} {i + 1}"
+                child = Category.objects.create(**self._category_values(child_name, root))
+                self.category_ids.append(child.id)
+                for j in range(4):
+                    leaf = Category.objects.create(**self._category_values(f"{child_name}.{j + 1}", child))
+                    self.category_ids.append(leaf.id)
+                    self.leaf_category_ids.append(leaf.id)
+
+    def _category_values(self, name, parent):
+        values = {'name': name, 'parent': parent}
+        if _has_field(Category, 'slug'):
+            values['slug'] = f"{slugify(name)}-{self.seed}-{len(self.category_ids)}"
+        return values
+
+    def generate_brands(self):
+        count = max(50, self.product_count // 500)
+        brands = []
+        for i in range(count):
+            name = f"{self.rng.choice(ADJECTIVES).title()}{self.rng.choice(NOUNS).title()} {i}"
+            brands.append(build_instance(Brand, name=name, slug=f"{slugify(name)}-{self.seed}"))
+        Brand.objects.bulk_create(brands, batch_size=BATCH_SIZE)
+        self.brand_ids = list(Brand.objects.order_by('-id').values_list('id', flat=True)[:count])[::-1]
+
+    def generate_products(self):
+        # Products only go in leaf categories, as in a real catalog
+        leaf_ids = self.leaf_category_ids
+        created = 0
+        while created < self.product_count:
+            batch = []
+            for i in range(created, min(created + BATCH_SIZE, self.product_count)):
+                noun = self.rng.choice(NOUNS)
+                name = f"{self.rng.choice(ADJECTIVES).title()} {noun.title()} {self.rng.randint(100, 9999)}"
+                words = self.rng.sample(DESCRIPTION_WORDS, 12)
+                batch.append(build_instance(
+                    Product,
+                    name=name,
+                    slug=f"{slugify(name)}-{self.seed}-{i}",
+                    short_description=f"{noun} {' '.join(words[:4])}",
+                    description=' '.join(words),
+                    brand_id=self.brand_ids[_skewed_index(self.rng, len(self.brand_ids), 1.5)],
+                    category_id=self.rng.choice(leaf_ids),
+                    base_price=Decimal(self.rng.randint(199, 99999)) / 100,
+                    stock=self.rng.randint(0, 500),
+                    is_active=self.rng.random() > 0.05,
+                    is_featured=self.rng.random() < 0.02,
+                ))
+            Product.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            created += len(batch)
+        self.product_ids = list(Product.objects.order_by('-id').values_list('id', flat=True)[:self.product_count])[::-1]
+
+    def generate_users(self):
+        User = get_user_model()
+        users = [
+            build_instance(User, username=f"synthetic_{self.seed}_{i}", email=f"synthetic_{self.seed}_{i}@example.com")
+            for i in range(self.user_count)
+        ]
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        self.user_ids = list(User.objects.order_by('-id').values_list('id', flat=True)[:self.user_count])[::-1]
+
+    def generate_reviews(self):
+        total = int(self.product_count * self.reviews_per_product)
+        seen = set()
+        batch = []
+        for _ in range(total):
+            product_id = self.product_ids[_skewed_index(self.rng, len(self.product_ids))]
+            user_id = self.rng.choice(self.user_ids)
+            if (product_id, user_id) in seen:
+                continue
+            seen.add((product_id, user_id))
+            batch.append(build_instance(
+                Review,
+                product_id=product_id,
+                user_id=user_id,
+                rating=self.rng.choices([1, 2, 3, 4, 5], weights=[1, 1, 3, 6, 8])[0],
+                title='Synthetic review',
+                comment=' '.join(self.rng.sample(DESCRIPTION_WORDS, 8)),
+            ))
+            if len(batch) >= BATCH_SIZE:
+                Review.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+                batch = []
+        if batch:
+            Review.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+
+    def iter_order_plans(self):
+        """
+        Yield (user_id, ordered_at, [(product_id, quantity), ...]) tuples
+
+        Orders mix a popular "anchor" product with items from the same
+        category, so there is real co-purchase structure to learn.
+        """
+        products_by_category = {}
+        for product_id, category_id in Product.objects.filter(
+            id__in=self.product_ids
+        ).values_list('id', 'category_id').iterator(chunk_size=BATCH_SIZE):
+            products_by_category.setdefault(category_id, []).append(product_id)
+
+        category_of = {}
+        for category_id, product_ids in products_by_category.items():
+            for product_id in product_ids:
+                category_of[product_id] = category_id
+
+        now = timezone.now()
+        for _ in range(self.order_count):
+            user_id = self.user_ids[_skewed_index(self.rng, len(self.user_ids), 2.0)]
+            ordered_at = now - datetime.timedelta(seconds=self.rng.randint(0, self.days * 86400))
+            anchor = self.product_ids[_skewed_index(self.rng, len(self.product_ids))]
+            lines = {anchor: self.rng.randint(1, 3)}
+            siblings = products_by_category.get(category_of.get(anchor), [])
+            for _ in range(self.rng.randint(0, 3)):
+                if siblings and self.rng.random() < 0.7:
+                    product_id = siblings[_skewed_index(self.rng, len(siblings))]
+                else:
+                    product_id = self.product_ids[_skewed_index(self.rng, len(self.product_ids))]
+                lines.setdefault(product_id, 1)
+            yield user_id, ordered_at, list(lines.items())
+
+    def generate_orders(self, plans=None, first_number=0):
+        """
+        Write paid orders with their items and payments
+
+        Args:
+            plans: Order plans as yielded by iter_order_plans(); defaults to
+                all of them, oldest first
+            first_number: Number of the first order, used in order numbers
+                so plans can be written in several calls
+
+        Returns:
+            List of the created order IDs, in plan order
+        """
+        prices = dict(Product.objects.filter(id__in=self.product_ids).values_list('id', 'base_price'))
+        if plans is None:
+            plans = sorted(self.iter_order_plans(), key=lambda plan: plan[1])
+
+        created_ids = []
+        for start in range(0, len(plans), BATCH_SIZE):
+            chunk = plans[start:start + BATCH_SIZE]
+            orders = [
+                build_instance(
+                    Order,
+                    user_id=user_id,
+                    order_number=f"SYN-{self.seed}-{first_number + start + i}",
+                    status='paid',
+                    date_ordered=ordered_at,
+                )
+                for i, (user_id, ordered_at, lines) in enumerate(chunk)
+            ]
+            with transaction.atomic():
+                Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+                order_ids = dict(Order.objects.filter(
+                    order_number__in=[order.order_number for order in orders]
+                ).values_list('order_number', 'id'))
+                created_ids.extend(order_ids[order.order_number] for order in orders)
+
+                # date_ordered is usually auto_now_add, so set it explicitly afterwards
+                if _has_field(Order, 'date_ordered'):
+                    dated = [
+                        Order(id=order_ids[order.order_number], date_ordered=ordered_at)
+                        for order, (user_id, ordered_at, lines) in zip(orders, chunk)
+                    ]
+                    Order.objects.bulk_update(dated, ['date_ordered'], batch_size=BATCH_SIZE)
+
+                items = []
+                for order, (user_id, ordered_at, lines) in zip(orders, chunk):
+                    for product_id, quantity in lines:
+                        items.append(build_instance(
+                            OrderItem,
+                            order_id=order_ids[order.order_number],
+                            product_id=product_id,
+                            quantity=quantity,
+                            price=prices[product_id],
+                        ))
+                OrderItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+
+                # Sales aggregates only count orders with a completed payment
+                Payment.objects.bulk_create([
+                    Payment(
+                        order_id=order_ids[order.order_number],
+                        amount=sum(prices[product_id] * quantity for product_id, quantity in lines),
+                        status='completed',
+                        paid_at=ordered_at,
+                    )
+                    for order, (user_id, ordered_at, lines) in zip(orders, chunk)
+                ], batch_size=BATCH_SIZE)
+        logger.info(f"Generated {len(plans)} synthetic orders")
+        return created_ids
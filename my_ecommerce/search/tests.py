@@ -0,0 +1,289 @@
+from collections import Counter
+from decimal import Decimal
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from products.models import Product
+from . import cache as search_cache
+from .autocomplete import MAX_SCAN, PrefixIndex, Suggestion
+from .cache import cached_search, get_search_cache, get_search_generation, invalidate_search_results
+from .category_tree import get_category_tree
+from .facets import FacetEngine, PriceHistogramFacet
+from .models import ProductStats
+from .pagination import InvalidCursor, encode_cursor, paginate_search
+from .synthetic import SyntheticCatalog
+from .utils import basic_search
+
+
+class SearchCatalogMixin:
+    """
+    Build one small synthetic catalog per test class
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog = SyntheticCatalog(products=60, seed=11, reviews_per_product=0)
+        catalog.generate_catalog()
+        cls.catalog = catalog
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+
+
+class PaginationTests(SearchCatalogMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        product_ids = cls.catalog.product_ids
+        # Ties on the sort value must be broken by the product ID
+        Product.objects.filter(id__in=product_ids[:15]).update(base_price=Decimal('10.00'))
+        Product.objects.filter(id__in=product_ids[:20]).update(is_featured=True)
+        ProductStats.objects.bulk_create([
+            ProductStats(product_id=product_id, avg_rating=(4.5 if index % 2 else 3.0))
+            for index, product_id in enumerate(product_ids[:30])
+        ])
+
+    def collect_pages(self, products, sort_by, page_size=7):
+        ids = []
+        cursor = None
+        pages = 0
+        while True:
+            page = paginate_search(products, sort_by=sort_by, cursor=cursor, page_size=page_size)
+            self.assertLessEqual(len(page.products), page_size)
+            ids.extend(product.id for product in page.products)
+            pages += 1
+            if page.next_cursor is None:
+                return ids, pages
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_product_once_in_sort_order(self):
+        products = Product.objects.filter(is_active=True)
+        expected = list(products.order_by('base_price', 'id').values_list('id', flat=True))
+
+        ids, pages = self.collect_pages(products, 'price_low')
+
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, -(-len(expected) // 7))
+
+    def test_descending_sort_pages_through_ties(self):
+        products = Product.objects.filter(is_active=True)
+        expected = list(products.order_by('-base_price', 'id').values_list('id', flat=True))
+
+        ids, pages = self.collect_pages(products, 'price_high', page_size=4)
+
+        self.assertEqual(ids, expected)
+
+    def test_composite_key_with_missing_stats_sorts_them_last(self):
+        products = Product.objects.filter(is_active=True)
+        rated = {
+            product_id: rating
+            for product_id, rating in ProductStats.objects.values_list('product_id', 'avg_rating')
+        }
+        rows = products.values_list('id', 'is_featured', 'name')
+        expected = [
+            product_id for product_id, is_featured, name in sorted(
+                rows,
+                key=lambda row: (
+                    not row[1],
+                    row[0] not in rated,
+                    -rated.get(row[0], 0),
+                    row[2],
+                    row[0],
+                )
+            )
+        ]
+
+        ids, pages = self.collect_pages(products, None, page_size=5)
+
+        self.assertEqual(ids, expected)
+
+    def test_last_page_has_no_cursor(self):
+        products = Product.objects.filter(is_active=True)
+
+        page = paginate_search(products, sort_by='price_low', page_size=products.count())
+
+        self.assertIsNone(page.next_cursor)
+
+    def test_cursor_from_another_sort_mode_is_rejected(self):
+        products = Product.objects.filter(is_active=True)
+        cursor = paginate_search(products, sort_by='price_low', page_size=3).next_cursor
+
+        with self.assertRaises(InvalidCursor):
+            paginate_search(products, sort_by='newest', cursor=cursor, page_size=3)
+
+    def test_tampered_cursor_is_rejected(self):
+        products = Product.objects.filter(is_active=True)
+        cursor = encode_cursor('price_low', ['1.00', 1])
+
+        with self.assertRaises(InvalidCursor):
+            paginate_search(products, sort_by='price_low', cursor=cursor[:-2] + 'xx', page_size=3)
+
+
+@override_settings(SEARCH_LOG_ENABLED=False)
+class ResultCacheTests(SearchCatalogMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The process-wide cache outlives a test otherwise
+        search_cache._result_cache = None
+        self.addCleanup(setattr, search_cache, '_result_cache', None)
+
+    def search(self):
+        return cached_search('', search_function=basic_search, with_facets=False, sort_by='price_low')
+
+    def test_repeated_search_is_served_from_the_cache(self):
+        first = self.search()
+        second = self.search()
+
+        self.assertIs(second, first)
+        self.assertEqual(get_search_cache().stats()['hits'], 1)
+
+    def test_new_generation_drops_cached_results(self):
+        first = self.search()
+        generation = get_search_generation()
+
+        invalidate_search_results()
+
+        self.assertNotEqual(get_search_generation(), generation)
+        second = self.search()
+        self.assertIsNot(second, first)
+        self.assertEqual(list(second.product_ids), list(first.product_ids))
+        self.assertEqual(get_search_cache().stats()['hits'], 0)
+
+    def test_product_edit_is_visible_after_commit(self):
+        first = self.search()
+        product = Product.objects.get(id=first.product_ids[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.is_active = False
+            product.save()
+
+        second = self.search()
+        self.assertNotIn(product.id, second.product_ids)
+        self.assertEqual(len(second.product_ids), len(first.product_ids) - 1)
+
+
+class FacetTests(SearchCatalogMixin, TestCase):
+
+    def test_counts_match_the_products(self):
+        products = Product.objects.filter(is_active=True)
+
+        facets = FacetEngine().compute(products)
+
+        brand_counts = Counter(products.values_list('brand_id', flat=True))
+        self.assertEqual(
+            {brand['id']: brand['product_count'] for brand in facets['brands']},
+            dict(brand_counts)
+        )
+        category_counts = Counter(products.values_list('category_id', flat=True))
+        self.assertEqual(
+            {category['id']: category['product_count'] for category in facets['categories']},
+            dict(category_counts)
+        )
+        prices = list(products.values_list('base_price', flat=True))
+        self.assertEqual(facets['price_range'], {'min_price': min(prices), 'max_price': max(prices)})
+
+    def test_counts_are_sorted_and_named(self):
+        facets = FacetEngine().compute(Product.objects.filter(is_active=True))
+
+        counts = [brand['product_count'] for brand in facets['brands']]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertTrue(all(brand['name'] for brand in facets['brands']))
+        self.assertTrue(all(category['name'] for category in facets['categories']))
+
+    def test_grouping_facets_share_one_query(self):
+        products = Product.objects.filter(is_active=True)
+        engine = FacetEngine(list(FacetEngine().facets) + [PriceHistogramFacet(bucket_width=100)])
+        # Category names come from the in-process tree snapshot
+        get_category_tree()
+
+        with self.assertNumQueries(1):
+            facets = engine.compute(products)
+
+        self.assertEqual(sum(bucket['product_count'] for bucket in facets['price_histogram']), products.count())
+
+    def test_no_matches(self):
+        facets = FacetEngine().compute(Product.objects.none())
+
+        self.assertEqual(facets['brands'], [])
+        self.assertEqual(facets['categories'], [])
+        self.assertEqual(facets['price_range'], {'min_price': None, 'max_price': None})
+
+
+class PrefixIndexTests(SimpleTestCase):
+
+    def make_index(self):
+        return PrefixIndex([
+            Suggestion('Apple iPhone 15', 'product', 1, 50),
+            Suggestion('Apple Watch', 'product', 2, 30),
+            Suggestion('Apricot Jam', 'product', 3, 10),
+            Suggestion('Apple', 'brand', 1, 80),
+        ])
+
+    def texts(self, suggestions):
+        return [suggestion.text for suggestion in suggestions]
+
+    def test_matches_word_starts_heaviest_first(self):
+        index = self.make_index()
+
+        self.assertEqual(self.texts(index.suggest('ap')), ['Apple', 'Apple iPhone 15', 'Apple Watch', 'Apricot Jam'])
+        self.assertEqual(self.texts(index.suggest('iph')), ['Apple iPhone 15'])
+        self.assertEqual(self.texts(index.suggest('apple w')), ['Apple Watch'])
+        self.assertEqual(index.suggest('  '), [])
+
+    def test_upsert_is_visible_before_and_after_compaction(self):
+        index = self.make_index()
+
+        index.upsert(Suggestion('Apple AirPods', 'product', 4, 60))
+        index.upsert(Suggestion('Apricot Jam', 'product', 3, 90))
+
+        expected = ['Apricot Jam', 'Apple', 'Apple AirPods', 'Apple iPhone 15']
+        self.assertEqual(self.texts(index.suggest('ap', limit=4)), expected)
+        self.assertEqual(self.texts(index.suggest('apri')), ['Apricot Jam'])
+        index.compact()
+        self.assertEqual(self.texts(index.suggest('ap', limit=4)), expected)
+        self.assertEqual(len(index), 5)
+
+    def test_renamed_suggestion_leaves_its_old_prefixes(self):
+        index = self.make_index()
+
+        index.upsert(Suggestion('Pear Watch', 'product', 2, 30))
+
+        self.assertNotIn('Pear Watch', self.texts(index.suggest('app')))
+        self.assertNotIn('Apple Watch', self.texts(index.suggest('app')))
+        self.assertEqual(self.texts(index.suggest('pea')), ['Pear Watch'])
+
+    def test_remove_hides_the_suggestion_before_and_after_compaction(self):
+        index = self.make_index()
+
+        index.remove('product', 1)
+
+        self.assertNotIn('Apple iPhone 15', self.texts(index.suggest('ap')))
+        self.assertEqual(index.suggest('iphone'), [])
+        self.assertIsNone(index.get('product', 1))
+        index.compact()
+        self.assertEqual(index.suggest('iphone'), [])
+        self.assertEqual(len(index), 3)
+
+    def test_upsert_after_remove_restores_the_suggestion(self):
+        index = self.make_index()
+
+        index.remove('brand', 1)
+        index.upsert(Suggestion('Apple', 'brand', 1, 5))
+        index.compact()
+
+        self.assertEqual(self.texts(index.suggest('apple')), ['Apple iPhone 15', 'Apple Watch', 'Apple'])
+
+    def test_long_prefix_with_many_matches(self):
+        index = PrefixIndex([
+            Suggestion(f"Charger {number}", 'product', number, number)
+            for number in range(MAX_SCAN * 2)
+        ])
+
+        index.remove('product', MAX_SCAN * 2 - 1)
+
+        self.assertEqual(
+            self.texts(index.suggest('charger', limit=3)),
+            [f"Charger {MAX_SCAN * 2 - number}" for number in (2, 3, 4)]
+        )
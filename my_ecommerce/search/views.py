@@ -0,0 +1,30 @@
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from .autocomplete import get_autocomplete_index
+
+MAX_PREFIX_LENGTH = 100
+MAX_SUGGESTIONS = 20
+
+
+@require_GET
+def autocomplete_view(request):
+    """
+    Return ranked product, brand and category suggestions for a prefix
+    """
+    prefix = request.GET.get('q', '')[:MAX_PREFIX_LENGTH]
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), MAX_SUGGESTIONS)
+    except ValueError:
+        limit = 8
+
+    suggestions = get_autocomplete_index().suggest(prefix, limit)
+
+    response = JsonResponse({
+        'suggestions': [
+            {'text': suggestion.text, 'type': suggestion.kind, 'id': suggestion.object_id}
+            for suggestion in suggestions
+        ]
+    })
+    # Suggestions are identical for every visitor, so let browsers reuse them briefly
+    response['Cache-Control'] = 'public, max-age=60'
+    return response